@@ -55,6 +55,7 @@ class ItselfBootstrapper:
 		self.reloadPip()
 
 		reload(self.install)
+		self.install.getInstalledDistributionsIndex().invalidate()  # the scheme may have changed with the new `pip`
 		self.initInstallTools()
 		if pipelines:
 			self.reloadPipelines()
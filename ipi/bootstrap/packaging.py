@@ -8,8 +8,10 @@ from tempfile import TemporaryDirectory
 from ..defaultPetnames import builtInRegistries
 from ..deps.git import fetchUsingGit
 from ..pipelines import buildAndInstallWheel, clonePackagesRepos
+from ..resolver import deepenPackagesHistories
 from ..tools.install import setupPyInstall
 from ..tools.setup_py import eggInfoCmd
+from ..utils.FetchScheduler import getDefaultFetchScheduler
 from ..utils.WithInBandBorders import GitHubActionsGroup
 from ..utils.WithPythonPath import cookPythonPathEnvDict
 from .utils import bootstrapBySequence, unload
@@ -24,6 +26,18 @@ def bootstrapPythonPackaging():
 		bootstrapHatchling(tempDir)
 
 
+def clonePackagesReposUpToTags(targetDir: Path, names: typing.Iterable[str]) -> typing.Dict[str, Path]:
+	"""Packages are fetched at depth 1. Their metadata cannot be extracted yet to tell which of them compute versions from tags, so the histories of all of them are deepened up to the nearest tag."""
+
+	names = list(names)
+	directURLs = {}
+	repoDirs = {}
+	clonedDirs, ignores = clonePackagesRepos(targetDir, names, builtInRegistries, directURLs=directURLs, repoDirs=repoDirs)
+	assert not ignores, ignores
+	deepenPackagesHistories(repoDirs, names, builtInRegistries, directURLs)
+	return clonedDirs
+
+
 essentialPackages = {
 	"setuptools": 50,
 	"wheel": 50,
@@ -32,8 +46,7 @@ essentialPackages = {
 
 def cloneSetuptoolsAndWheel(targetDir: Path):
 	with GitHubActionsGroup("Bootstrapping packaging: Cloning essential packages: " + ", ".join(essentialPackages)):
-		clonedDirs, ignores = clonePackagesRepos(targetDir, essentialPackages, builtInRegistries)
-		assert not ignores, ignores
+		clonedDirs = clonePackagesReposUpToTags(targetDir, essentialPackages)
 	return clonedDirs["setuptools"], clonedDirs["wheel"]
 
 
@@ -76,7 +89,8 @@ def roughWheel(targetDir: Path, setuptoolsDir: Path):
 
 def installPip(targetDir: Path, setuptoolsDir: Path):
 	with GitHubActionsGroup("Bootstrapping packaging: Install pip"):
-		fetchUsingGit(builtInRegistries.lookup("pip").pkg.fetcher.repo, targetDir)
+		pipRepo = builtInRegistries.lookup("pip").pkg.fetcher.repo
+		getDefaultFetchScheduler()(pipRepo, fetchUsingGit, pipRepo, targetDir)
 
 		buildAndInstallWheel(targetDir, buildPythonPath=(setuptoolsDir,), installPythonPath=(targetDir / "src",), _useSetupPy=True)
 		# sudo chown -R `id -un`:`id -gn` .;
@@ -99,8 +113,7 @@ def installSetuptools(targetDir: Path):
 
 def bootstrapBySchedule(tempDir: Path, schedule):
 	with GitHubActionsGroup("Cloning the rest of packages: " + ", ".join(schedule)):
-		clonedDirs, ignores = clonePackagesRepos(tempDir, schedule, builtInRegistries)
-		assert not ignores, ignores
+		clonedDirs = clonePackagesReposUpToTags(tempDir, schedule)
 
 	bootstrapBySequence(clonedDirs, schedule.items())
 
@@ -110,8 +123,7 @@ restOfEssentialPackages = ("tomli", "pyparsing", "flit_core", "pyproject-hooks",
 
 def bootstrapTheRestPackagingEcosystem(tempDir: Path):
 	with GitHubActionsGroup("Cloning the rest of packages: " + ", ".join(restOfEssentialPackages)):
-		clonedDirs, ignores = clonePackagesRepos(tempDir, restOfEssentialPackages, builtInRegistries)
-		assert not ignores, ignores
+		clonedDirs = clonePackagesReposUpToTags(tempDir, restOfEssentialPackages)
 
 	pphDir = clonedDirs["pyproject-hooks"] / "src"
 
@@ -1,16 +1,37 @@
 import argparse
+from pathlib import Path
 
 from ..bootstrap.tiers import BootstrapTier
 
 __all__ = ("main", "tier")
 
 cli = argparse.ArgumentParser(description="A basic CLI. `bootstrap self` to get `ipi` fully functional.")
+cli.add_argument("--proxy", default=None, help="Proxy used for all the network operations")
+cli.add_argument("--retries", type=int, default=None, help="Count of retries of a network operation failed transiently")
+cli.add_argument("--refresh", action="store_true", help="Retry the lookups and the builds which have failed recently with the same inputs")
 sp = cli.add_subparsers(dest="cmd")
 
 instl = sp.add_parser("install", description="Installs packages.")
-instl.add_argument("packages", nargs="+")
+instl.add_argument("packages", nargs="*")
 instl.add_argument("--upgrade", action="store_true", help="Upgrade all installed packages")
 instl.add_argument("--force-reinstall", action="store_true", help="Always rebuild and reinstall")
+instl.add_argument("-j", "--jobs", type=int, default=None, help="Count of packages fetched concurrently")
+instl.add_argument("-b", "--build-jobs", type=int, default=None, help="Count of packages built concurrently, the count of CPUs by default")
+instl.add_argument("--from-lock", type=Path, default=None, help="Install exactly the revisions recorded into a lockfile by `lock`, without resolving")
+instl.add_argument("--prefetch-hints", type=Path, default=None, help="A lockfile of an earlier resolution, the deps recorded in it are prefetched while their dependents are being fetched")
+instl.add_argument("--dry-run", action="store_true", help="Only print what would be fetched, built and skipped, without building and installing anything")
+instl.add_argument("--resume", action="store_true", help="Continue the unfinished installation from the last stage each package has completed, without resolving again")
+instl.add_argument("--resumable", action="store_true", help="Save the progress of the installation, so a failed one can be continued with `--resume`. It is saved within the state dir of `ipi`, separately for each environment installed into.")
+instl.add_argument("--session-dir", type=Path, default=None, help="Save the progress of the installation into this dir instead, implies `--resumable`")
+instl.add_argument("--discard-session", action="store_true", help="Start over, discarding the unfinished resumable installation")
+
+lck = sp.add_parser("lock", description="Resolves packages and records the exact revisions into a lockfile without installing them.")
+lck.add_argument("packages", nargs="+")
+lck.add_argument("-o", "--output", type=Path, default=Path("ipi.lock.json"), help="Path of the lockfile")
+lck.add_argument("--upgrade", action="store_true", help=instl._option_string_actions["--upgrade"].help)
+lck.add_argument("--force-reinstall", action="store_true", help="Lock all the packages, even the ones which suitable versions are already installed")
+lck.add_argument("-j", "--jobs", type=int, default=None, help=instl._option_string_actions["--jobs"].help)
+lck.add_argument("--python", default=None, help="The interpreter the packages are locked for, the environment markers of the deps are evaluated for it. The current one if not set.")
 
 boo = sp.add_parser("bootstrap", description="Bootstraps the stuff.")
 
@@ -26,21 +47,111 @@ def indexArgparseParserOpts(parserCls):
 
 
 instlIndex = indexArgparseParserOpts(instl)
+lckIndex = indexArgparseParserOpts(lck)
 
 
-def _installImpl(packageNames, upgrade, forceReinstall):
+def _installImpl(packageNames, upgrade, forceReinstall, jobs=None, fromLock=None, dryRun=False, prefetchHints=None, resume=False, buildJobs=None, resumable=False, sessionDir=None, discardSession=False):
+	from ..pipelines import PackagesInstaller, ResolutionPrefs, buildAndInstallWheelFromGitURI
+	from ..session import InstallSession, getDefaultSessionDir
+	from ..utils.BuildPool import BuildPool
+	from ..utils.FetchPool import FetchPool
+
+	if sessionDir is not None:
+		sessionDir = Path(sessionDir)
+	elif resumable or resume:
+		sessionDir = getDefaultSessionDir()
+		if sessionDir is None and resumable and not dryRun:
+			raise ValueError("There is no state dir to save the progress into, use `--session-dir`")
+
+	if resume:
+		if packageNames or fromLock is not None:
+			raise ValueError("Packages are taken from the session, don't specify them", packageNames, fromLock)
+
+		if sessionDir is None or not InstallSession.exists(sessionDir):
+			from ..utils.styles import styles
+
+			print(styles.error("No unfinished session") + " to resume" + (" in " + styles.varContent(str(sessionDir)) if sessionDir is not None else ", there is no state dir, use `--session-dir`"))
+			exit(1)
+
+		from ..session import WrongTargetError
+
+		try:
+			if dryRun:
+				from ..plan import InstallPlan
+				from ..session import SessionStage
+
+				session = InstallSession.load(sessionDir)
+				session.close()
+				InstallPlan.fromLock(session.pending(SessionStage.installed)).print()
+			else:
+				PackagesInstaller(None, FetchPool(jobs), sessionDir=sessionDir, buildPool=BuildPool(buildJobs)).resume()
+		except WrongTargetError as ex:
+			from ..utils.styles import styles
+
+			print(styles.error("The session installs into another environment") + ": " + styles.varContent(ex.args[1]) + ", run `ipi` from it to resume")
+			exit(1)
+		return
+
+	if fromLock is not None:
+		from ..lock import Lock
+
+		if packageNames:
+			raise ValueError("Packages are taken from the lockfile, don't specify them", packageNames)
+
+		lock = Lock.load(Path(fromLock))
+		if dryRun:
+			from ..plan import InstallPlan
+
+			InstallPlan.fromLock(lock).print()
+		else:
+			PackagesInstaller(None, FetchPool(jobs), sessionDir=sessionDir, buildPool=BuildPool(buildJobs), discardSession=discardSession).installFromLock(lock)
+		return
+
+	if not packageNames:
+		raise ValueError("No packages to install")
+
 	from ..registries import initRegistries
 
 	regs = initRegistries()
 
-	from ..pipelines import PackagesInstaller, ResolutionPrefs, buildAndInstallWheelFromGitURI
+	depsHints = None
+	if prefetchHints is not None:
+		from ..lock import Lock
 
-	i = PackagesInstaller(regs)
-	i(ResolutionPrefs(upgrade=upgrade, forceReinstall=forceReinstall), packageNames)
+		depsHints = Lock.load(Path(prefetchHints)).depsHints()
+
+	i = PackagesInstaller(regs, FetchPool(jobs), sessionDir=sessionDir, buildPool=BuildPool(buildJobs), discardSession=discardSession)
+	prefs = ResolutionPrefs(upgrade=upgrade, forceReinstall=forceReinstall)
+	if dryRun:
+		i.plan(prefs, packageNames, depsHints=depsHints).print()
+	else:
+		i(prefs, packageNames, depsHints=depsHints)
+
+
+def _lockImpl(packageNames, output, upgrade, forceReinstall, jobs=None, python=None):
+	from ..pipelines import PackagesInstaller, ResolutionPrefs
+	from ..registries import initRegistries
+	from ..utils.FetchPool import FetchPool
+	from ..utils.targetEnvironment import TargetEnvironment
+
+	targetEnvironment = TargetEnvironment.fromInterpreter(python) if python else None
+	regs = initRegistries()
+
+	lock = PackagesInstaller(regs, FetchPool(jobs)).lock(ResolutionPrefs(upgrade=upgrade, forceReinstall=forceReinstall), packageNames, targetEnvironment=targetEnvironment)
+	output = Path(output)
+	lock.save(output)
+	print(str(len(lock.packages)) + " packages locked into " + str(output))
 
 
 def main():
 	args = cli.parse_args()
+
+	from ..utils.FetchScheduler import configureFetchScheduler
+	from ..utils.negativeCache import configureNegativeCache
+
+	configureFetchScheduler(retries=args.retries, proxy=args.proxy)
+	configureNegativeCache(refresh=args.refresh)
+
 	if args.cmd == "bootstrap":
 		if args.booCmd in {"self", "itself"}:
 			from ..bootstrap.itself import bootstrapItself
@@ -55,7 +166,9 @@ def main():
 			boo.print_help()
 			exit(1)
 	elif args.cmd == "install":
-		_installImpl(packageNames=args.packages, upgrade=args.upgrade, forceReinstall=args.force_reinstall)
+		_installImpl(packageNames=args.packages, upgrade=args.upgrade, forceReinstall=args.force_reinstall, jobs=args.jobs, fromLock=args.from_lock, dryRun=args.dry_run, prefetchHints=args.prefetch_hints, resume=args.resume, buildJobs=args.build_jobs, resumable=args.resumable, sessionDir=args.session_dir, discardSession=args.discard_session)
+	elif args.cmd == "lock":
+		_lockImpl(packageNames=args.packages, output=args.output, upgrade=args.upgrade, forceReinstall=args.force_reinstall, jobs=args.jobs, python=args.python)
 	else:
 		cli.print_help()
 		exit(1)
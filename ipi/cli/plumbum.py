@@ -8,10 +8,13 @@ from warnings import warn
 from plumbum import cli
 
 from ..bootstrap.tiers import BootstrapTier
+from ..utils.FetchScheduler import configureFetchScheduler, getDefaultFetchScheduler, raiseForRetriableStatus
+from ..utils.negativeCache import configureNegativeCache
 from ..utils.styles import styles
 from ..utils.uriDetector import GitHubURIDetector, URIType
-from .argparse import _installImpl
+from .argparse import _installImpl, _lockImpl
 from .argparse import instlIndex as argparseInstallSubParserIndex
+from .argparse import lckIndex as argparseLockSubParserIndex
 
 __all__ = ("main", "tier")
 
@@ -20,23 +23,52 @@ class CLI(cli.Application):
 	"""Anti-bullshit package manager"""
 
 	verbose = cli.Flag(["-v", "--verbose"])
-	proxy = cli.SwitchAttr(["--proxy"])
-	retries = cli.SwitchAttr(["--retries"])
+	proxy = cli.SwitchAttr(["--proxy"], help="Proxy used for all the network operations")
+	retries = cli.SwitchAttr(["--retries"], argtype=int, default=None, help="Count of retries of a network operation failed transiently")
+	refresh = cli.Flag(["--refresh"], help="Retry the lookups and the builds which have failed recently with the same inputs")
 	noColor = cli.Flag(["--no-color"])
 
+	def main(self, *args):
+		configureFetchScheduler(retries=self.retries, proxy=self.proxy)
+		configureNegativeCache(refresh=self.refresh)
+		if self.nested_command is None:
+			return super().main(*args)
+
 
 @CLI.subcommand("install")
 class CLIInstall(cli.Application):
 	upgrade = cli.Flag(argparseInstallSubParserIndex["upgrade"].option_strings, help=argparseInstallSubParserIndex["upgrade"].help)
 	forceReinstall = cli.Flag(argparseInstallSubParserIndex["force_reinstall"].option_strings, help=argparseInstallSubParserIndex["force_reinstall"].help)
 	noDeps = cli.Flag(["--no-deps"])
-	dryRun = cli.Flag(["--dry-run"])
+	jobs = cli.SwitchAttr(argparseInstallSubParserIndex["jobs"].option_strings, argtype=int, default=None, help=argparseInstallSubParserIndex["jobs"].help)
+	buildJobs = cli.SwitchAttr(argparseInstallSubParserIndex["build_jobs"].option_strings, argtype=int, default=None, help=argparseInstallSubParserIndex["build_jobs"].help)
+	fromLock = cli.SwitchAttr(argparseInstallSubParserIndex["from_lock"].option_strings, argtype=cli.ExistingFile, default=None, help=argparseInstallSubParserIndex["from_lock"].help)
+	prefetchHints = cli.SwitchAttr(argparseInstallSubParserIndex["prefetch_hints"].option_strings, argtype=cli.ExistingFile, default=None, help=argparseInstallSubParserIndex["prefetch_hints"].help)
+	dryRun = cli.Flag(argparseInstallSubParserIndex["dry_run"].option_strings, help=argparseInstallSubParserIndex["dry_run"].help)
+	resume = cli.Flag(argparseInstallSubParserIndex["resume"].option_strings, help=argparseInstallSubParserIndex["resume"].help)
+	resumable = cli.Flag(argparseInstallSubParserIndex["resumable"].option_strings, help=argparseInstallSubParserIndex["resumable"].help)
+	sessionDir = cli.SwitchAttr(argparseInstallSubParserIndex["session_dir"].option_strings, argtype=str, default=None, help=argparseInstallSubParserIndex["session_dir"].help)
+	discardSession = cli.Flag(argparseInstallSubParserIndex["discard_session"].option_strings, help=argparseInstallSubParserIndex["discard_session"].help)
 	user = cli.Flag(["--user"])
 	root = cli.SwitchAttr(["--root"])
 	prefix = cli.SwitchAttr(["--prefix"])
 
 	def main(self, *packageNames: str):
-		_installImpl(packageNames=packageNames, upgrade=self.upgrade, forceReinstall=self.forceReinstall)
+		_installImpl(packageNames=packageNames, upgrade=self.upgrade, forceReinstall=self.forceReinstall, jobs=self.jobs, fromLock=self.fromLock, dryRun=self.dryRun, prefetchHints=self.prefetchHints, resume=self.resume, buildJobs=self.buildJobs, resumable=self.resumable, sessionDir=self.sessionDir, discardSession=self.discardSession)
+
+
+@CLI.subcommand("lock")
+class CLILock(cli.Application):
+	"""Resolves packages and records the exact revisions into a lockfile without installing them"""
+
+	output = cli.SwitchAttr(argparseLockSubParserIndex["output"].option_strings, argtype=str, default=str(argparseLockSubParserIndex["output"].default), help=argparseLockSubParserIndex["output"].help)
+	upgrade = cli.Flag(argparseLockSubParserIndex["upgrade"].option_strings, help=argparseLockSubParserIndex["upgrade"].help)
+	forceReinstall = cli.Flag(argparseLockSubParserIndex["force_reinstall"].option_strings, help=argparseLockSubParserIndex["force_reinstall"].help)
+	jobs = cli.SwitchAttr(argparseLockSubParserIndex["jobs"].option_strings, argtype=int, default=None, help=argparseLockSubParserIndex["jobs"].help)
+	python = cli.SwitchAttr(argparseLockSubParserIndex["python"].option_strings, argtype=str, default=None, help=argparseLockSubParserIndex["python"].help)
+
+	def main(self, *packageNames: str):
+		_lockImpl(packageNames=packageNames, output=self.output, upgrade=self.upgrade, forceReinstall=self.forceReinstall, jobs=self.jobs, python=self.python)
 
 
 @CLI.subcommand("update")
@@ -267,7 +299,7 @@ class CLIRepoAdd(cli.Application):
 
 			import httpx
 
-			repoDict = httpx.get(repoDictURI).json()
+			repoDict = getDefaultFetchScheduler()(repoDictURI, lambda: raiseForRetriableStatus(httpx.get(repoDictURI)).json())
 
 		print(styles.entity("Repo dict"), pformat(repoDict))
 
@@ -307,7 +339,7 @@ class CLIRepoAdd(cli.Application):
 				print(styles.operationName("Updating..."))
 				r = m.repoByPetName(repoPetName)
 				repoDict
-				r.update()
+				getDefaultFetchScheduler()(repoURI, r.update)
 
 			# if self.fetch:
 			#
@@ -324,7 +356,7 @@ class CLIRepoUpdate(cli.Application):
 		from ..repos.tuf.RepoManager import RepoManager
 
 		m = RepoManager()
-		m.repoByPetName(repoPetName).update()
+		getDefaultFetchScheduler()(None, m.repoByPetName(repoPetName).update)
 
 
 @CLIRepo.subcommand("remove")
@@ -0,0 +1,183 @@
+import io
+import re
+import shutil
+import tarfile
+import typing
+import zipfile
+from pathlib import Path, PurePosixPath
+from tempfile import TemporaryFile
+from urllib.parse import urlparse
+
+import httpx
+
+from ..bootstrap.tiers import BootstrapTier
+from ..utils import SubDirsT, toSubDirs
+from ..utils.styles import styles
+from ..utils.uriDetector import GitHubURIDetector, URIType
+
+__all__ = ("fetchUsingArchive", "archiveURIForRepo")
+
+ARCHIVE_SUFFIXES = (".tar.gz", ".tgz", ".tar.bz2", ".tar.xz", ".tar", ".zip")
+ZIP_MAGIC = b"PK\x03\x04"
+CHUNK_SIZE = 1 << 16
+
+commitHashRx = re.compile("^[0-9a-f]{40}$")
+
+
+class IteratorStream(io.RawIOBase):
+	"""A read-only file-like object over an iterator of `bytes` chunks, i.e. a body of an HTTP response being downloaded"""
+
+	__slots__ = ("it", "leftover")
+
+	def __init__(self, it: typing.Iterator[bytes]):
+		super().__init__()
+		self.it = it
+		self.leftover = b""
+
+	def readable(self) -> bool:
+		return True
+
+	def readinto(self, b) -> int:
+		while not self.leftover:
+			try:
+				self.leftover = next(self.it)
+			except StopIteration:
+				return 0
+
+		n = min(len(b), len(self.leftover))
+		b[:n] = self.leftover[:n]
+		self.leftover = self.leftover[n:]
+		return n
+
+
+def archiveURIForRepo(uri: str, refSpec: typing.Optional[str] = None) -> str:
+	"""Returns the URI of a snapshot of `refSpec` (the default branch if not set) of a repo on a code hosting. The URIs already pointing to archives are returned as is, `{ref}` within them is replaced with `refSpec`."""
+
+	if "{ref}" in uri:
+		if not refSpec:
+			raise ValueError("`refSpec` is needed to make the URI of the archive", uri)
+		uri = uri.replace("{ref}", refSpec)
+
+	if urlparse(uri).path.lower().endswith(ARCHIVE_SUFFIXES):
+		return uri
+
+	detected = GitHubURIDetector.detect(urlparse(uri))
+	if detected is not None and detected["uriType"] == URIType.root:
+		repoName = detected["repoName"]
+		if repoName.lower().endswith(".git"):
+			repoName = repoName[: -len(".git")]
+		return "https://codeload.github.com/" + detected["namespace"] + "/" + repoName + "/tar.gz/" + (refSpec if refSpec else "HEAD")
+
+	raise ValueError("Don't know how to get an archive for the URI", uri)
+
+
+def _isSafeRelPath(parts: typing.Tuple[str, ...]) -> bool:
+	return bool(parts) and not any(p in {"", ".", ".."} for p in parts)
+
+
+def _isNeeded(parts: typing.Tuple[str, ...], isDir: bool, subDirsParts: typing.Tuple[typing.Tuple[str, ...], ...]) -> bool:
+	"""Whether the member of the archive is within one of the `subDir`s or is a file in the root (build files may be there)"""
+
+	if not subDirsParts:
+		return True
+
+	if len(parts) == 1 and not isDir:
+		return True
+
+	for subDirParts in subDirsParts:
+		l = min(len(parts), len(subDirParts))
+		if parts[:l] == subDirParts[:l]:
+			return True
+
+	return False
+
+
+def _memberRelParts(name: str, stripComponents: int) -> typing.Optional[typing.Tuple[str, ...]]:
+	parts = PurePosixPath(name).parts[stripComponents:]
+	if not _isSafeRelPath(parts):
+		return None
+	return parts
+
+
+def _extractTarStream(stream: typing.BinaryIO, targetDir: Path, subDirsParts, stripComponents: int) -> typing.Tuple[int, typing.Optional[str]]:
+	extracted = 0
+	with tarfile.open(fileobj=stream, mode="r|*") as tar:
+		for member in tar:
+			parts = _memberRelParts(member.name, stripComponents)
+			if parts is None or not (member.isfile() or member.isdir()):
+				continue
+
+			if not _isNeeded(parts, member.isdir(), subDirsParts):
+				continue
+
+			target = targetDir.joinpath(*parts)
+			if member.isdir():
+				target.mkdir(parents=True, exist_ok=True)
+				continue
+
+			target.parent.mkdir(parents=True, exist_ok=True)
+			with tar.extractfile(member) as src, target.open("wb") as dst:
+				shutil.copyfileobj(src, dst, CHUNK_SIZE)
+			target.chmod(member.mode & 0o755 | 0o644)
+			extracted += 1
+
+		revision = tar.pax_headers.get("comment", None)  # `git archive` puts the commit hash there
+
+	return extracted, revision
+
+
+def _extractZip(f: typing.BinaryIO, targetDir: Path, subDirsParts, stripComponents: int) -> typing.Tuple[int, typing.Optional[str]]:
+	extracted = 0
+	with zipfile.ZipFile(f) as z:
+		for info in z.infolist():
+			parts = _memberRelParts(info.filename, stripComponents)
+			if parts is None or not _isNeeded(parts, info.is_dir(), subDirsParts):
+				continue
+
+			target = targetDir.joinpath(*parts)
+			if info.is_dir():
+				target.mkdir(parents=True, exist_ok=True)
+				continue
+
+			target.parent.mkdir(parents=True, exist_ok=True)
+			with z.open(info) as src, target.open("wb") as dst:
+				shutil.copyfileobj(src, dst, CHUNK_SIZE)
+			extracted += 1
+
+		revision = z.comment.decode("ascii", errors="replace")  # `git archive` puts the commit hash there
+
+	return extracted, revision
+
+
+def fetchUsingArchive(uri: str, targetDir: Path, depth: typing.Optional[int] = None, refSpec: typing.Optional[str] = None, subDir: SubDirsT = None, stripComponents: int = 1, timeout: float = 60) -> typing.Optional[str]:
+	"""Downloads a snapshot of a repo as an archive and extracts it into `targetDir` while it is being downloaded, without buffering it in memory. zip archives cannot be extracted before they are fully downloaded, so they are spooled to a temporary file.
+	If `subDir` is set, only it (or them) and the files in the root of the archive are extracted. `stripComponents` leading path components (the dir code hostings put everything into) are removed.
+	`depth` is ignored, there is no history in archives. Returns the hash of the commit if the archive was created by `git archive`."""
+
+	archiveURI = archiveURIForRepo(uri, refSpec)
+	subDirsParts = tuple(PurePosixPath(el).parts for el in toSubDirs(subDir))
+
+	targetDir = Path(targetDir)
+	targetDir.mkdir(parents=True, exist_ok=True)
+
+	with httpx.stream("GET", archiveURI, follow_redirects=True, timeout=timeout) as response:
+		response.raise_for_status()
+		stream = io.BufferedReader(IteratorStream(response.iter_bytes(CHUNK_SIZE)), CHUNK_SIZE)
+
+		if stream.peek(len(ZIP_MAGIC))[: len(ZIP_MAGIC)] == ZIP_MAGIC:
+			with TemporaryFile() as spool:
+				shutil.copyfileobj(stream, spool, CHUNK_SIZE)
+				spool.seek(0)
+				extracted, revision = _extractZip(spool, targetDir, subDirsParts, stripComponents)
+		else:
+			extracted, revision = _extractTarStream(stream, targetDir, subDirsParts, stripComponents)
+
+	print(styles.success("Extracted") + " " + str(extracted) + " files of " + styles.varContent(archiveURI))
+
+	if revision and commitHashRx.match(revision):
+		return revision
+
+	return None
+
+
+tier = BootstrapTier.full
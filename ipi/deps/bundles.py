@@ -0,0 +1,98 @@
+import csv
+import shutil
+import threading
+import typing
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from urllib.parse import unquote, urlparse
+
+from ..bootstrap.tiers import BootstrapTier
+from ..utils.repoURINormalizer import normalizeRepoURI
+
+__all__ = ("getBundleForRepo", "materializeBundle")
+
+CHUNK_SIZE = 1 << 16
+
+
+def parseBundlesConfig(lines: typing.Iterable[str]) -> typing.Dict[str, str]:
+	"""The local config is a TSV with `repo` and `bundle` columns, in the same format as registries"""
+
+	res = {}
+	for el in csv.DictReader((l for l in lines if not l.startswith("#")), dialect=csv.excel_tab):
+		repo = el.get("repo", None)
+		bundle = el.get("bundle", None)
+		if repo and bundle:
+			res[normalizeRepoURI(repo)] = bundle
+
+	return res
+
+
+_configuredBundles = None
+_configuredBundlesLock = threading.Lock()
+
+
+def getConfiguredBundles() -> typing.Dict[str, str]:
+	global _configuredBundles
+
+	with _configuredBundlesLock:
+		if _configuredBundles is None:
+			from ..settings import bundlesConfigFile
+
+			if bundlesConfigFile is not None and bundlesConfigFile.is_file():
+				_configuredBundles = parseBundlesConfig(bundlesConfigFile.read_text().splitlines())
+			else:
+				_configuredBundles = {}
+
+	return _configuredBundles
+
+
+def getBundleForRepo(uri: str) -> typing.Optional[str]:
+	"""Returns the bundle pre-staged for the repo in the local config (`bundles.tsv` in the settings dir), if any"""
+
+	return getConfiguredBundles().get(normalizeRepoURI(uri), None)
+
+
+def downloadBundle(uri: str, path: Path, timeout: float = 60):
+	"""Streams the bundle into `path` without buffering it in memory. `httpx` is used if it is available."""
+
+	try:
+		import httpx
+	except ImportError:
+		httpx = None
+
+	with path.open("wb") as f:
+		if httpx is not None:
+			with httpx.stream("GET", uri, follow_redirects=True, timeout=timeout) as response:
+				response.raise_for_status()
+				for chunk in response.iter_bytes(CHUNK_SIZE):
+					f.write(chunk)
+		else:
+			with urllib.request.urlopen(uri, timeout=timeout) as response:
+				shutil.copyfileobj(response, f, CHUNK_SIZE)
+
+
+@contextmanager
+def materializeBundle(bundle: str, tempDir: Path, timeout: float = 60):
+	"""Yields a local path of the bundle. Bundles served over HTTP are downloaded through the fetch scheduler into a temporary dir within `tempDir` and removed after use."""
+
+	scheme = urlparse(bundle).scheme
+	if scheme in {"http", "https"}:
+		from ..utils.FetchScheduler import getDefaultFetchScheduler
+
+		tempDir.mkdir(parents=True, exist_ok=True)
+		with TemporaryDirectory(prefix="bundle_", dir=tempDir) as d:
+			res = Path(d) / "repo.bundle"
+			getDefaultFetchScheduler()(bundle, downloadBundle, bundle, res, timeout=timeout)  # a retry overwrites the partial download
+			yield res
+		return
+
+	if scheme == "file":
+		yield Path(unquote(urlparse(bundle).path))
+		return
+
+	yield Path(bundle).expanduser()
+
+
+tier = BootstrapTier.bootstrap
@@ -1,8 +1,16 @@
 import typing
 from enum import IntEnum
 
-from .git import fetchUsingGit
-from .hg import fetchUsingMercurial
+from ..utils import toFileURI
+from ..utils.repoURINormalizer import normalizeRepoURI
+from .git import checkoutUsingGit, deepenUsingGit, estimateCheckoutUsingGit, fetchMetadataUsingGit, fetchRevisionUsingGit, fetchUsingGit, getRemoteRevisionUsingGit, prefetchUsingGit, widenCheckoutUsingGit, widenMetadataUsingGit
+from .hg import fetchRevisionUsingMercurial, fetchUsingMercurial, getRemoteRevisionUsingMercurial, prefetchUsingMercurial, widenCheckoutUsingMercurial
+from .local import locateLocalSources
+
+try:
+	from .archive import fetchUsingArchive
+except ImportError:
+	fetchUsingArchive = None
 
 
 class Source(IntEnum):
@@ -11,20 +19,83 @@ class Source(IntEnum):
 	pip = 2
 	git = 3
 	hg = 4
+	archive = 5
+	path = 6
 
 
 Source.none.__doc__ = "Undefined fetcher"
 Source.system.__doc__ = "Package must be already installed in the system"
 Source.pip.__doc__ = "Install a wheel from pip"
-Source.git.__doc__ = "Fetch source from a git repo"
+Source.git.__doc__ = "Fetch source from a git repo, seeding the mirror from a `bundle` if it is set"
 Source.hg.__doc__ = "Fetch source from a hg repo"
+Source.archive.__doc__ = "Download and extract a snapshot archive (tar or zip) of a ref of a repo on a code hosting"
+Source.path.__doc__ = "Use a local dir (i.e. a worktree already checked out) in place, without copying it"
+
+VCS_SOURCES = frozenset((Source.git, Source.hg))
 
 
+# fetchers return the id of the revision fetched
 fetchers = {
 	Source.git: fetchUsingGit,
 	Source.hg: fetchUsingMercurial,
 }
 
+if fetchUsingArchive is not None:
+	fetchers[Source.archive] = fetchUsingArchive
+
+# fetch the exact revision recorded earlier, i.e. into a lockfile. Return the id of the revision.
+revisionFetchers = {
+	Source.git: fetchRevisionUsingGit,
+	Source.hg: fetchRevisionUsingMercurial,
+}
+
+# sources used in place, without fetching. Return the dir of the package.
+inPlaceLocators = {
+	Source.path: locateLocalSources,
+}
+
+# two-phase fetching: the first phase materializes only the files needed to extract metadata and returns the id of the revision, the second one checks out the rest when the package is to be built
+metadataFetchers = {
+	Source.git: fetchMetadataUsingGit,
+}
+
+checkouters = {
+	Source.git: checkoutUsingGit,
+}
+
+# add the metadata files of more packages of the same repo to the ones written by the first phase, from the same revision
+metadataWideners = {
+	Source.git: widenMetadataUsingGit,
+}
+
+# materialize more subdirs in a checkout made by a fetcher, for more packages of the same repo
+checkoutWideners = {
+	Source.git: widenCheckoutUsingGit,
+	Source.hg: widenCheckoutUsingMercurial,
+}
+
+# estimate the second phase without fetching anything. Return the count of files to be checked out, the count of the ones to be downloaded and the estimated size of the download in bytes.
+checkoutEstimators = {
+	Source.git: estimateCheckoutUsingGit,
+}
+
+# warm the local mirrors of the packages likely to be needed without writing anything into the target dir
+prefetchers = {
+	Source.git: prefetchUsingGit,
+	Source.hg: prefetchUsingMercurial,
+}
+
+# fetch more history of a shallow fetch until a tag is reachable from the revision, for the packages computing their versions from tags
+historyDeepeners = {
+	Source.git: deepenUsingGit,
+}
+
+# get the id of the revision a ref points to without fetching the repo
+remoteRevisionGetters = {
+	Source.git: getRemoteRevisionUsingGit,
+	Source.hg: getRemoteRevisionUsingMercurial,
+}
+
 
 class Fetcher:
 	__slots__ = ()
@@ -46,14 +117,68 @@ class SourceFetcher(DummyFetcher):
 		"subDir",
 		"depth",
 		"refSpec",
+		"bundle",
 	)
 
-	def __init__(self, tp: Source, repo: str, subDir: typing.Optional[str] = None, refSpec: typing.Optional[str] = None, depth: int = 1) -> None:
+	def __init__(self, tp: Source, repo: str, subDir: typing.Optional[str] = None, refSpec: typing.Optional[str] = None, depth: int = 1, bundle: typing.Optional[str] = None) -> None:
 		super().__init__(tp)
 		self.repo = repo
 		self.subDir = subDir
 		self.refSpec = refSpec
 		self.depth = depth
+		self.bundle = bundle
+
+	@property
+	def fetcherKwargs(self) -> dict:
+		"""The optional args only some of the fetchers support"""
+
+		res = {}
+		if self.bundle:
+			res["bundle"] = self.bundle
+		return res
+
+	@property
+	def repoKey(self) -> tuple:
+		"""Packages which sources have the same key share a single checkout (i.e. several packages living in subdirs of a monorepo)"""
+
+		return (self.type, normalizeRepoURI(self.repo), self.refSpec)
+
+	def toDirectURL(self, revision: typing.Optional[str]) -> dict:
+		"""Describes the source as `direct_url.json` (PEP 610) recorded into `dist-info` of an installed package."""
+
+		if self.type in inPlaceLocators:
+			return {"url": toFileURI(inPlaceLocators[self.type](self.repo, self.subDir)), "dir_info": {}}
+
+		if self.type not in VCS_SOURCES:
+			return {"url": self.repo, "archive_info": {}}
+
+		vcsInfo = {"vcs": self.type.name, "commit_id": revision}
+		if self.refSpec:
+			vcsInfo["requested_revision"] = self.refSpec
+
+		res = {"url": self.repo, "vcs_info": vcsInfo}
+		if self.subDir:
+			res["subdirectory"] = self.subDir
+
+		return res
+
+	def recordedRevision(self, directURL: typing.Optional[dict]) -> typing.Optional[str]:
+		"""Returns the id of the revision recorded in `directURL` if it describes this source. `None` otherwise."""
+
+		if not directURL:
+			return None
+
+		vcsInfo = directURL.get("vcs_info", None)
+		if not isinstance(vcsInfo, dict) or vcsInfo.get("vcs", None) != self.type.name:
+			return None
+
+		if directURL.get("subdirectory", None) != self.subDir or vcsInfo.get("requested_revision", None) != self.refSpec:
+			return None
+
+		if normalizeRepoURI(directURL.get("url", "")) != normalizeRepoURI(self.repo):
+			return None
+
+		return vcsInfo.get("commit_id", None)
 
 	def __repr__(self) -> str:
-		return self.__class__.__name__ + "(" + repr(self.repo) + (", subDir=" + repr(self.subDir) if self.subDir else "") + (", refSpec=" + repr(self.refSpec) if self.refSpec else "") + (", depth=" + repr(self.depth) if self.depth != 1 else "") + ")"
+		return self.__class__.__name__ + "(" + repr(self.repo) + (", subDir=" + repr(self.subDir) if self.subDir else "") + (", refSpec=" + repr(self.refSpec) if self.refSpec else "") + (", depth=" + repr(self.depth) if self.depth != 1 else "") + (", bundle=" + repr(self.bundle) if self.bundle else "") + ")"
@@ -1,32 +1,546 @@
+import os
+import shutil
+import subprocess
+import sys
+import threading
 import typing
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
+from warnings import warn
 
 from ..bootstrap.tiers import BootstrapTier
+from ..utils import SubDirsT, formatSize, getDirSize, toSubDirs
+from ..utils.styles import styles
 from . import sh
+from .bundles import getBundleForRepo, materializeBundle
+from .mirrors import MirrorsCache, getDefaultMirrorsCache
 
-git = sh.Command("git").bake(_fg=True)
-gitClone = git.bake("clone")
-gitSparseCheckout = git.bake("sparse-checkout")
+gitOut = sh.Command("git")
+gitRevParse = gitOut.bake("rev-parse")
+gitLsRemote = gitOut.bake("ls-remote")
+gitBundleListHeads = gitOut.bake("bundle", "list-heads")
+gitForEachRef = gitOut.bake("for-each-ref")
+gitCatFileExists = gitOut.bake("cat-file", "-e")
+gitCatFileDiskSizes = gitOut.bake("cat-file", "--batch-check=%(objecttype) %(objectsize:disk)")
+gitDescribeTag = gitOut.bake("describe", "--tags", "--abbrev=0")
+gitRevListBlobsMissing = gitOut.bake("rev-list", "--objects", "--missing=print", "--filter=object:type=blob", "--filter-provided-objects")
+gitLsTree = gitOut.bake("ls-tree")
+git = gitOut.bake(_fg=True)
+gitNet = gitOut.bake(_out=sys.stdout, _err=sys.stderr, _tee="err")  # the network operations: stderr is both shown and kept in the errors, so the transient failures can be told and retried
+gitClone = gitNet.bake("clone")
+gitSparseCheckout = gitNet.bake("sparse-checkout")  # the blobs missing in partial clones are fetched lazily
 gitSparseCheckoutSet = gitSparseCheckout.bake("set")
+gitInit = git.bake("init")
+gitConfig = git.bake("config")
+gitFetch = gitNet.bake("fetch")
+gitWorktree = gitNet.bake("worktree")
+gitWorktreeAdd = gitWorktree.bake("add")
+gitWorktreePrune = gitWorktree.bake("prune")
+gitReadTree = gitNet.bake("read-tree")
 
+MIRRORS_KIND = "git"
+MIRROR_REFS_PREFIX = "refs/ipi/"
+MIRROR_FILTER = "blob:none"
+MIRROR_FETCH_ARGS = ("--filter=" + MIRROR_FILTER, "--no-write-fetch-head")
+gitFetchObjects = gitNet.bake("-c", "fetch.negotiationAlgorithm=noop", "fetch", "--no-tags", "--no-write-fetch-head", "--recurse-submodules=no", "--filter=" + MIRROR_FILTER)  # what `git` runs itself to fetch missing objects of partial clones
+MIRROR_CONFIG = (
+	("core.repositoryformatversion", "1"),
+	("extensions.partialClone", "origin"),
+	("remote.origin.promisor", "true"),
+	("remote.origin.partialclonefilter", MIRROR_FILTER),
+)
+
+METADATA_FILES_NAMES = ("pyproject.toml", "setup.cfg", "setup.py")
+
+NO_LAZY_FETCH_ENV = {"GIT_NO_LAZY_FETCH": "1"}
+
+DEFAULT_BLOB_DISK_SIZE = 4096  # assumed for the blobs to download if the mirror has none to average over
+
+
+def getRevisionUsingGit(repoDir: Path, ref: str = "HEAD") -> str:
+	return str(gitRevParse("--verify", ref + "^{commit}", _cwd=repoDir)).strip()
+
+
+def getTreeUsingGit(dir: Path, ref: str = "HEAD") -> str:
+	"""The hash of the tree of `dir` (may be a subdir of a repo) in `ref`. Git already has it, nothing is hashed."""
+
+	return str(gitRevParse("--verify", ref + ":./", _cwd=dir)).strip()
+
+
+def getRemoteRevisionUsingGit(uri: str, refSpec: typing.Optional[str] = None) -> typing.Optional[str]:
+	"""Asks the remote which commit `refSpec` (the default branch if not set) points to without fetching anything. `None` if it cannot be determined, i.e. when `refSpec` is a commit hash."""
+
+	ref = refSpec if refSpec else "HEAD"
+	refs = {}
+	for line in str(gitLsRemote(uri, ref)).splitlines():
+		line = line.strip()
+		if line:
+			sha, name = line.split("\t", 1)
+			refs[name] = sha
+
+	if refSpec:
+		candidates = ("refs/heads/" + ref, "refs/tags/" + ref + "^{}", "refs/tags/" + ref, ref)
+	else:
+		candidates = (ref,)
+
+	for candidate in candidates:
+		sha = refs.get(candidate, None)
+		if sha:
+			return sha
+
+	return None
+
+
+def cloneUsingGit(uri: str, targetDir: Path, depth: int = 1, refSpec: typing.Optional[str] = None, subDir: SubDirsT = None) -> str:
+	"""Clones directly from the network, without any mirror. Returns the hash of the commit checked out.
+	If `subDir` is set, only it (or them) and the files in the root of the repo are materialized and only their blobs are downloaded."""
+
+	subDirs = toSubDirs(subDir)
+	if subDirs:
+		additionalArgs = ["--filter=blob:none", "--sparse"]  # `--sparse` checks out only the files in the root
+	else:
+		additionalArgs = ["--filter=tree:0"]
 
-def fetchUsingGit(uri: str, targetDir: Path, depth: int = 50, refSpec: typing.Optional[str] = None, subDir: typing.Optional[str] = None):
-	additionalArgs = ["--filter=tree:0"]
 	if depth and depth > 0:
 		additionalArgs.extend(("--depth", depth))
 
 	if refSpec:
 		additionalArgs.extend(("--single-branch", "--branch", refSpec))
 
-	if subDir:
-		additionalArgs.extend(("--no-checkout", "--sparse"))
+	gitClone(uri, targetDir, *additionalArgs)
+
+	if subDirs:
+		gitSparseCheckoutSet("--cone", *subDirs, _cwd=targetDir)
+
+	return getRevisionUsingGit(targetDir)
 
-	res = gitClone(uri, targetDir, *additionalArgs)
 
-	if subDir:
-		gitSparseCheckoutSet(subDir, _cwd=targetDir)
+def mirrorRefName(refSpec: typing.Optional[str]) -> str:
+	"""The ref within a mirror the fetched `refSpec` is stored into"""
+
+	if refSpec:
+		return MIRROR_REFS_PREFIX + "heads/" + refSpec
+
+	return MIRROR_REFS_PREFIX + "HEAD"
+
+
+def mirrorFetchRefSpec(refSpec: typing.Optional[str]) -> str:
+	return "+" + (refSpec if refSpec else "HEAD") + ":" + mirrorRefName(refSpec)
+
+
+def initMirror(uri: str, mirrorDir: Path):
+	gitInit("--bare", "--quiet", mirrorDir)
+	for k, v in MIRROR_CONFIG:
+		gitConfig(k, v, _cwd=mirrorDir)
+	gitConfig("remote.origin.url", uri, _cwd=mirrorDir)
+
+
+def bundleRefSpecs(bundlePath: Path) -> typing.List[str]:
+	"""Tags from a bundle are stored as tags, the rest of its refs are stored into a separate namespace of the mirror"""
+
+	res = []
+	for line in str(gitBundleListHeads(bundlePath)).splitlines():
+		line = line.strip()
+		if not line:
+			continue
+
+		name = line.split(" ", 1)[1]
+		if name.endswith("^{}"):
+			continue
+
+		if name.startswith("refs/tags/"):
+			res.append("+" + name + ":" + name)
+		else:
+			res.append("+" + name + ":" + MIRROR_REFS_PREFIX + "bundle/" + (name[len("refs/") :] if name.startswith("refs/") else name))
 
 	return res
 
 
+def seedMirrorFromBundle(mirrorDir: Path, bundle: str) -> bool:
+	"""Populates a new mirror from a git bundle (a local file or a one served over HTTP), so only the objects missing in it are fetched from the origin afterwards. If the bundle is unusable, warns and returns `False`, the mirror is then populated from the origin as usual."""
+
+	try:
+		with materializeBundle(bundle, mirrorDir.parent) as bundlePath:
+			bundlePath = bundlePath.absolute()
+			gitFetch("--no-write-fetch-head", bundlePath, *bundleRefSpecs(bundlePath), _cwd=mirrorDir)
+	except Exception as ex:
+		warn("Cannot seed the mirror from the bundle " + repr(bundle) + ": " + repr(ex))
+		return False
+
+	return True
+
+
+@contextmanager
+def bundleForNewMirror(mirrors: MirrorsCache, uri: str, bundle: typing.Optional[str] = None):
+	"""Materializes the bundle (`bundle` or the one in the local config) to seed the mirror of `uri` with, if the mirror doesn't exist yet. It is done before the mirror is locked, so the mirror is not held for the whole download. Yields the local path of the bundle for `updateMirror`, an empty string if there is nothing to seed the mirror with."""
+
+	if bundle is None:
+		bundle = getBundleForRepo(uri)
+
+	mirrorDir = mirrors.pathFor(MIRRORS_KIND, uri)
+	if not bundle or (mirrorDir / "config").is_file():
+		yield ""
+		return
+
+	with ExitStack() as stack:
+		try:
+			res = str(stack.enter_context(materializeBundle(bundle, mirrorDir.parent)).absolute())
+		except Exception as ex:
+			warn("Cannot seed the mirror from the bundle " + repr(bundle) + ": " + repr(ex))
+			res = ""
+		yield res
+
+
+def updateMirror(uri: str, mirrorDir: Path, depth: int = 1, refSpec: typing.Optional[str] = None, bundle: typing.Optional[str] = None) -> str:
+	"""Fetches `refSpec` (the default branch if not set) into a bare blobless mirror, creating the mirror if needed. Only the objects missing in the mirror are transferred. Returns the name of the ref in the mirror.
+	A new mirror is seeded from `bundle` (the one configured in the local config, if not set) first, the callers holding the lock of the mirror materialize it beforehand with `bundleForNewMirror`. `depth` only applies to the first fetch into an empty mirror: the history fetched later (i.e. by deepening to the nearest tag, or from a bundle) is kept."""
+
+	if not (mirrorDir / "config").is_file():
+		initMirror(uri, mirrorDir)
+		if bundle is None:
+			bundle = getBundleForRepo(uri)
+		if bundle:
+			seedMirrorFromBundle(mirrorDir, bundle)
+
+	isEmpty = not str(gitForEachRef("--count=1", _cwd=mirrorDir)).strip()
+	isShallow = (mirrorDir / "shallow").is_file()
+
+	additionalArgs = list(MIRROR_FETCH_ARGS)
+	if depth and depth > 0:
+		if isEmpty:
+			additionalArgs.extend(("--depth", depth))
+	elif isShallow:
+		additionalArgs.append("--unshallow")
+
+	ref = mirrorRefName(refSpec)
+	gitFetch(*additionalArgs, "origin", mirrorFetchRefSpec(refSpec), _cwd=mirrorDir)
+	return ref
+
+
+def checkoutFromMirror(mirrorDir: Path, ref: str, targetDir: Path, subDir: SubDirsT = None) -> str:
+	"""Creates a worktree of the mirror in `targetDir`. The objects are not copied, the worktree uses the object store of the mirror. Returns the hash of the commit checked out."""
+
+	targetDir = Path(targetDir).absolute()
+	gitWorktreePrune(_cwd=mirrorDir)  # the worktrees of the previous sessions are deleted together with their temporary dirs
+
+	subDirs = toSubDirs(subDir)
+	if not subDirs:
+		gitWorktreeAdd("--detach", targetDir, ref, _cwd=mirrorDir)
+	else:
+		gitWorktreeAdd("--detach", "--no-checkout", targetDir, ref, _cwd=mirrorDir)
+		gitSparseCheckoutSet("--cone", *subDirs, _cwd=targetDir)
+		gitReadTree("-mu", "HEAD", _cwd=targetDir)
+
+	return getRevisionUsingGit(targetDir)
+
+
+def fetchUsingGit(uri: str, targetDir: Path, depth: int = 1, refSpec: typing.Optional[str] = None, subDir: SubDirsT = None, mirrors: typing.Optional[MirrorsCache] = None, bundle: typing.Optional[str] = None) -> str:
+	"""Fetches a repo through a persistent local mirror (the default one, if `mirrors` is not set), so the repeated fetches of the same repo transfer only the new objects. A new mirror is seeded from a bundle (`bundle` or the one in the local config), then only the delta is fetched from the origin.
+	Clones directly if there is no place for mirrors and no bundle. Returns the hash of the commit checked out."""
+
+	if bundle is None:
+		bundle = getBundleForRepo(uri)
+
+	if mirrors is None:
+		mirrors = getDefaultMirrorsCache()
+
+	if mirrors is None:
+		if not bundle:
+			return cloneUsingGit(uri, targetDir, depth=depth, refSpec=refSpec, subDir=subDir)
+		mirrors = _getMirrors(None, targetDir)
+
+	with bundleForNewMirror(mirrors, uri, bundle) as bundle, mirrors.use(MIRRORS_KIND, uri) as mirrorDir:
+		objectsDir = mirrorDir / "objects"
+		sizeBefore = getDirSize(objectsDir)[1]
+		ref = updateMirror(uri, mirrorDir, depth=depth, refSpec=refSpec, bundle=bundle)
+		res = checkoutFromMirror(mirrorDir, ref, targetDir, subDir=subDir)
+		print(styles.success("Fetched") + " " + formatSize(getDirSize(objectsDir)[1] - sizeBefore) + " of " + styles.entity("objects") + " of " + styles.varContent(uri) + " into the mirror")
+		return res
+
+
+class GitCatFileBatch:
+	"""A long-lived `git cat-file --batch` process reading objects of a repo without spawning a process per object. Missing blobs of partial clones are not fetched on demand, they must be fetched explicitly beforehand, so every network operation goes through the fetch scheduler."""
+
+	__slots__ = ("repoDir", "proc", "lock")
+
+	def __init__(self, repoDir: Path):
+		self.repoDir = repoDir
+		self.proc = subprocess.Popen(("git", "cat-file", "--batch"), cwd=str(repoDir), stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=dict(os.environ, **NO_LAZY_FETCH_ENV))
+		self.lock = threading.Lock()
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.repoDir) + ")"
+
+	def read(self, objectName: str) -> typing.Optional[bytes]:
+		"""Returns the contents of an object, i.e. `<commit>:<path>`, or `None` if there is no such object"""
+
+		with self.lock:
+			self.proc.stdin.write(objectName.encode("utf-8") + b"\n")
+			self.proc.stdin.flush()
+
+			header = self.proc.stdout.readline()
+			if not header:
+				raise RuntimeError("`git cat-file` has exited", self.repoDir, self.proc.poll())
+
+			if header.endswith((b" missing\n", b" ambiguous\n")):
+				return None
+
+			size = int(header.split()[-1])
+			res = self.proc.stdout.read(size)
+			self.proc.stdout.read(1)  # the trailing \n
+			return res
+
+	def close(self):
+		self.proc.stdin.close()
+		self.proc.wait()
+		self.proc.stdout.close()
+
+
+_catFileBatches = {}
+_catFileBatchesLock = threading.Lock()
+
+
+def getCatFileBatch(repoDir: Path) -> GitCatFileBatch:
+	"""Returns the `git cat-file --batch` process of the repo, spawning it on the first call"""
+
+	with _catFileBatchesLock:
+		res = _catFileBatches.get(repoDir, None)
+		if res is None:
+			res = _catFileBatches[repoDir] = GitCatFileBatch(repoDir)
+		return res
+
+
+def closeCatFileBatches():
+	with _catFileBatchesLock:
+		for b in _catFileBatches.values():
+			b.close()
+		_catFileBatches.clear()
+
+
+_sessionMirrorsCaches = {}
+_sessionMirrorsCachesLock = threading.Lock()
+
+
+def _getMirrors(mirrors: typing.Optional[MirrorsCache], targetDir: Path) -> MirrorsCache:
+	"""The two-phase fetching always needs a mirror. If there is no place for persistent ones, the mirrors are put into the dir containing `targetDir` and live as long as it."""
+
+	if mirrors is None:
+		mirrors = getDefaultMirrorsCache()
+
+	if mirrors is None:
+		sessionMirrorsDir = Path(targetDir).absolute().parent / ".mirrors"
+		with _sessionMirrorsCachesLock:
+			mirrors = _sessionMirrorsCaches.get(sessionMirrorsDir, None)
+			if mirrors is None:
+				mirrors = _sessionMirrorsCaches[sessionMirrorsDir] = MirrorsCache(sessionMirrorsDir)
+
+	return mirrors
+
+
+def hasObjectUsingGit(repoDir: Path, objectName: str) -> bool:
+	"""Without fetching it if it is missing in a partial clone"""
+
+	try:
+		gitCatFileExists(objectName, _cwd=repoDir, _env=dict(os.environ, **NO_LAZY_FETCH_ENV))
+	except Exception:
+		return False
+
+	return True
+
+
+def fetchMissingBlobsUsingGit(mirrorDir: Path, revision: str, paths: typing.Iterable[str]) -> int:
+	"""Fetches the blobs of the `paths` in `revision` which are missing in a blobless mirror in a single request. Returns the count of the fetched ones."""
+
+	paths = list(paths)
+	objectNames = [l.split("\t", 1)[0].split()[2] for l in str(gitLsTree(revision, "--", *paths, _cwd=mirrorDir)).splitlines() if l.strip()] if paths else []
+	missing = [o for o in objectNames if not hasObjectUsingGit(mirrorDir, o)]
+	if missing:
+		gitFetchObjects("origin", *missing, _cwd=mirrorDir)
+	return len(missing)
+
+
+def fetchMetadataUsingGit(uri: str, targetDir: Path, depth: int = 1, refSpec: typing.Optional[str] = None, subDir: SubDirsT = None, mirrors: typing.Optional[MirrorsCache] = None, bundle: typing.Optional[str] = None) -> str:
+	"""The first phase of two-phase fetching. Fetches commits, trees and only the blobs of the metadata files into the mirror and writes only the files needed to extract metadata of the package into `targetDir` (each of `subDir` within it), reading them through a long-lived `git cat-file --batch` process.
+	The rest is checked out by `checkoutUsingGit` when the package is about to be built. Returns the hash of the commit."""
+
+	mirrors = _getMirrors(mirrors, targetDir)
+
+	with bundleForNewMirror(mirrors, uri, bundle) as bundle, mirrors.use(MIRRORS_KIND, uri) as mirrorDir:  # held for the whole read, a concurrent update or gc of the mirror must not interfere
+		ref = updateMirror(uri, mirrorDir, depth=depth, refSpec=refSpec, bundle=bundle)
+		revision = getRevisionUsingGit(mirrorDir, ref)
+		writeMetadataFilesUsingGit(mirrorDir, revision, targetDir, subDir)
+
+	return revision
+
+
+def writeMetadataFilesUsingGit(mirrorDir: Path, revision: str, targetDir: Path, subDir: SubDirsT = None):
+	"""Writes the files needed to extract metadata of the packages in `subDir` (the root if not set) at `revision` into `targetDir`. The mirror must be locked."""
+
+	packageDirs = toSubDirs(subDir) or (None,)
+
+	def prefixOf(packageDir: typing.Optional[str]) -> str:
+		return packageDir.strip("/") + "/" if packageDir else ""
+
+	fetchMissingBlobsUsingGit(mirrorDir, revision, (prefixOf(d) + f for d in packageDirs for f in METADATA_FILES_NAMES))
+
+	reader = getCatFileBatch(mirrorDir)
+	for packageDir in packageDirs:
+		metadataDir = Path(targetDir) / packageDir if packageDir else Path(targetDir)
+		metadataDir.mkdir(parents=True, exist_ok=True)
+
+		for fileName in METADATA_FILES_NAMES:
+			content = reader.read(revision + ":" + prefixOf(packageDir) + fileName)
+			if content is not None:
+				(metadataDir / fileName).write_bytes(content)
+
+
+def widenMetadataUsingGit(uri: str, targetDir: Path, revision: str, subDir: SubDirsT = None, mirrors: typing.Optional[MirrorsCache] = None):
+	"""Adds the files needed to extract metadata of more packages of a repo to the ones written by `fetchMetadataUsingGit` into `targetDir`, from the same commit `revision`, which is already in the mirror"""
+
+	mirrors = _getMirrors(mirrors, targetDir)
+	with mirrors.use(MIRRORS_KIND, uri) as mirrorDir:
+		writeMetadataFilesUsingGit(mirrorDir, revision, targetDir, subDir)
+
+
+def widenCheckoutUsingGit(uri: str, targetDir: Path, subDir: SubDirsT = None, mirrors: typing.Optional[MirrorsCache] = None):
+	"""Materializes `subDir` (the whole repo if not set) in a sparse checkout made by `fetchUsingGit` or `checkoutUsingGit` in `targetDir`, for more packages of the repo. The blobs missing in the mirror are fetched on demand."""
+
+	subDirs = toSubDirs(subDir)
+
+	def widen():
+		if subDirs:
+			gitSparseCheckoutSet("--cone", *subDirs, _cwd=targetDir)
+		else:
+			gitSparseCheckout("disable", _cwd=targetDir)
+
+	if not (Path(targetDir) / ".git").is_file():  # a standalone clone
+		widen()
+		return
+
+	mirrors = _getMirrors(mirrors, targetDir)
+	with mirrors.use(MIRRORS_KIND, uri):  # a worktree of the mirror, the blobs are fetched into it
+		widen()
+
+
+def prefetchUsingGit(uri: str, targetDir: Path, refSpec: typing.Optional[str] = None, mirrors: typing.Optional[MirrorsCache] = None, bundle: typing.Optional[str] = None):
+	"""Brings the mirror used by `fetchMetadataUsingGit` up to date without writing anything into `targetDir`, so the fetch of the package, if it turns out to be needed, transfers nothing. If not, the objects stay in the mirror."""
+
+	mirrors = _getMirrors(mirrors, targetDir)
+
+	with bundleForNewMirror(mirrors, uri, bundle) as bundle, mirrors.use(MIRRORS_KIND, uri, blocking=False) as mirrorDir:
+		if mirrorDir is not None:  # otherwise it is being updated right now anyway
+			updateMirror(uri, mirrorDir, refSpec=refSpec, bundle=bundle)
+
+
+def checkoutUsingGit(uri: str, targetDir: Path, revision: str, subDir: SubDirsT = None, mirrors: typing.Optional[MirrorsCache] = None) -> str:
+	"""The second phase of two-phase fetching. Replaces the files written by `fetchMetadataUsingGit` with a worktree of the mirror. Returns the hash of the commit."""
+
+	mirrors = _getMirrors(mirrors, targetDir)
+
+	if Path(targetDir).exists():
+		shutil.rmtree(targetDir)
+
+	with mirrors.use(MIRRORS_KIND, uri) as mirrorDir:
+		return checkoutFromMirror(mirrorDir, revision, targetDir, subDir=subDir)
+
+
+def meanBlobDiskSizeUsingGit(repoDir: Path) -> int:
+	"""The mean compressed size of the blobs present in a repo, close to the size of a blob in a pack transferred. Missing blobs of partial clones are not fetched."""
+
+	sizes = []
+	for line in str(gitCatFileDiskSizes("--batch-all-objects", _cwd=repoDir, _env=dict(os.environ, **NO_LAZY_FETCH_ENV))).splitlines():
+		parts = line.split()
+		if len(parts) == 2 and parts[0] == "blob":
+			sizes.append(int(parts[1]))
+
+	return sum(sizes) // len(sizes) if sizes else DEFAULT_BLOB_DISK_SIZE
+
+
+def estimateCheckoutUsingGit(uri: str, targetDir: Path, revision: str, subDir: SubDirsT = None, mirrors: typing.Optional[MirrorsCache] = None) -> typing.Tuple[int, int, int]:
+	"""Estimates the second phase of two-phase fetching without fetching anything. Returns the count of files to be checked out, the count of the ones which contents are not yet in the mirror and would be downloaded, and the estimated size of the download in bytes.
+	A blobless mirror doesn't know the sizes of the blobs it lacks, they are assumed to be of the mean size of the blobs it has."""
+
+	mirrors = _getMirrors(mirrors, targetDir)
+	trees = [revision + ":" + d.strip("/") for d in toSubDirs(subDir)] or [revision + "^{tree}"]
+
+	with mirrors.use(MIRRORS_KIND, uri) as mirrorDir:
+		blobs = [l for l in str(gitRevListBlobsMissing(*trees, _cwd=mirrorDir)).splitlines() if l.strip()]
+		missingCount = sum(1 for l in blobs if l.startswith("?"))
+		return len(blobs), missingCount, missingCount * meanBlobDiskSizeUsingGit(mirrorDir) if missingCount else 0
+
+
+def isShallowUsingGit(repoDir: Path) -> bool:
+	return str(gitRevParse("--is-shallow-repository", _cwd=repoDir)).strip() == "true"
+
+
+def isTagReachableUsingGit(repoDir: Path, revision: str) -> bool:
+	try:
+		gitDescribeTag(revision, _cwd=repoDir)
+	except Exception:
+		return False
+
+	return True
+
+
+DEEPEN_INITIAL_STEP = 16
+DEEPEN_MAX_DEPTH = 4096
+
+
+def deepenUntilTagReachable(repoDir: Path, revision: str, fetchArgs: typing.Iterable[str]) -> bool:
+	"""Fetches more history of a shallow repo with `git fetch --deepen`, doubling the step each time, until a tag is reachable from `revision`. Unshallows the repo if no tag is found within `DEEPEN_MAX_DEPTH` commits. Returns `False` if there are no tags in the whole history."""
+
+	fetchArgs = tuple(fetchArgs)
+	step = DEEPEN_INITIAL_STEP
+	deepened = 0
+
+	while not isTagReachableUsingGit(repoDir, revision):
+		if not isShallowUsingGit(repoDir):
+			return False
+
+		if deepened >= DEEPEN_MAX_DEPTH:
+			gitFetch("--unshallow", *fetchArgs, _cwd=repoDir)
+			continue
+
+		gitFetch("--deepen=" + str(step), *fetchArgs, _cwd=repoDir)
+		deepened += step
+		step *= 2
+
+	return True
+
+
+def deepenUsingGit(uri: str, targetDir: Path, revision: str, refSpec: typing.Optional[str] = None, mirrors: typing.Optional[MirrorsCache] = None) -> bool:
+	"""Makes the nearest tag reachable from `revision` for the build backends computing versions from tags (`setuptools_scm` and the like), so repos can be fetched at depth 1 by default. Works both on a direct clone in `targetDir` and on the mirror the worktree in `targetDir` belongs to."""
+
+	targetDir = Path(targetDir)
+	if (targetDir / ".git").is_dir():  # a direct clone, a worktree has a `.git` file
+		return deepenUntilTagReachable(targetDir, revision, ("origin",))
+
+	mirrors = _getMirrors(mirrors, targetDir)
+	with mirrors.use(MIRRORS_KIND, uri) as mirrorDir:
+		return deepenUntilTagReachable(mirrorDir, revision, MIRROR_FETCH_ARGS + ("origin", mirrorFetchRefSpec(refSpec)))
+
+
+def hasCommitUsingGit(repoDir: Path, revision: str) -> bool:
+	if not (repoDir / "config").is_file():
+		return False
+
+	try:
+		gitCatFileExists(revision + "^{commit}", _cwd=repoDir)
+	except Exception:
+		return False
+
+	return True
+
+
+def fetchRevisionUsingGit(uri: str, targetDir: Path, revision: str, depth: int = 1, subDir: SubDirsT = None, mirrors: typing.Optional[MirrorsCache] = None) -> str:
+	"""Fetches the exact commit `revision` (i.e. recorded into a lockfile) through a mirror and checks it out. Nothing is transferred if the mirror already has the commit. Returns the hash of the commit."""
+
+	mirrors = _getMirrors(mirrors, targetDir)
+
+	with bundleForNewMirror(mirrors, uri) as bundle, mirrors.use(MIRRORS_KIND, uri) as mirrorDir:
+		if not hasCommitUsingGit(mirrorDir, revision):
+			updateMirror(uri, mirrorDir, depth=depth, refSpec=revision, bundle=bundle)
+		return checkoutFromMirror(mirrorDir, revision, targetDir, subDir=subDir)
+
+
 tier = BootstrapTier.bootstrap
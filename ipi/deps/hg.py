@@ -1,17 +1,110 @@
+import re
+import sys
 import typing
 from pathlib import Path
 from warnings import warn
 
 from ..bootstrap.tiers import BootstrapTier
 from . import sh
+from ..utils import SubDirsT
+from .mirrors import MirrorsCache, getDefaultMirrorsCache
 
-hg = sh.Command("hg").bake(_fg=True)
-hgClone = hg.bake("clone", "--rev", "default")
+hgOut = sh.Command("hg")
+hgIdentify = hgOut.bake("identify", "--debug", "--id")
+hg = hgOut.bake(_fg=True)
+hgNet = hgOut.bake(_out=sys.stdout, _err=sys.stderr, _tee="err")  # the network operations: stderr is both shown and kept in the errors, so the transient failures can be told and retried
+hgClone = hgNet.bake("clone")
+hgInit = hg.bake("init")
+hgPull = hgNet.bake("pull")
+hgShare = hg.bake("--config", "extensions.share=", "share", "--noupdate")
+hgUpdate = hg.bake("update", "--clean")
 
+MIRRORS_KIND = "hg"
+DEFAULT_REV = "default"
+
+changesetHashRx = re.compile("^[0-9a-f]{12,40}$")
+
+
+def getRevisionUsingMercurial(repoDir: Path) -> str:
+	return str(hgOut("log", "--rev", ".", "--template", "{node}", _cwd=repoDir)).strip()
+
+
+def getRemoteRevisionUsingMercurial(uri: str, refSpec: typing.Optional[str] = None) -> typing.Optional[str]:
+	"""Asks the remote which changeset `refSpec` (the `default` branch if not set) points to without pulling anything"""
+
+	res = str(hgIdentify("--rev", refSpec if refSpec else DEFAULT_REV, uri)).strip()
+	return res if res else None
+
+
+def cloneUsingMercurial(uri: str, targetDir: Path, depth: int = 50, refSpec: typing.Optional[str] = None) -> str:
+	"""Clones directly from the network, without any mirror, only `refSpec` (the `default` branch if not set) and its ancestors. Returns the hash of the changeset checked out."""
 
-def fetchUsingMercurial(uri: str, targetDir: Path, depth: int = 50, refSpec: typing.Optional[str] = None):
 	warn("depth is not supported for hg, see https://www.mercurial-scm.org/wiki/ShallowClone")
-	return hgClone(uri, targetDir)
+	rev = refSpec if refSpec else DEFAULT_REV
+	hgClone("--rev", rev, uri, targetDir)
+	res = getRevisionUsingMercurial(targetDir)
+	if changesetHashRx.match(rev) and not res.startswith(rev):
+		raise RuntimeError("Cloned a changeset other than requested", uri, rev, res)
+	return res
+
+
+def updateMirror(uri: str, mirrorDir: Path, refSpec: typing.Optional[str] = None):
+	"""Pulls `refSpec` (the `default` branch if not set) into a local store, creating it if needed. Only the changesets missing in the store are transferred."""
+
+	if not (mirrorDir / ".hg").is_dir():
+		mirrorDir.mkdir(parents=True, exist_ok=True)
+		hgInit(_cwd=mirrorDir)
+		(mirrorDir / ".hg" / "hgrc").write_text("[paths]\ndefault = " + uri + "\n")
+
+	hgPull("--rev", refSpec if refSpec else DEFAULT_REV, uri, _cwd=mirrorDir)
+
+
+def checkoutFromMirror(mirrorDir: Path, targetDir: Path, refSpec: typing.Optional[str] = None) -> str:
+	"""Creates a working copy sharing the store of the mirror in `targetDir`. Returns the hash of the changeset checked out."""
+
+	targetDir = Path(targetDir).absolute()
+	hgShare(mirrorDir, targetDir)
+	hgUpdate("--rev", refSpec if refSpec else DEFAULT_REV, _cwd=targetDir)
+	return getRevisionUsingMercurial(targetDir)
+
+
+def fetchUsingMercurial(uri: str, targetDir: Path, depth: int = 50, refSpec: typing.Optional[str] = None, subDir: SubDirsT = None, mirrors: typing.Optional[MirrorsCache] = None) -> str:
+	"""Fetches a repo through a persistent local store (the same place and eviction policy as the git mirrors), so the repeated fetches of the same repo pull only the new changesets. The working copy uses the store through the `share` extension.
+	Clones directly if there is no place for mirrors. Returns the hash of the changeset checked out. `subDir` is ignored, the whole repo is checked out."""
+
+	if mirrors is None:
+		mirrors = getDefaultMirrorsCache()
+
+	if mirrors is None:
+		return cloneUsingMercurial(uri, targetDir, depth=depth, refSpec=refSpec)
+
+	with mirrors.use(MIRRORS_KIND, uri) as mirrorDir:
+		updateMirror(uri, mirrorDir, refSpec=refSpec)
+		return checkoutFromMirror(mirrorDir, targetDir, refSpec=refSpec)
+
+
+def widenCheckoutUsingMercurial(uri: str, targetDir: Path, subDir: SubDirsT = None, mirrors: typing.Optional[MirrorsCache] = None):
+	"""Nothing to do, `fetchUsingMercurial` always checks out the whole repo"""
+
+
+def prefetchUsingMercurial(uri: str, targetDir: Path, refSpec: typing.Optional[str] = None, mirrors: typing.Optional[MirrorsCache] = None):
+	"""Brings the local store up to date without creating a working copy. Does nothing if there is no place for mirrors, the fetch would clone directly then."""
+
+	if mirrors is None:
+		mirrors = getDefaultMirrorsCache()
+
+	if mirrors is None:
+		return
+
+	with mirrors.use(MIRRORS_KIND, uri, blocking=False) as mirrorDir:
+		if mirrorDir is not None:  # otherwise it is being updated right now anyway
+			updateMirror(uri, mirrorDir, refSpec=refSpec)
+
+
+def fetchRevisionUsingMercurial(uri: str, targetDir: Path, revision: str, depth: int = 1, subDir: SubDirsT = None, mirrors: typing.Optional[MirrorsCache] = None) -> str:
+	"""Fetches the exact changeset `revision` (i.e. recorded into a lockfile)"""
+
+	return fetchUsingMercurial(uri, targetDir, depth=depth, refSpec=revision, subDir=subDir, mirrors=mirrors)
 
 
 tier = BootstrapTier.bootstrap
@@ -0,0 +1,32 @@
+import typing
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+from ..bootstrap.tiers import BootstrapTier
+
+__all__ = ("locateLocalSources",)
+
+
+def localPathFromURI(uri: str) -> Path:
+	"""Accepts both plain paths and `file://` URIs"""
+
+	if uri.startswith("file://"):
+		return Path(unquote(urlparse(uri).path))
+
+	return Path(uri).expanduser()
+
+
+def locateLocalSources(uri: str, subDir: typing.Optional[str] = None) -> Path:
+	"""`Source.path` packages are neither cloned nor copied: their dir (a local dir or a worktree of a repo already checked out) is used in place. Returns the absolute path of the dir of the package."""
+
+	res = localPathFromURI(uri)
+	if subDir:
+		res = res / subDir
+
+	if not res.is_dir():
+		raise FileNotFoundError("The dir of local sources doesn't exist", str(res))
+
+	return res.absolute().resolve()
+
+
+tier = BootstrapTier.bootstrap
@@ -0,0 +1,161 @@
+import hashlib
+import re
+import shutil
+import threading
+import time
+import typing
+from contextlib import contextmanager
+from pathlib import Path
+
+from ..bootstrap.tiers import BootstrapTier
+from ..utils.repoURINormalizer import normalizeRepoURI
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+__all__ = ("MirrorsCache", "getDefaultMirrorsCache")
+
+unsafeCharsRx = re.compile("[^\\w.-]+")
+
+
+class MirrorsCache:
+	"""A persistent storage of local mirrors of remote repos shared between `ipi` sessions.
+	Mirrors are grouped by VCS (`kind`) and keyed by normalized URIs of the repos. A mirror not used for `maxAge` seconds is evicted."""
+
+	__slots__ = ("root", "maxAge", "_locks", "_locksLock")
+
+	DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+	STAMP_FILE_NAME = "ipi_last_used"
+
+	def __init__(self, root: Path, maxAge: typing.Optional[float] = None) -> None:
+		if maxAge is None:
+			maxAge = self.__class__.DEFAULT_MAX_AGE
+
+		self.root = root
+		self.maxAge = maxAge
+		self._locks = {}
+		self._locksLock = threading.Lock()
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.root) + ", maxAge=" + repr(self.maxAge) + ")"
+
+	@classmethod
+	def keyForURI(cls, uri: str) -> str:
+		normalized = normalizeRepoURI(uri)
+		readable = unsafeCharsRx.sub("_", normalized.split("://", 1)[-1]).strip("_")
+		return readable[-64:] + "-" + hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+	def pathFor(self, kind: str, uri: str) -> Path:
+		return self.root / kind / self.__class__.keyForURI(uri)
+
+	def _threadLock(self, mirrorDir: Path) -> threading.Lock:
+		with self._locksLock:
+			lock = self._locks.get(mirrorDir, None)
+			if lock is None:
+				lock = self._locks[mirrorDir] = threading.Lock()
+			return lock
+
+	@contextmanager
+	def lock(self, mirrorDir: Path, blocking: bool = True):
+		"""Serializes access to a mirror both across threads of this process and across processes. Yields `False` if not `blocking` and the mirror is busy."""
+
+		tl = self._threadLock(mirrorDir)
+		if not tl.acquire(blocking):
+			yield False
+			return
+
+		try:
+			if fcntl is None:
+				yield True
+				return
+
+			mirrorDir.parent.mkdir(parents=True, exist_ok=True)
+			with open(str(mirrorDir) + ".lock", "wb") as lockFile:
+				try:
+					fcntl.flock(lockFile, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+				except BlockingIOError:
+					yield False
+					return
+
+				try:
+					yield True
+				finally:
+					fcntl.flock(lockFile, fcntl.LOCK_UN)
+		finally:
+			tl.release()
+
+	@contextmanager
+	def use(self, kind: str, uri: str, blocking: bool = True):
+		"""Locks the mirror of `uri` and marks it as recently used. Yields the path of the mirror, which may not yet exist. Yields `None` if not `blocking` and the mirror is busy."""
+
+		mirrorDir = self.pathFor(kind, uri)
+		with self.lock(mirrorDir, blocking=blocking) as acquired:
+			if not acquired:
+				yield None
+				return
+
+			yield mirrorDir
+			if mirrorDir.is_dir():
+				(mirrorDir / self.__class__.STAMP_FILE_NAME).touch()
+
+	def lastUsed(self, mirrorDir: Path) -> float:
+		stamp = mirrorDir / self.__class__.STAMP_FILE_NAME
+		if stamp.is_file():
+			return stamp.stat().st_mtime
+		return mirrorDir.stat().st_mtime
+
+	def __iter__(self) -> typing.Iterator[Path]:
+		if not self.root.is_dir():
+			return
+
+		for kindDir in self.root.iterdir():
+			if kindDir.is_dir():
+				for mirrorDir in kindDir.iterdir():
+					if mirrorDir.is_dir():
+						yield mirrorDir
+
+	def evict(self, maxAge: typing.Optional[float] = None) -> typing.List[Path]:
+		"""Removes the mirrors not used for `maxAge` seconds. The mirrors being used right now are skipped."""
+
+		if maxAge is None:
+			maxAge = self.maxAge
+
+		threshold = time.time() - maxAge
+		evicted = []
+		for mirrorDir in list(self):
+			if self.lastUsed(mirrorDir) >= threshold:
+				continue
+
+			with self.lock(mirrorDir, blocking=False) as acquired:
+				if acquired:
+					shutil.rmtree(mirrorDir, ignore_errors=True)
+					evicted.append(mirrorDir)
+
+		return evicted
+
+
+_defaultMirrorsCache = None
+_defaultMirrorsCacheLock = threading.Lock()
+
+
+def getDefaultMirrorsCache() -> typing.Optional[MirrorsCache]:
+	"""Returns the mirrors cache within the settings dir, evicting the stale mirrors on the first call. `None` if there is no settings dir."""
+
+	global _defaultMirrorsCache
+
+	with _defaultMirrorsCacheLock:
+		if _defaultMirrorsCache is None:
+			from ..settings import mirrorsDir
+
+			if mirrorsDir is None:
+				return None
+
+			_defaultMirrorsCache = MirrorsCache(mirrorsDir)
+			_defaultMirrorsCache.evict()
+
+	return _defaultMirrorsCache
+
+
+tier = BootstrapTier.bootstrap
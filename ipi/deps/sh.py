@@ -25,13 +25,13 @@ except ImportError:
 			self.env = _env
 			self.cwd = _cwd
 
-		def bake(self, *args, _env: EnvT = None, _fg: bool = False, _cwd: Path = None, **kwargs):
+		def bake(self, *args, _env: EnvT = None, _fg: bool = False, _cwd: Path = None, _out: typing.Any = None, _err: typing.Any = None, _tee: typing.Any = None, **kwargs):  # the output is always both captured and shown
 			if kwargs:
 				raise NotImplementedError("For kwargs you need to bootstrap this tool.")
 
 			return self.__class__(*(self.args + tuple(args)), _env=self.env | _env if _env else self.env, _cwd=_cwd if _cwd is not None else self.cwd)
 
-		def __call__(self, *args, _env: EnvT = None, _fg: bool = False, _in: str = None, _cwd: Path = None, **kwargs):
+		def __call__(self, *args, _env: EnvT = None, _fg: bool = False, _in: str = None, _cwd: Path = None, _out: typing.Any = None, _err: typing.Any = None, _tee: typing.Any = None, **kwargs):
 			o = self.bake(*args, _env=_env, _fg=_fg, _cwd=_cwd, **kwargs)
 
 			# stdout=subprocess.PIPE, stderr=subprocess.PIPE
@@ -39,7 +39,7 @@ except ImportError:
 			if isinstance(input, str):
 				input = input.encode("utf-8")
 
-			res = subprocess.run(tuple(str(el) for el in o.args), cwd=o.cwd, env=o.env, input=input, check=False, capture_output=True, shell=False)
+			res = subprocess.run(tuple(str(el) for el in o.args), cwd=o.cwd, env=o.env if o.env else None, input=input, check=False, capture_output=True, shell=False)  # like `sh`, the environment is inherited if `_env` is not set
 			sys.stdout.flush()
 			sys.stderr.flush()
 
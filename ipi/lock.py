@@ -0,0 +1,243 @@
+"""Lockfiles record the result of a resolution: the exact revisions of the packages to install, in the order of installation. Replaying a lockfile skips registry lookups, metadata extraction and resolution."""
+
+import typing
+from functools import partial
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from .deps.fetchers import Source, SourceFetcher, fetchers, historyDeepeners, inPlaceLocators, revisionFetchers
+from .deps.git import closeCatFileBatches
+from .resolver import DEPS_KINDS, DepsKindID, InstallationCollection, InstallationTarget, PackageFetcher, mergeSubDirs, removeLeftovers
+from .utils.FetchPool import FetchPool, PackagesFetchingError
+from .utils.FetchScheduler import getDefaultFetchScheduler
+from .utils.json import json
+from .utils.styles import styles
+
+__all__ = ("Lock", "LockedPackage", "LockReplayer", "LOCK_FORMAT_VERSION")
+
+LOCK_FORMAT_VERSION = 1
+
+
+class LockedPackage:
+	__slots__ = ("name", "kind", "regPath", "fetcher", "revision", "deps", "buildDeps", "tagsNeeded")
+
+	def __init__(self, name: str, kind: DepsKindID, regPath: typing.Sequence[str], fetcher: SourceFetcher, revision: typing.Optional[str], deps: typing.Sequence[str] = (), buildDeps: typing.Sequence[str] = (), tagsNeeded: bool = False):
+		self.name = name
+		self.kind = kind
+		self.regPath = tuple(regPath)
+		self.fetcher = fetcher
+		self.revision = revision
+		self.deps = tuple(deps)
+		self.buildDeps = tuple(buildDeps)
+		self.tagsNeeded = tagsNeeded
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + ", ".join(repr(getattr(self, k)) for k in self.__class__.__slots__) + ")"
+
+	def toJSON(self) -> dict:
+		f = self.fetcher
+		res = {
+			"name": self.name,
+			"kind": self.kind.name,
+			"regPath": list(self.regPath),
+			"fetcher": f.type.name,
+			"repo": f.repo,
+			"revision": self.revision,
+		}
+		for k in ("subDir", "refSpec", "bundle"):
+			v = getattr(f, k)
+			if v:
+				res[k] = v
+
+		res["deps"] = list(self.deps)
+		res["buildDeps"] = list(self.buildDeps)
+		if self.tagsNeeded:
+			res["tagsNeeded"] = True
+		return res
+
+	@classmethod
+	def fromJSON(cls, d: dict) -> "LockedPackage":
+		fetcher = SourceFetcher(Source[d["fetcher"]], d["repo"], d.get("subDir", None), d.get("refSpec", None), bundle=d.get("bundle", None))
+		return cls(d["name"], DepsKindID[d["kind"]], d.get("regPath", ()), fetcher, d.get("revision", None), d.get("deps", ()), d.get("buildDeps", ()), d.get("tagsNeeded", False))
+
+	def toDirectURL(self) -> typing.Optional[dict]:
+		"""PEP 610 `direct_url.json` of the package installed from the locked revision"""
+
+		if self.revision or self.fetcher.type in inPlaceLocators:
+			return self.fetcher.toDirectURL(self.revision)
+		return None
+
+
+class Lock:
+	"""The packages are stored in the order of installation"""
+
+	__slots__ = ("packages",)
+
+	def __init__(self, packages: typing.Iterable[LockedPackage]):
+		self.packages = list(packages)
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.packages) + ")"
+
+	@classmethod
+	def fromResolution(cls, session: PackageFetcher) -> "Lock":
+		"""Records the install plan of a resolution. The packages which suitable versions are already installed are not in the plan, so they are not recorded."""
+
+		res = []
+		for node in session.graph.installPlan():
+			lookupRes = session.registry.lookup(node.name)
+			fetcherSpec = lookupRes.pkg.fetcher
+			res.append(
+				LockedPackage(
+					node.name,
+					DepsKindID.build if node.neededForBuild else DepsKindID.pkgs,
+					[r.name for r in lookupRes.regPath],
+					fetcherSpec,
+					fetcherSpec.recordedRevision(session.directURLs.get(node.name, None)),
+					deps=[k for k, v in node.deps.items() if v == DepsKindID.pkgs],
+					buildDeps=[k for k, v in node.deps.items() if v == DepsKindID.build],
+					tagsNeeded=node.name in session.versionedUsingVCS,
+				)
+			)
+
+		return cls(res)
+
+	def depsHints(self) -> typing.Dict[str, typing.Tuple[str, ...]]:
+		"""The deps of the packages as they were resolved, used to guess the deps before the packages are fetched when they are resolved again"""
+
+		return {p.name: p.buildDeps + p.deps for p in self.packages}
+
+	def toJSON(self) -> dict:
+		return {"version": LOCK_FORMAT_VERSION, "packages": [p.toJSON() for p in self.packages]}
+
+	@classmethod
+	def fromJSON(cls, d: dict) -> "Lock":
+		version = d.get("version", None)
+		if version != LOCK_FORMAT_VERSION:
+			raise ValueError("Unsupported version of the lockfile format", version, LOCK_FORMAT_VERSION)
+
+		return cls(LockedPackage.fromJSON(p) for p in d["packages"])
+
+	def save(self, path: Path):
+		path.write_text(json.dumps(self.toJSON(), indent="\t"))
+
+	@classmethod
+	def load(cls, path: Path) -> "Lock":
+		return cls.fromJSON(json.loads(path.read_text()))
+
+
+class LockReplayer:
+	"""Fetches the exact revisions recorded in a lockfile concurrently and returns them as `InstallationCollection`s, like `PackageFetcher` does."""
+
+	__slots__ = ("lock", "pool", "sourcesDir")
+
+	def __init__(self, lock: Lock, pool: typing.Optional[FetchPool] = None):
+		if pool is None:
+			pool = FetchPool()
+
+		self.lock = lock
+		self.pool = pool
+		self.sourcesDir = None
+
+	def __enter__(self):
+		self.sourcesDir = TemporaryDirectory(prefix="install_", dir=Path("."))
+		return self
+
+	def __exit__(self, *args, **kwargs):
+		self.clean()
+
+	@property
+	def sourcesPath(self) -> Path:
+		return Path(self.sourcesDir.name)
+
+	def clean(self):
+		closeCatFileBatches()
+		if self.sourcesDir:
+			self.sourcesDir.cleanup()
+		self.sourcesDir = None
+
+	def _fetch(self) -> typing.Tuple[typing.Dict[str, Path], typing.Dict[str, Path]]:
+		scheduler = getDefaultFetchScheduler()
+		installDirs = {}
+		repoDirs = {}
+		errors = {}
+		groups = {}
+
+		for p in self.lock.packages:
+			fetcherSpec = p.fetcher
+			if fetcherSpec.type in inPlaceLocators:
+				try:
+					installDirs[p.name] = inPlaceLocators[fetcherSpec.type](fetcherSpec.repo, fetcherSpec.subDir)
+				except Exception as ex:
+					errors[p.name] = ex
+				continue
+
+			groups.setdefault(fetcherSpec.repoKey + (p.revision,), []).append(p)
+
+		tasks = {}
+		members = {}
+		for group in groups.values():
+			first = group[0]
+			fetcherSpec = first.fetcher
+			repoDir = self.sourcesPath / first.name
+			subDir = mergeSubDirs(p.fetcher.subDir for p in group)
+			members[first.name] = group
+
+			revisionFetcher = revisionFetchers.get(fetcherSpec.type, None) if first.revision else None
+			if revisionFetcher is not None:
+				fetcher = partial(revisionFetcher, fetcherSpec.repo, repoDir, first.revision, subDir=subDir)
+			else:  # i.e. archives, which revisions cannot be requested
+				fetcher = partial(fetchers[fetcherSpec.type], fetcherSpec.repo, repoDir, refSpec=fetcherSpec.refSpec, subDir=subDir, **fetcherSpec.fetcherKwargs)
+
+			tasks[first.name] = partial(scheduler, fetcherSpec.repo, fetcher, cleanup=partial(removeLeftovers, repoDir))
+
+			for p in group:
+				installDirs[p.name] = repoDir / p.fetcher.subDir if p.fetcher.subDir else repoDir
+				repoDirs[p.name] = repoDir
+
+		fetchedRevisions, groupErrors = self.pool(tasks)
+
+		for groupName, revision in fetchedRevisions.items():
+			expected = members[groupName][0].revision
+			if expected and revisionFetchers.get(members[groupName][0].fetcher.type, None) is not None and revision != expected:
+				groupErrors[groupName] = RuntimeError("Fetched revision doesn't match the locked one", revision, expected)
+
+		for groupName, ex in groupErrors.items():
+			for p in members[groupName]:
+				errors[p.name] = ex
+
+		if errors:
+			for name, ex in errors.items():
+				print(styles.error("Error") + " " + styles.operationName("fetching") + " locked " + styles.varContent(name) + ": " + repr(ex))
+			raise PackagesFetchingError("Failed to fetch some locked packages", errors)
+
+		return installDirs, repoDirs
+
+	def _deepen(self, repoDirs: typing.Mapping[str, Path]):
+		scheduler = getDefaultFetchScheduler()
+		tasks = {}
+		seenRepoDirs = set()
+
+		for p in self.lock.packages:
+			deepener = historyDeepeners.get(p.fetcher.type, None)
+			repoDir = repoDirs.get(p.name, None)
+			if not p.tagsNeeded or deepener is None or not p.revision or repoDir is None or repoDir in seenRepoDirs:
+				continue
+
+			seenRepoDirs.add(repoDir)
+			tasks[p.name] = partial(scheduler, p.fetcher.repo, deepener, p.fetcher.repo, repoDir, p.revision, refSpec=p.revision)
+
+		_, errors = self.pool(tasks)
+		if errors:
+			raise PackagesFetchingError("Failed to fetch history of some locked packages", errors)
+
+	def __call__(self) -> typing.Tuple[InstallationCollection, ...]:
+		installDirs, repoDirs = self._fetch()
+		self._deepen(repoDirs)
+
+		res = tuple(InstallationCollection(dk, []) for dk in DEPS_KINDS.values())
+		for p in self.lock.packages:
+			res[p.kind].targets.append(InstallationTarget(installDirs[p.name], p.toDirectURL(), name=p.name, buildDeps=p.buildDeps, deps=p.deps))
+
+		print(styles.success("Fetched") + " " + str(len(self.lock.packages)) + " locked " + styles.entity("packages"))
+		return res
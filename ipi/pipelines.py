@@ -2,6 +2,7 @@
 
 import json
 import re
+import shutil
 import sys
 import typing
 from collections import defaultdict
@@ -12,38 +13,252 @@ from tempfile import TemporaryDirectory, mkdtemp
 
 from . import resolver
 from .deps import sh
+from .deps.git import getTreeUsingGit
 from .deps.icecream import ic
 from .deps.packaging import Requirement
-from .resolver import InstallationCollection, InstallationTarget, PackageFetcher, ResolutionPrefs, clonePackagesRepos
+from .resolver import DEPS_KINDS, InstallationCollection, InstallationTarget, PackageFetcher, ResolutionPrefs, clonePackagesRepos
 from .tools import install
 from .tools.python import python
 from .tools.setup_py import wheelCmd
-from .utils import pythonBuild
+from .utils import canonicalizePackageName, formatSize, pythonBuild
 from .utils.CLICookie import CLICookie
+from .utils.BuildPool import BuildPool
+from .utils.buildWorkers import closeBuildWorkers, getDefaultBuildWorkers
+from .utils.FetchPool import FetchPool
+from .utils.metadataCache import metadataCacheKey
 from .utils.metadataExtractor import canonicalizedRequirement, extractMetadata
+from .utils.negativeCache import KnownFailureError, getDefaultNegativeCache
 from .utils.styles import styles
+from .utils.wheelCache import getDefaultWheelCache, wheelCacheKey
 from .utils.WithPythonPath import cookPythonPathEnvDict
 
 standalonePEP517Cmd = python.bake("-m", pythonBuild.__spec__.name)
 
 
+class WheelBuildError(RuntimeError):
+	"""Building a wheel has failed, as opposed to installing it"""
+
+	__slots__ = ()
+
+
 class PackagesInstaller:
-	__slots__ = ("registry",)
+	"""If `sessionDir` is set, the progress of the installations is checkpointed into it, so a failed one can be `resume`d. An unfinished session in it is not discarded by a new installation unless `discardSession`. If `buildPool` allows concurrency, the packages are built concurrently, otherwise one by one."""
 
-	def __init__(self, registry: "IRegistry"):
+	__slots__ = ("registry", "fetchPool", "sessionDir", "discardSession", "buildPool")
+
+	def __init__(self, registry: "IRegistry", fetchPool: typing.Optional[FetchPool] = None, sessionDir: typing.Optional[Path] = None, buildPool: typing.Optional[BuildPool] = None, discardSession: bool = False):
 		self.registry = registry
+		self.fetchPool = fetchPool
+		self.sessionDir = sessionDir
+		self.discardSession = discardSession
+		self.buildPool = buildPool
+
+	def _ensureCanCreateSession(self):
+		"""Fails before anything is fetched, rather than after the resolution"""
+
+		if self.sessionDir is not None:
+			from .session import InstallSession
+
+			InstallSession.ensureCanCreate(self.sessionDir, self.discardSession)
+
+	def _createSession(self, lock: "Lock") -> typing.Optional["InstallSession"]:
+		if self.sessionDir is None:
+			return None
+
+		from .session import InstallSession
+
+		return InstallSession.create(self.sessionDir, lock, self.discardSession)
 
-	def __call__(self, prefs: ResolutionPrefs, names: typing.Collection[str]):
-		with PackageFetcher(self.registry) as fetcher:
+	def __call__(self, prefs: ResolutionPrefs, names: typing.Collection[str], depsHints: typing.Optional[typing.Mapping[str, typing.Sequence[str]]] = None):
+		from .lock import Lock
+
+		self._ensureCanCreateSession()
+		with PackageFetcher(self.registry, self.fetchPool, depsHints=depsHints) as fetcher:
 			toInstallCollections = fetcher(prefs, names)
+			session = self._createSession(Lock.fromResolution(fetcher))
+			try:
+				self.installCollections(toInstallCollections, fetcher.sourcesPath, session)
+			finally:
+				if session is not None:
+					session.close()
+
+	def lock(self, prefs: ResolutionPrefs, names: typing.Collection[str], targetEnvironment: typing.Optional["TargetEnvironment"] = None) -> "Lock":
+		"""Resolves the packages without installing them. The environment markers are evaluated against `targetEnvironment` (the current interpreter if not set)."""
+
+		from .lock import Lock
+
+		with PackageFetcher(self.registry, self.fetchPool, targetEnvironment=targetEnvironment) as fetcher:
+			fetcher(prefs, names, fetchHistories=False)  # the replay fetches the histories itself
+			return Lock.fromResolution(fetcher)
+
+	def plan(self, prefs: ResolutionPrefs, names: typing.Collection[str], depsHints: typing.Optional[typing.Mapping[str, typing.Sequence[str]]] = None) -> "InstallPlan":
+		"""Resolves the packages and tells what installing them would do, without building or installing anything"""
+
+		from .plan import InstallPlan
+
+		with PackageFetcher(self.registry, self.fetchPool, depsHints=depsHints) as fetcher:
+			fetcher(prefs, names, fetchHistories=False)
+			return InstallPlan.fromResolution(fetcher)
+
+	def installFromLock(self, lock: "Lock"):
+		from .lock import LockReplayer
+
+		session = self._createSession(lock)
+		try:
+			with LockReplayer(lock, self.fetchPool) as replayer:
+				self.installCollections(replayer(), replayer.sourcesPath, session)
+		finally:
+			if session is not None:
+				session.close()
+
+	def resume(self):
+		"""Continues the installation checkpointed into `sessionDir` from the last stage each package has completed. Only the packages not yet built are fetched again, at the recorded revisions, the resolution is not repeated."""
 
+		from .lock import LockReplayer
+		from .session import InstallSession, SessionStage
+
+		if self.sessionDir is None:
+			raise ValueError("No unfinished session to resume", self.sessionDir)
+
+		session = InstallSession.load(self.sessionDir)
+		try:
+			toFetch = session.pending(SessionStage.built)
+			print(styles.operationName("Resuming") + " the " + styles.entity("session") + ": " + str(len(session.lock.packages) - len(session.pending(SessionStage.installed).packages)) + " of " + str(len(session.lock.packages)) + " " + styles.entity("packages") + " installed, " + str(len(toFetch.packages)) + " to fetch")
+
+			with LockReplayer(toFetch, self.fetchPool) as replayer:
+				fetched = {t.name: t for c in replayer() for t in c} if toFetch.packages else {}
+
+				res = tuple(InstallationCollection(dk, []) for dk in DEPS_KINDS.values())
+				for p in session.lock.packages:
+					target = fetched.get(p.name, None)
+					if target is None:
+						target = InstallationTarget(None, p.toDirectURL(), name=p.name, buildDeps=p.buildDeps, deps=p.deps)
+					res[p.kind].targets.append(target)
+
+				self.installCollections(res, replayer.sourcesPath, session)
+		finally:
+			session.close()
+
+	def installCollections(self, toInstallCollections: typing.Iterable[InstallationCollection], scratchDir: Path, session: typing.Optional["InstallSession"] = None):
+		"""Fails before building anything if a build of one of the packages at the same commit has failed recently. The failures of builds are remembered. If `session` is given, the packages it has already built or installed are not built again, the progress is checkpointed into it and it is finished when everything is installed."""
+
+		from .session import SessionStage
+
+		toInstallCollections = tuple(toInstallCollections)
+		negativeCache = getDefaultNegativeCache()
+
+		if negativeCache is not None:
+			knownFailures = {}
 			for instalaltionCollection in toInstallCollections:
-				if instalaltionCollection:  # self.resolved, installDirs[t]
-					print(styles.operationName("Installing") + " " + styles.entity(instalaltionCollection.depsKind.packageTypeName) + "s")
-					for installationTarget in instalaltionCollection:
-						buildAndInstallWheel(installationTarget.installDir)
+				for installationTarget in instalaltionCollection:
+					if session is not None and session.stage(installationTarget.name) >= SessionStage.built:
+						continue
+					key = metadataCacheKey(installationTarget.directURL)
+					error = negativeCache.buildFailure(key) if key is not None else None
+					if error is not None:
+						knownFailures[str(installationTarget.installDir)] = error
+
+			if knownFailures:
+				for packageDir, error in knownFailures.items():
+					print(styles.error("Build has recently failed") + " for " + styles.varContent(packageDir) + " at the same commit: " + error)
+				raise KnownFailureError("Builds of some packages have recently failed at the same commits. Use `--refresh` to build them anyway.", knownFailures)
+
+		try:
+			with TemporaryDirectory(prefix="wheels", dir=scratchDir) as wheelsDir:  # the sources of `Source.path` packages are used in place, they are not scratch space
+				wheelsDir = Path(wheelsDir)
+				if self.buildPool is None or self.buildPool.concurrency == 1:
+					for instalaltionCollection in toInstallCollections:
+						if instalaltionCollection:  # self.resolved, installDirs[t]
+							print(styles.operationName("Installing") + " " + styles.entity(instalaltionCollection.depsKind.packageTypeName) + "s")
+							for installationTarget in instalaltionCollection:
+								self._installBuilt(installationTarget, self._buildTarget(installationTarget, wheelsDir, session, negativeCache), session)
+						else:
+							print(styles.success("No " + styles.entity(instalaltionCollection.depsKind.packageTypeName) + "s to install"))
 				else:
-					print(styles.success("No " + styles.entity(instalaltionCollection.depsKind.packageTypeName) + "s to install"))
+					self._buildAndInstallConcurrently([t for c in toInstallCollections for t in c], wheelsDir, session, negativeCache)
+		except BaseException:
+			if session is not None:
+				print(styles.operationName("Progress saved") + " into " + styles.varContent(str(session.dir)) + ", use `--resume` to continue")
+			raise
+		finally:
+			closeBuildWorkers()
+
+		if session is not None:
+			session.finish()
+
+	def _buildAndInstallConcurrently(self, targets: typing.Sequence[InstallationTarget], wheelsDir: Path, session: typing.Optional["InstallSession"], negativeCache: typing.Optional["NegativeCache"]):
+		"""A package is built as soon as its build deps and their deps are installed, the independent ones are built concurrently, each in its own subprocess"""
+
+		byName = {t.name: t for t in targets}
+		names = list(byName)
+
+		def targetDeps(name: str) -> typing.Iterable[str]:
+			t = byName[name]
+			return (d for d in tuple(t.buildDeps or ()) + tuple(t.deps or ()) if d in byName)
+
+		buildPrereqs = {}
+		for name, t in byName.items():
+			res = set()
+			stack = [d for d in (t.buildDeps or ()) if d in byName]
+			while stack:
+				dep = stack.pop()
+				if dep not in res:
+					res.add(dep)
+					stack.extend(targetDeps(dep))
+			buildPrereqs[name] = res
+
+		installPrereqs = {name: set(targetDeps(name)) for name in names}
+
+		print(styles.operationName("Installing") + " " + str(len(names)) + " " + styles.entity("packages") + ", up to " + str(self.buildPool.concurrency) + " built concurrently")
+		self.buildPool(names, buildPrereqs, installPrereqs, lambda name: self._buildTarget(byName[name], wheelsDir, session, negativeCache, _remote=True), lambda name, builtWheel: self._installBuilt(byName[name], builtWheel, session))
+
+	def _buildTarget(self, installationTarget: InstallationTarget, wheelsDir: Path, session: typing.Optional["InstallSession"], negativeCache: typing.Optional["NegativeCache"], _remote: bool = False) -> typing.Optional[Path]:
+		"""Returns the wheel to install, `None` if the session has already installed it. Without a session the wheel is built into a new dir within `wheelsDir`."""
+
+		from .session import SessionStage
+
+		name = installationTarget.name
+		stage = session.stage(name) if session is not None else None
+
+		if stage == SessionStage.installed:
+			print(styles.success("Already installed") + " in the " + styles.entity("session") + ": " + styles.varContent(name) + ", skipping")
+			return None
+
+		if stage == SessionStage.built:
+			builtWheel = session.builtWheel(name)
+			print(styles.success("Already built") + " in the " + styles.entity("session") + ": " + styles.varContent(builtWheel.name))
+			return builtWheel
+
+		installationTarget.checkout()
+		key = metadataCacheKey(installationTarget.directURL)
+		buildDeps = installationTarget.buildDeps if key is not None else None  # the contents of the sources not at a commit are not identified by a tree, so their wheels are not cached
+		if negativeCache is None:
+			key = None
+
+		try:
+			builtWheel = buildWheelChecked(installationTarget.installDir, session.wheelsDir(name) if session is not None else Path(mkdtemp(prefix=(name or "") + "_", dir=str(wheelsDir))), buildDeps=buildDeps, _remote=_remote)
+		except WheelBuildError as ex:
+			if key is not None:
+				negativeCache.recordBuildFailure(key, ex.__cause__ if ex.__cause__ is not None else ex)
+			raise
+
+		if key is not None:
+			negativeCache.forgetBuildFailure(key)
+
+		if session is not None:
+			session.markBuilt(name, builtWheel)
+
+		return builtWheel
+
+	def _installBuilt(self, installationTarget: InstallationTarget, builtWheel: typing.Optional[Path], session: typing.Optional["InstallSession"]):
+		if builtWheel is None:
+			return
+
+		installWheel(builtWheel, installConfig=install.directURLInstallConfig(installationTarget.directURL))
+		if session is not None:
+			session.markInstalled(installationTarget.name)
+		else:
+			shutil.rmtree(str(builtWheel.parent), ignore_errors=True)
 
 
 def buildWheelUsingRemotePEP517(packageDir: Path, outDir: Path, pythonPath=()):
@@ -53,6 +268,16 @@ def buildWheelUsingRemotePEP517(packageDir: Path, outDir: Path, pythonPath=()):
 	return r.processOutput(str(res))
 
 
+def buildWheelUsingWorker(packageDir: Path, outDir: Path, pythonPath=()):
+	"""Reuses a persistent worker process which has already imported the backend. The in-tree backends (`backend-path`) differ for every package, so they are built by a new process."""
+
+	backend, backendPath = pythonBuild.getBuildBackend(packageDir, pythonPath)
+	if backendPath:
+		return buildWheelUsingRemotePEP517(packageDir, outDir, pythonPath)
+
+	return getDefaultBuildWorkers().build(packageDir, outDir, backend, pythonPath)
+
+
 def buildWheelUsingSetupPy(packageDir: Path, outDir: Path, pythonPath=()):
 	wheelCmd("--dist-dir", outDir, _cwd=packageDir, _env=cookPythonPathEnvDict(pythonPath))
 
@@ -68,9 +293,13 @@ def buildWheelUsingSetupPy(packageDir: Path, outDir: Path, pythonPath=()):
 	return wheelFiles[0]
 
 
-def buildWheel(packageDir: Path, outDir: Path, pythonPath=(), _useSetupPy: bool = False):
+def buildWheel(packageDir: Path, outDir: Path, pythonPath=(), _useSetupPy: bool = False, _remote: bool = False):
+	"""`_remote` builds in a separate process, so builds can run concurrently in threads"""
+
 	ic(packageDir, outDir, pythonPath, _useSetupPy)
 	if not _useSetupPy:
+		if _remote:
+			return buildWheelUsingWorker(packageDir, outDir, pythonPath)
 		return pythonBuild.buildWheelUsingPEP517(packageDir, outDir, pythonPath)
 
 	return buildWheelUsingSetupPy(packageDir, outDir, pythonPath)
@@ -86,20 +315,83 @@ def buildWheelFromGHUri(wheelsDir: Path, uri: str, buildPythonPath=()):
 	return wheel
 
 
-def buildAndInstallWheel(packageDir: Path, buildPythonPath=(), installPythonPath=(), _useSetupPy: bool = False, installBackend=None, installConfig=None):
-	with TemporaryDirectory(prefix="wheels", dir=packageDir) as wheelsDir:
-		wheelsDir = Path(wheelsDir).absolute().resolve()
-		builtWheel = buildWheel(packageDir, wheelsDir, pythonPath=buildPythonPath, _useSetupPy=_useSetupPy)
-		# sudo --preserve-env=PYTHONPATH
+def computeWheelCacheKey(packageDir: Path, buildDeps: typing.Iterable[str], buildPythonPath=(), _useSetupPy: bool = False) -> typing.Optional[str]:
+	"""`None` if the sources are not a checkout of a git commit"""
 
-		if not installPythonPath:
-			if installBackend is None:
-				installBackend = install.REINSTALL_BACKEND
-		else:
-			installBackend = partial(install.pipCliReInstaller, pythonPath=installPythonPath)
+	try:
+		tree = getTreeUsingGit(packageDir)
+	except Exception:
+		return None
+
+	if _useSetupPy:
+		backend = ("setup.py", None)
+	else:
+		backend = pythonBuild.getBuildBackend(packageDir, buildPythonPath)
 
-		print(installBackend)
+	buildDepsVersions = {}
+	for name in buildDeps:
+		version = install.getInstalledPackageVersion(name)
+		buildDepsVersions[canonicalizePackageName(name)] = str(version) if version is not None else None
+
+	return wheelCacheKey(tree, backend, buildDepsVersions)
+
+
+def buildWheelChecked(packageDir: Path, wheelsDir: Path, buildPythonPath=(), _useSetupPy: bool = False, buildDeps: typing.Optional[typing.Iterable[str]] = None, _remote: bool = False) -> Path:
+	"""Distinguishes the failures of building from the ones of installing by raising `WheelBuildError`. If the names of the resolved `buildDeps` are given, the wheel built earlier from the same tree with the same backend and the same versions of the build deps is reused from the wheel cache, and a newly built one is stored into it."""
+
+	wheelsDir = wheelsDir.absolute().resolve()
+	wheelCache = getDefaultWheelCache() if buildDeps is not None else None
+	key = computeWheelCacheKey(packageDir, buildDeps, buildPythonPath, _useSetupPy) if wheelCache is not None else None
+
+	if key is not None:
+		cachedWheel = wheelCache.get(key)
+		if cachedWheel is not None:
+			print(styles.success("Cached") + " " + styles.entity("wheel") + " " + styles.varContent(cachedWheel.name) + " " + styles.operationName("reused"))
+			builtWheel = wheelsDir / cachedWheel.name
+			shutil.copy2(str(cachedWheel), str(builtWheel))
+			return builtWheel
+
+	try:
+		builtWheel = buildWheel(packageDir, wheelsDir, pythonPath=buildPythonPath, _useSetupPy=_useSetupPy, _remote=_remote)
+	except Exception as ex:
+		raise WheelBuildError("Error building wheel", packageDir) from ex
+	print(styles.success("Built") + " " + styles.varContent(builtWheel.name) + ": " + formatSize(builtWheel.stat().st_size))
+
+	if key is not None:
+		try:
+			wheelCache.put(key, builtWheel)
+		except OSError as ex:
+			print(styles.error("Error") + " storing " + styles.varContent(builtWheel.name) + " into the " + styles.entity("wheel cache") + ", ignoring: " + repr(ex))
+
+	return builtWheel
+
+
+def installWheel(builtWheel: Path, installPythonPath=(), installBackend=None, installConfig=None):
+	# sudo --preserve-env=PYTHONPATH
+
+	if not installPythonPath:
+		if installBackend is None:
+			installBackend = install.REINSTALL_BACKEND
+	else:
+		installBackend = partial(install.pipCliReInstaller, pythonPath=installPythonPath)
+
+	print(installBackend)
+	try:
 		installBackend((builtWheel,), config=installConfig)
+	finally:
+		install.getInstalledDistributionsIndex().refresh((install.wheelDistributionName(builtWheel),))
+		getDefaultBuildWorkers().invalidate(builtWheel)
+
+
+def buildAndInstallWheel(packageDir: Path, buildPythonPath=(), installPythonPath=(), _useSetupPy: bool = False, installBackend=None, installConfig=None, scratchDir: typing.Optional[Path] = None, buildDeps: typing.Optional[typing.Iterable[str]] = None):
+	"""The wheel is built into a temporary dir within `scratchDir` (`packageDir` if not set). See `buildWheelChecked` for `buildDeps`."""
+
+	if scratchDir is None:
+		scratchDir = packageDir
+
+	with TemporaryDirectory(prefix="wheels", dir=scratchDir) as wheelsDir:
+		builtWheel = buildWheelChecked(packageDir, Path(wheelsDir), buildPythonPath=buildPythonPath, _useSetupPy=_useSetupPy, buildDeps=buildDeps)
+		installWheel(builtWheel, installPythonPath=installPythonPath, installBackend=installBackend, installConfig=installConfig)
 
 
 def buildAndInstallWheelFromGitURI(uri: str, buildPythonPath=(), installBackend=None, installConfig=None):
@@ -111,4 +403,7 @@ def buildAndInstallWheelFromGitURI(uri: str, buildPythonPath=(), installBackend=
 		if installBackend is None:
 			installBackend = install.REINSTALL_BACKEND
 
-		installBackend((builtWheel,), config=installConfig)
+		try:
+			installBackend((builtWheel,), config=installConfig)
+		finally:
+			install.getInstalledDistributionsIndex().refresh((install.wheelDistributionName(builtWheel),))
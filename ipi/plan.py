@@ -0,0 +1,139 @@
+"""Dry runs: what an installation would fetch, build and skip, computed from the resolution only. Nothing is built or installed."""
+
+import typing
+from enum import IntEnum
+
+from .deps.fetchers import checkoutEstimators
+from .resolver import DEPS_KINDS, DepsKindID, PackageFetcher, ResolutionNodeState
+from .tools import install
+from .utils import formatSize, getDirSize
+from .utils.styles import styles
+
+__all__ = ("InstallPlan", "PlannedPackage", "PlannedAction")
+
+
+class PlannedAction(IntEnum):
+	build = 0
+	skip = 1
+	system = 2
+
+
+PlannedAction.build.__doc__ = "Fetch the sources, build a wheel and install it"
+PlannedAction.skip.__doc__ = "A suitable version is already installed"
+PlannedAction.system.__doc__ = "Must be installed in the system, `ipi` doesn't install it"
+
+
+class PlannedPackage:
+	__slots__ = ("name", "action", "kind", "source", "installedVersion", "filesCount", "toDownloadCount", "toDownloadSize", "fetchedSize")
+
+	def __init__(self, name: str, action: PlannedAction, kind: DepsKindID = DepsKindID.pkgs, source: typing.Optional[str] = None, installedVersion: typing.Optional[str] = None, filesCount: typing.Optional[int] = None, toDownloadCount: typing.Optional[int] = None, toDownloadSize: int = 0, fetchedSize: int = 0):
+		self.name = name
+		self.action = action
+		self.kind = kind
+		self.source = source
+		self.installedVersion = installedVersion
+		self.filesCount = filesCount
+		self.toDownloadCount = toDownloadCount
+		self.toDownloadSize = toDownloadSize
+		self.fetchedSize = fetchedSize
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + ", ".join(k + "=" + repr(getattr(self, k)) for k in self.__class__.__slots__) + ")"
+
+	def __str__(self) -> str:
+		res = styles.operationName(self.action.name) + " " + styles.entity(DEPS_KINDS[self.kind].packageTypeName) + " " + styles.varContent(self.name)
+
+		if self.installedVersion is not None:
+			res += ", " + styles.varContent(self.installedVersion) + " installed"
+
+		if self.source is not None:
+			res += " from " + self.source
+
+		if self.filesCount is not None:
+			res += ": " + str(self.filesCount) + " files"
+			if self.toDownloadCount is not None:
+				res += ", " + str(self.toDownloadCount) + " to download"
+				if self.toDownloadSize:
+					res += " (~" + formatSize(self.toDownloadSize) + ")"
+
+		if self.fetchedSize:
+			res += ", " + formatSize(self.fetchedSize) + " already fetched"
+
+		return res
+
+
+def describeSource(directURL: typing.Optional[dict]) -> typing.Optional[str]:
+	if not directURL:
+		return None
+
+	res = directURL["url"]
+	vcsInfo = directURL.get("vcs_info", None)
+	if vcsInfo:
+		res += "@" + vcsInfo["commit_id"][:12]
+	subDir = directURL.get("subdirectory", None)
+	if subDir:
+		res += " [" + subDir + "]"
+	return res
+
+
+class InstallPlan:
+	"""The packages to be built are in the order of installation, the rest follow them"""
+
+	__slots__ = ("packages",)
+
+	def __init__(self, packages: typing.Iterable[PlannedPackage]):
+		self.packages = list(packages)
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.packages) + ")"
+
+	@classmethod
+	def fromResolution(cls, session: PackageFetcher) -> "InstallPlan":
+		"""The sources of the packages to be built were fetched during the resolution only to the extent needed to extract their metadata, if their fetchers support that. The rest of them is estimated without fetching. The packages sharing a checkout share the estimate, it is attributed to the first of them."""
+
+		res = []
+		estimated = set()
+
+		for node in session.graph.installPlan():
+			p = PlannedPackage(node.name, PlannedAction.build, DepsKindID.build if node.neededForBuild else DepsKindID.pkgs, describeSource(session.directURLs.get(node.name, None)))
+			deferredCheckout = session.deferredCheckouts.get(node.name, None)
+			repoDir = session.repoDirs.get(node.name, None)  # `None` for the sources used in place, they are not fetched
+
+			if (deferredCheckout is not None or repoDir is not None) and id(deferredCheckout if deferredCheckout is not None else repoDir) not in estimated:
+				if deferredCheckout is not None:
+					estimated.add(id(deferredCheckout))
+					estimator = checkoutEstimators[deferredCheckout.fetcherSpec.type]
+					p.filesCount, p.toDownloadCount, p.toDownloadSize = estimator(deferredCheckout.fetcherSpec.repo, deferredCheckout.outDir, deferredCheckout.revision, subDir=deferredCheckout.subDir)
+				else:
+					estimated.add(id(repoDir))
+					p.filesCount, p.fetchedSize = getDirSize(repoDir)
+
+			res.append(p)
+
+		for node in sorted(session.graph.nodes.values(), key=lambda n: n.name):
+			if node.state == ResolutionNodeState.satisfied:
+				version = install.getInstalledPackageVersion(node.name)
+				res.append(PlannedPackage(node.name, PlannedAction.skip, DepsKindID.build if node.neededForBuild else DepsKindID.pkgs, installedVersion=str(version) if version is not None else None))
+			elif node.state == ResolutionNodeState.system:
+				res.append(PlannedPackage(node.name, PlannedAction.system, DepsKindID.build if node.neededForBuild else DepsKindID.pkgs))
+
+		return cls(res)
+
+	@classmethod
+	def fromLock(cls, lock: "Lock") -> "InstallPlan":
+		"""Replaying a lockfile fetches and builds everything recorded, nothing is fetched to plan it"""
+
+		return cls(PlannedPackage(p.name, PlannedAction.build, p.kind, describeSource(p.toDirectURL())) for p in lock.packages)
+
+	def print(self):
+		for p in self.packages:
+			print(str(p))
+
+		counts = {a: 0 for a in PlannedAction}
+		for p in self.packages:
+			counts[p.action] += 1
+
+		toDownload = sum(p.toDownloadCount for p in self.packages if p.toDownloadCount)
+		toDownloadSize = sum(p.toDownloadSize for p in self.packages)
+		fetchedSize = sum(p.fetchedSize for p in self.packages)
+		print(styles.success("Plan") + ": " + str(counts[PlannedAction.build]) + " to build, " + str(counts[PlannedAction.skip]) + " to skip, " + str(counts[PlannedAction.system]) + " to be installed in the system; ~" + formatSize(toDownloadSize) + " (" + str(toDownload) + " files) to download, " + formatSize(fetchedSize) + " already fetched")
@@ -1,4 +1,5 @@
 import csv
+import hashlib
 import typing
 from io import IOBase, StringIO
 from pathlib import Path, PurePath
@@ -40,6 +41,11 @@ class IRegistry:
 	def lookup(self, k: str) -> LookupResult:
 		raise NotImplementedError
 
+	def snapshotDigest(self) -> str:
+		"""Changes when the set of the packages in the registry changes"""
+
+		raise NotImplementedError
+
 
 def derivePackageNameFromURI(uri: str) -> str:
 	uP = PurePath(uri)
@@ -59,9 +65,14 @@ class Registry(IRegistry):
 	def lookup(self, k: str) -> LookupResult:
 		return LookupResult(self.reg[canonicalizePackageName(k)], (self,))
 
+	def snapshotDigest(self) -> str:
+		return hashlib.sha256("\n".join(sorted(self.reg)).encode("utf-8")).hexdigest()
+
 	@classmethod
 	def fromCSV(cls, regCSV: typing.Union[Path, str, typing.Iterable[str]], name: str = None) -> "Registry":
+		baseDir = None
 		if isinstance(regCSV, Path):
+			baseDir = regCSV.absolute().parent
 			if name is None:
 				name = str(regCSV.resolve().absolute())
 			regCSV = regCSV.read_text()
@@ -92,7 +103,10 @@ class Registry(IRegistry):
 				else:
 					fetcherType = Source.git
 
-				fetcher = SourceFetcher(fetcherType, repo, el.get("subDir", None), el.get("refSpec", None), int(el.get("depth", 1)))
+				if fetcherType == Source.path and baseDir is not None and not repo.startswith("file://"):
+					repo = str(baseDir / Path(repo).expanduser())  # relative paths are relative to the registry file
+
+				fetcher = SourceFetcher(fetcherType, repo, el.get("subDir", None), el.get("refSpec", None), int(el.get("depth", 1)), el.get("bundle", None))
 			else:
 				fetcherType = Source[fetcherType]
 				fetcher = DummyFetcher(fetcherType)
@@ -148,6 +162,9 @@ class CompoundRegistry(IRegistry):
 				continue
 		raise KeyError(k)
 
+	def snapshotDigest(self) -> str:
+		return hashlib.sha256("\n".join(k + "\t" + child.snapshotDigest() for k, child in sorted(self.children.items())).encode("utf-8")).hexdigest()
+
 	@classmethod
 	def fromCSVDir(cls, name: str, csvDir: Path, nameGen: typing.Optional[typing.Callable] = None) -> "CompoundRegistry":
 		if nameGen is None:
@@ -179,11 +196,13 @@ def initRegistries() -> CompoundRegistry:
 		except ImportError:
 			pass
 		else:
+			from .utils.FetchScheduler import getDefaultFetchScheduler
+
 			m = RepoManager(reposRoot)
 			for repoPetName in m:
 				print(repoPetName)
 				repo = m[repoPetName]
-				repo.update()
+				getDefaultFetchScheduler()(None, repo.update)
 				tufRegsDict[repoPetName] = repo.toRegistry()
 
 			userTufReg = CompoundRegistry("tuf", tufRegsDict)
@@ -1,45 +1,382 @@
+import shutil
+import threading
 import typing
+from concurrent.futures import FIRST_COMPLETED, wait
 from enum import IntEnum
-from pathlib import Path
+from functools import partial
+from pathlib import Path, PurePosixPath
 from tempfile import TemporaryDirectory, mkdtemp
 
-from .deps.fetchers import Source, SourceFetcher, fetchers
+from .deps.fetchers import Source, SourceFetcher, checkoutWideners, checkouters, fetchers, historyDeepeners, inPlaceLocators, metadataFetchers, metadataWideners, prefetchers, remoteRevisionGetters
+from .deps.git import closeCatFileBatches
 from .deps.icecream import ic
 from .deps.unpin import unpinRequirement
 from .tools import install
-from .utils.metadataExtractor import canonicalizedRequirement, extractMetadata
+from .utils import SubDirsT, formatSize, getDirSize, toSubDirs
+from .utils.FetchPool import FetchPool, PackagesFetchingError
+from .utils.FetchScheduler import getDefaultFetchScheduler
+from .utils.conflicts import DependencyConflictsError, findConflicts
+from .utils.metadataCache import MetadataCache, getDefaultMetadataCache, metadataCacheKey
+from .utils.metadataExtractor import canonicalizedRequirement, extractMetadata, isVersionedUsingVCS
+from .utils.negativeCache import KnownFailureError, NegativeCache, getDefaultNegativeCache
 from .utils.styles import styles
+from .utils.targetEnvironment import TargetEnvironment, canonicalizeExtraName
 
 
-def clonePackagesRepos(targetDir: Path, packagesToClone: typing.Iterable[str], registry: "IRegistry"):
-	res = {}
+class DeferredCheckout:
+	"""The second phase of two-phase fetching of a package, which first phase has materialized only the files needed to extract its metadata. Shared by all the packages fetched into the same checkout, only the first call does the work. `subDir` is widened while more packages of the repo are discovered."""
+
+	__slots__ = ("fetcherSpec", "outDir", "revision", "subDir", "done", "lock")
+
+	def __init__(self, fetcherSpec: SourceFetcher, outDir: Path, revision: str, subDir: SubDirsT = None):
+		self.fetcherSpec = fetcherSpec
+		self.outDir = outDir
+		self.revision = revision
+		self.subDir = subDir
+		self.done = False
+		self.lock = threading.Lock()  # the packages sharing it may be built concurrently
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + ", ".join(repr(getattr(self, k)) for k in ("fetcherSpec", "outDir", "revision", "subDir", "done")) + ")"
+
+	def __call__(self):
+		with self.lock:
+			if not self.done:
+				checkouter = checkouters[self.fetcherSpec.type]
+				getDefaultFetchScheduler()(self.fetcherSpec.repo, checkouter, self.fetcherSpec.repo, self.outDir, self.revision, subDir=self.subDir)  # missing blobs are fetched lazily
+				self.done = True
+
+
+def mergeSubDirs(subDirs: typing.Iterable[typing.Optional[str]]) -> SubDirsT:
+	"""The subdirs to check out for the packages sharing a repo. If one of them needs the whole repo, everything is checked out."""
+
+	res = []
+	for subDir in subDirs:
+		if not subDir:
+			return None
+		if subDir not in res:
+			res.append(subDir)
+
+	return res[0] if len(res) == 1 else tuple(res)
+
+
+def removeLeftovers(repoDir: Path):
+	"""Fetchers cannot reuse a dir a failed attempt has left"""
+
+	if repoDir.exists():
+		shutil.rmtree(repoDir)
+
+
+def normalizedSubDir(subDir: typing.Optional[str]) -> str:
+	return subDir.strip("/") if subDir else ""
+
+
+def isWithinSubDirs(subDir: typing.Optional[str], subDirs: SubDirsT) -> bool:
+	"""Whether `subDir` is within any of `subDirs` (the whole repo if not set)"""
+
+	subDirs = toSubDirs(subDirs)
+	if not subDirs:
+		return True
+
+	parts = PurePosixPath(normalizedSubDir(subDir)).parts
+	return any(parts[: len(p)] == p for p in (PurePosixPath(normalizedSubDir(d)).parts for d in subDirs))
+
+
+class RepoCheckout:
+	"""A checkout shared by the packages living in the same repo (with the same ref), i.e. in subdirs of a monorepo. The repo is fetched once into the dir named after the first of them.
+	The packages discovered later join it: the subdirs they need are materialized from the revision already fetched. `pending` are the ones joined but not yet materialized."""
+
+	__slots__ = ("fetcherSpec", "repoDir", "members", "pending", "twoPhase", "revision", "materialized", "deferredCheckout", "lock")
+
+	def __init__(self, fetcherSpec: SourceFetcher, repoDir: Path, twoPhase: bool = False):
+		self.fetcherSpec = fetcherSpec
+		self.repoDir = repoDir
+		self.members = []
+		self.pending = []
+		self.twoPhase = twoPhase
+		self.revision = None
+		self.materialized = None  # the subdirs which metadata files are written if `twoPhase`, otherwise `SubDirsT` checked out
+		self.deferredCheckout = None
+		self.lock = threading.Lock()  # the widenings of a checkout must not run concurrently
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.repoDir) + ", " + repr([name for name, _ in self.members]) + (", twoPhase" if self.twoPhase else "") + ")"
+
+	@property
+	def subDir(self) -> SubDirsT:
+		return mergeSubDirs(spec.subDir for _, spec in self.members)
+
+	def add(self, name: str, spec: SourceFetcher):
+		self.members.append((name, spec))
+		self.pending.append((name, spec))
+
+	def isMaterialized(self, spec: SourceFetcher) -> bool:
+		if self.twoPhase:
+			return normalizedSubDir(spec.subDir) in self.materialized
+		return isWithinSubDirs(spec.subDir, self.materialized)
+
+	def fetchTask(self) -> typing.Callable[[], typing.Optional[str]]:
+		"""The fetch of the repo through the fetch scheduler, returning the revision fetched. Only the files needed to extract metadata are fetched if `twoPhase`."""
+
+		fetcherSpec = self.fetcherSpec
+		fetcher = metadataFetchers[fetcherSpec.type] if self.twoPhase else fetchers[fetcherSpec.type]
+		subDir = self.subDir
+		self.materialized = ({normalizedSubDir(d) for d in toSubDirs(subDir)} or {""}) if self.twoPhase else subDir
+
+		fetcherKwargs = {}
+		for _, spec in reversed(self.members):
+			fetcherKwargs.update(spec.fetcherKwargs)
+
+		return partial(getDefaultFetchScheduler(), fetcherSpec.repo, fetcher, fetcherSpec.repo, self.repoDir, depth=max(spec.depth for _, spec in self.members), refSpec=fetcherSpec.refSpec, subDir=subDir, cleanup=partial(removeLeftovers, self.repoDir), **fetcherKwargs)
+
+	def fetched(self, revision: typing.Optional[str], directURLs: typing.Optional[dict] = None, deferredCheckouts: typing.Optional[dict] = None, repoDirs: typing.Optional[dict] = None) -> typing.Dict[str, Path]:
+		"""Records the results of the fetch into the dicts given and returns the dirs of the packages materialized by it. The rest (the ones joined while it was running) stay `pending`."""
+
+		self.revision = revision
+		if self.twoPhase:
+			self.deferredCheckout = DeferredCheckout(self.fetcherSpec, self.repoDir, revision, self.subDir)
+
+		materialized = [name for name, spec in self.pending if self.isMaterialized(spec)]
+		names = ", ".join(styles.varContent(name) for name in materialized)
+		if self.twoPhase:
+			print(styles.success("Fetched") + " " + styles.entity("metadata") + " of " + names + ", checkout is deferred")
+		else:
+			filesCount, size = getDirSize(self.repoDir)
+			print(styles.success("Fetched") + " " + names + ": " + str(filesCount) + " files, " + formatSize(size) + " checked out")
+
+		return self.record(materialized, directURLs, deferredCheckouts, repoDirs)
+
+	def widenTask(self) -> typing.Optional[typing.Callable[[], None]]:
+		"""The materialization of the subdirs of the `pending` packages in the checkout already fetched, through the fetch scheduler. `None` if the fetcher cannot do it, the pending packages must be fetched separately then."""
+
+		fetcherSpec = self.fetcherSpec
+		scheduler = getDefaultFetchScheduler()
+		if self.twoPhase:
+			widener = metadataWideners.get(fetcherSpec.type, None)
+			if widener is None:
+				return None
+
+			self.materialized = self.materialized | {normalizedSubDir(spec.subDir) for _, spec in self.pending}
+			self.deferredCheckout.subDir = self.subDir
+			return partial(scheduler, fetcherSpec.repo, self._widenMetadata, widener)
+
+		widener = checkoutWideners.get(fetcherSpec.type, None)
+		if widener is None:
+			return None
+
+		self.materialized = self.subDir
+		return partial(scheduler, fetcherSpec.repo, self._widenCheckout, widener)
+
+	def _widenMetadata(self, widener: typing.Callable):
+		with self.lock:
+			subDirs = sorted(self.materialized)  # the latest ones, the widenings may run in any order
+			if "" in subDirs:
+				widener(self.fetcherSpec.repo, self.repoDir, self.revision)
+			if any(subDirs):
+				widener(self.fetcherSpec.repo, self.repoDir, self.revision, subDir=tuple(d for d in subDirs if d))
+
+	def _widenCheckout(self, widener: typing.Callable):
+		with self.lock:
+			widener(self.fetcherSpec.repo, self.repoDir, subDir=self.materialized)
+
+	def record(self, names: typing.Collection[str], directURLs: typing.Optional[dict] = None, deferredCheckouts: typing.Optional[dict] = None, repoDirs: typing.Optional[dict] = None) -> typing.Dict[str, Path]:
+		"""Records the packages materialized into the dicts given and returns their dirs"""
+
+		res = {}
+		names = set(names)
+		for name, spec in self.pending:
+			if name not in names:
+				continue
+
+			res[name] = self.repoDir / spec.subDir if spec.subDir else self.repoDir
+			if repoDirs is not None:
+				repoDirs[name] = self.repoDir
+			if directURLs is not None and self.revision:
+				directURLs[name] = spec.toDirectURL(self.revision)
+			if self.deferredCheckout is not None:
+				deferredCheckouts[name] = self.deferredCheckout
+
+		self.pending = [(name, spec) for name, spec in self.pending if name not in names]
+		return res
+
+
+def planPackagesFetching(targetDir: Path, packagesToClone: typing.Iterable[str], registry: "IRegistry", twoPhase: bool = False, directURLs: typing.Optional[dict] = None, shared: typing.Optional[typing.Dict[tuple, RepoCheckout]] = None) -> typing.Tuple[typing.Dict[str, RepoCheckout], typing.List[RepoCheckout], typing.Dict[str, Path], typing.Dict[str, BaseException], list]:
+	"""Groups the packages by repo into `RepoCheckout`s, keyed by the names of their first packages. The packages which sources are local dirs are located in place and are not fetched.
+	`shared` maps `repoKey`s to the checkouts fetched earlier in the session, the packages living in them join them instead of being fetched again, and the new checkouts are added into it.
+	Returns the checkouts to fetch, the checkouts from `shared` the packages have joined, the dirs of the packages used in place, the errors of locating them and the packages that cannot be fetched."""
+
+	if shared is None:
+		shared = {}
+
+	checkouts = {}
+	joined = []
+	inPlace = {}
+	inPlaceErrors = {}
 	ignored = []
 
 	for name in packagesToClone:
-		outDir = targetDir / name
 		lookupRes = registry.lookup(name).pkg
 		fetcherSpec = lookupRes.fetcher
 
-		if isinstance(fetcherSpec, SourceFetcher):
-			fetcher = fetchers.get(fetcherSpec.type, None)
-			if fetcher is None:
-				print("fetcherSpec", fetcherSpec)
-				ignored.append(lookupRes)
+		if isinstance(fetcherSpec, SourceFetcher) and fetcherSpec.type in inPlaceLocators:
+			try:
+				inPlace[name] = inPlaceLocators[fetcherSpec.type](fetcherSpec.repo, fetcherSpec.subDir)
+			except Exception as ex:
+				inPlaceErrors[name] = ex
 				continue
-		else:
+
+			print(styles.operationName("Using") + " " + styles.varContent(name) + " in place: " + str(inPlace[name]))
+			if directURLs is not None:
+				directURLs[name] = fetcherSpec.toDirectURL(None)
+			continue
+
+		if not isinstance(fetcherSpec, SourceFetcher) or fetcherSpec.type not in fetchers:
 			print("fetcherSpec", fetcherSpec)
 			ignored.append(lookupRes)
 			continue
 
-		fetcher(fetcherSpec.repo, outDir, depth=fetcherSpec.depth, refSpec=fetcherSpec.refSpec)
-		if fetcherSpec.subDir:
-			outDir = outDir / fetcherSpec.subDir
+		checkout = shared.get(fetcherSpec.repoKey, None)
+		if checkout is None:
+			checkout = shared[fetcherSpec.repoKey] = checkouts[name] = RepoCheckout(fetcherSpec, targetDir / name, twoPhase and fetcherSpec.type in metadataFetchers)
+		elif checkout.repoDir.name not in checkouts and checkout not in joined:
+			joined.append(checkout)
+		checkout.add(name, fetcherSpec)
+
+	for checkout in checkouts.values():
+		if len(checkout.members) > 1:
+			print(styles.operationName("Sharing") + " a checkout of " + styles.entity("repo") + " " + styles.varContent(checkout.fetcherSpec.repo) + " between " + ", ".join(styles.varContent(name) for name, _ in checkout.members))
+	for checkout in joined:
+		print(styles.operationName("Sharing") + " the checkout of " + styles.entity("repo") + " " + styles.varContent(checkout.fetcherSpec.repo) + " fetched for " + styles.varContent(checkout.members[0][0]) + " with " + ", ".join(styles.varContent(name) for name, _ in checkout.pending))
+
+	return checkouts, joined, inPlace, inPlaceErrors, ignored
 
-		res[name] = outDir
+
+def clonePackagesRepos(targetDir: Path, packagesToClone: typing.Iterable[str], registry: "IRegistry", pool: typing.Optional[FetchPool] = None, directURLs: typing.Optional[dict] = None, deferredCheckouts: typing.Optional[dict] = None, repoDirs: typing.Optional[dict] = None):
+	"""Fetches the packages concurrently using `pool`. If some of fetches fail, the rest are completed anyway, then `PackagesFetchingError` is raised.
+	The packages living in the same repo (with the same ref) share a single checkout in the dir named after the first of them, the repo is fetched once. The packages which sources are local dirs are used in place.
+	If `directURLs` is given, it is populated with PEP 610 descriptions of the fetched revisions. If `repoDirs` is given, it is populated with the roots of the checkouts.
+	If `deferredCheckouts` is given, the sources supporting two-phase fetching are fetched only to the extent needed to extract metadata, and `deferredCheckouts` is populated with `DeferredCheckout`s, that must be called before building the packages."""
+
+	if pool is None:
+		pool = FetchPool()
+
+	checkouts, _, res, inPlaceErrors, ignored = planPackagesFetching(targetDir, packagesToClone, registry, deferredCheckouts is not None, directURLs)
+
+	fetchResults, groupErrors = pool({groupName: checkout.fetchTask() for groupName, checkout in checkouts.items()})
+	if groupErrors or inPlaceErrors:
+		raise packagesFetchingError(inPlaceErrors, {name: ex for groupName, ex in groupErrors.items() for name, _ in checkouts[groupName].members})
+
+	for groupName, revision in fetchResults.items():
+		res.update(checkouts[groupName].fetched(revision, directURLs, deferredCheckouts, repoDirs))
 
 	return res, ignored
 
 
+def packagesFetchingError(locatingErrors: typing.Mapping[str, BaseException], fetchingErrors: typing.Mapping[str, BaseException]) -> PackagesFetchingError:
+	errors = {}
+	for name, ex in locatingErrors.items():
+		print(styles.error("Error") + " " + styles.operationName("locating") + " " + styles.varContent(name) + ": " + repr(ex))
+		errors[name] = ex
+	for name, ex in fetchingErrors.items():
+		print(styles.error("Error") + " " + styles.operationName("fetching") + " " + styles.varContent(name) + ": " + repr(ex))
+		errors[name] = ex
+	return PackagesFetchingError("Failed to fetch some packages", errors)
+
+
+def historyDeepeningTasks(repoDirs: typing.Mapping[str, Path], names: typing.Iterable[str], registry: "IRegistry", directURLs: typing.Mapping[str, dict], seenRepoDirs: typing.Optional[typing.Set[Path]] = None) -> typing.Dict[str, typing.Callable[[], bool]]:
+	"""The deepenings of the histories of the packages, through the fetch scheduler. A checkout shared by several packages (or already in `seenRepoDirs`, which is updated) is deepened once."""
+
+	if seenRepoDirs is None:
+		seenRepoDirs = set()
+
+	scheduler = getDefaultFetchScheduler()
+	tasks = {}
+	for name in names:
+		fetcherSpec = registry.lookup(name).pkg.fetcher
+		if not isinstance(fetcherSpec, SourceFetcher):
+			continue
+
+		deepener = historyDeepeners.get(fetcherSpec.type, None)
+		revision = fetcherSpec.recordedRevision(directURLs.get(name, None))
+		repoDir = repoDirs.get(name, None)
+		if deepener is None or not revision or repoDir is None or repoDir in seenRepoDirs:
+			continue
+
+		seenRepoDirs.add(repoDir)
+		tasks[name] = partial(scheduler, fetcherSpec.repo, deepener, fetcherSpec.repo, repoDir, revision, refSpec=fetcherSpec.refSpec)
+
+	return tasks
+
+
+def reportHistoryDeepened(name: str, found: bool):
+	if found:
+		print(styles.success("Fetched") + " " + styles.entity("history") + " of " + styles.varContent(name) + " up to the nearest tag")
+	else:
+		print(styles.error("No tags") + " in the " + styles.entity("history") + " of " + styles.varContent(name) + ", its version may be unknown")
+
+
+def historiesFetchingError(errors: typing.Mapping[str, BaseException]) -> PackagesFetchingError:
+	for name, ex in errors.items():
+		print(styles.error("Error") + " " + styles.operationName("deepening") + " " + styles.entity("history") + " of " + styles.varContent(name) + ": " + repr(ex))
+	return PackagesFetchingError("Failed to fetch history of some packages", errors)
+
+
+def deepenPackagesHistories(repoDirs: typing.Mapping[str, Path], names: typing.Iterable[str], registry: "IRegistry", directURLs: typing.Mapping[str, dict], pool: typing.Optional[FetchPool] = None):
+	"""Packages are fetched at depth 1. For the ones computing their versions from VCS tags, fetches (concurrently) more history until the nearest tag is reachable from the fetched revision. A checkout shared by several packages is deepened once."""
+
+	if pool is None:
+		pool = FetchPool()
+
+	tagsFound, errors = pool(historyDeepeningTasks(repoDirs, names, registry, directURLs))
+	if errors:
+		raise historiesFetchingError(errors)
+
+	for name, found in tagsFound.items():
+		reportHistoryDeepened(name, found)
+
+
+def unchangedPackageProbe(name: str, registry: "IRegistry") -> typing.Optional[typing.Callable[[], bool]]:
+	"""Returns a task asking the remote (through the fetch scheduler) which revision the ref of the installed package points to now and returning whether the package was installed from exactly this revision, so fetching it is pointless.
+	`None` if the package cannot be probed: only the packages which installation was recorded into `direct_url.json` can be."""
+
+	fetcherSpec = registry.lookup(name).pkg.fetcher
+	if not isinstance(fetcherSpec, SourceFetcher):
+		return None
+
+	remoteRevisionGetter = remoteRevisionGetters.get(fetcherSpec.type, None)
+	if remoteRevisionGetter is None:
+		return None
+
+	installedRevision = fetcherSpec.recordedRevision(install.getInstalledPackageDirectURL(name))
+	if not installedRevision:
+		return None
+
+	def probe() -> bool:
+		try:
+			return getDefaultFetchScheduler()(fetcherSpec.repo, remoteRevisionGetter, fetcherSpec.repo, fetcherSpec.refSpec) == installedRevision
+		except Exception as ex:
+			print(styles.error("Error") + " " + styles.operationName("probing") + " " + styles.varContent(name) + ", will fetch it: " + repr(ex))
+			return False
+
+	return probe
+
+
+def probeUnchangedPackages(names: typing.Iterable[str], registry: "IRegistry", pool: typing.Optional[FetchPool] = None) -> typing.Set[str]:
+	"""Probes (concurrently) the installed packages and returns the names of the ones installed from the latest revisions. See `unchangedPackageProbe`."""
+
+	if pool is None:
+		pool = FetchPool()
+
+	tasks = {}
+	for name in names:
+		probe = unchangedPackageProbe(name, registry)
+		if probe is not None:
+			tasks[name] = probe
+
+	unchanged, _ = pool(tasks)
+	return {name for name, isUnchanged in unchanged.items() if isUnchanged}
+
+
 class ResolutionPrefs:
 	__slots__ = ("upgrade", "resolveDeps", "forceReinstall")
 
@@ -55,41 +392,180 @@ class ResolutionPrefs:
 		return self.__class__.__name__ + "(" + ", ".join((k + "=" + repr(getattr(self, k))) for k in self.__class__.__slots__) + ")"
 
 
-class ResolutionSubRoundPipelineStage(IntEnum):
-	notResolved = 0
-	fetched = 1
-	depsResolved = 2
-	built = 3
-	installed = 4
-
-
 class DepsKindID(IntEnum):
 	build = 0
 	pkgs = 1
 
 
 class DepsKind:
-	__slots__ = ("idx", "packageTypeName", "depsGetter", "moveToThis", "prefsPatch")
+	__slots__ = ("idx", "packageTypeName", "depsGetter", "prefsPatch")
 
-	def __init__(self, idx: DepsKindID, packageTypeName: str, depsGetter, moveToThis: bool, prefsPatch: dict):
+	def __init__(self, idx: DepsKindID, packageTypeName: str, depsGetter, prefsPatch: dict):
 		self.idx = idx
 		self.packageTypeName = packageTypeName
 		self.depsGetter = depsGetter
-		self.moveToThis = moveToThis
 		self.prefsPatch = prefsPatch
 
 
 DEPS_KINDS = {
-	DepsKindID.build: DepsKind(DepsKindID.build, "build tool", lambda prefs, md: md.buildDeps, moveToThis=True, prefsPatch={"forceReinstall": False}),
-	DepsKindID.pkgs: DepsKind(DepsKindID.pkgs, "package", lambda prefs, md: md.deps if prefs.resolveDeps and md.deps else (), moveToThis=False, prefsPatch={}),
+	DepsKindID.build: DepsKind(DepsKindID.build, "build tool", lambda prefs, md: md.buildDeps, prefsPatch={"forceReinstall": False}),
+	DepsKindID.pkgs: DepsKind(DepsKindID.pkgs, "package", lambda prefs, md: md.deps if prefs.resolveDeps and md.deps else (), prefsPatch={}),
 }
 
 
+def isReInstallationNeeded(el, prefs: ResolutionPrefs, packageTypeName: str) -> bool:
+	version = install.getInstalledPackageVersion(el.name)
+	if version:
+		print(styles.entity(packageTypeName) + " " + styles.varContent(el.name) + " " + styles.entity("version") + " installed: " + styles.varContent(str(version)))
+		if not prefs.upgrade:
+			print(styles.operationName("No upgrade") + ", may " + styles.operationName("skip") + " if suitable " + styles.entity("version") + " installed")
+			if prefs.forceReinstall:
+				print(styles.operationName("Forcing reinstallation..."), styles.varContent(el))
+			else:
+				if list(el.specifier.filter((version,), prereleases=True)):
+					print(styles.success("Suitable " + styles.entity("version") + " installed") + ", " + styles.operationName("skipping ") + str(styles.varContent(el)))
+					return False
+		else:
+			print("`upgrade`==`True`, non-skipping", el)
+	else:
+		print(styles.entity(packageTypeName) + " " + styles.varContent(el.name) + " " + "not installed")
+
+	return True
+
+
+class ResolutionNodeState(IntEnum):
+	scheduled = 0
+	fetched = 1
+	resolved = 2
+	satisfied = 3
+	system = 4
+
+
+ResolutionNodeState.scheduled.__doc__ = "Is being fetched"
+ResolutionNodeState.fetched.__doc__ = "Sources are fetched, deps are not yet known"
+ResolutionNodeState.resolved.__doc__ = "Deps are known and added into the graph"
+ResolutionNodeState.satisfied.__doc__ = "A suitable version is already installed, or it was installed from the latest revision"
+ResolutionNodeState.system.__doc__ = "Must be installed in the system"
+
+
+class ResolutionNode:
+	"""A package in the dependency graph. `deps` are the outgoing edges: the names of the packages it depends on mapped to the kinds of the dependencies. `constraints` are the requirements on the package itself, as `(dependentName, requirement)`, after unpinning."""
+
+	__slots__ = ("name", "state", "installDir", "deps", "dependents", "requested", "neededForBuild", "extras", "constraints")
+
+	def __init__(self, name: str, state: ResolutionNodeState = ResolutionNodeState.scheduled, requested: bool = False, neededForBuild: bool = False, extras: typing.Iterable[str] = ()):
+		self.name = name
+		self.state = state
+		self.installDir = None
+		self.deps = {}
+		self.dependents = set()
+		self.requested = requested
+		self.neededForBuild = neededForBuild
+		self.extras = set(extras)
+		self.constraints = []
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.name) + ", " + self.state.name + (", requested" if self.requested else "") + (", neededForBuild" if self.neededForBuild else "") + (", extras=" + repr(sorted(self.extras)) if self.extras else "") + ", deps=" + repr(sorted(self.deps)) + ")"
+
+	@property
+	def isToInstall(self) -> bool:
+		return self.state in {ResolutionNodeState.fetched, ResolutionNodeState.resolved}
+
+
+class ResolutionGraph:
+	"""The dependency graph of the packages being installed. Nodes are keyed by names of packages. Edges are typed: a package is either needed to build its dependent or to run it."""
+
+	__slots__ = ("nodes",)
+
+	def __init__(self):
+		self.nodes = {}
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "<" + ", ".join(repr(n) for n in self.nodes.values()) + ">"
+
+	def __contains__(self, name: str) -> bool:
+		return name in self.nodes
+
+	def __getitem__(self, name: str) -> ResolutionNode:
+		return self.nodes[name]
+
+	def add(self, node: ResolutionNode) -> ResolutionNode:
+		self.nodes[node.name] = node
+		return node
+
+	def addEdge(self, dependent: str, dependency: str, kind: DepsKindID):
+		dependentNode = self.nodes[dependent]
+		prevKind = dependentNode.deps.get(dependency, None)
+		dependentNode.deps[dependency] = kind if prevKind is None else min(prevKind, kind)  # build deps take precedence
+		self.nodes[dependency].dependents.add(dependent)
+
+		if kind == DepsKindID.build or dependentNode.neededForBuild:
+			self.markNeededForBuild(dependency)
+
+	def markNeededForBuild(self, name: str):
+		"""The deps of a package needed for building are needed for building too"""
+
+		stack = [name]
+		while stack:
+			node = self.nodes[stack.pop()]
+			if not node.neededForBuild:
+				node.neededForBuild = True
+				stack.extend(node.deps)
+
+	def installPlan(self) -> typing.List[ResolutionNode]:
+		"""The packages to install, ordered topologically: each one comes after all its deps. Cycles are broken at the edge closing them."""
+
+		res = []
+		visitState = {}  # False: being visited, True: done
+
+		for root in self.nodes:
+			if root in visitState:
+				continue
+
+			visitState[root] = False
+			stack = [(root, iter(self.nodes[root].deps))]
+			while stack:
+				name, depsIter = stack[-1]
+				for dep in depsIter:
+					depState = visitState.get(dep, None)
+					if depState is None:
+						visitState[dep] = False
+						stack.append((dep, iter(self.nodes[dep].deps)))
+						break
+					if depState is False:
+						print(styles.error("Dependency cycle") + ": " + styles.varContent(name) + " -> " + styles.varContent(dep) + ", ignoring this edge")
+				else:
+					stack.pop()
+					visitState[name] = True
+					node = self.nodes[name]
+					if node.isToInstall:
+						res.append(node)
+
+		return res
+
+
 class InstallationTarget:
-	__slots__ = ("installDir",)
+	"""`installDir` is `None` if the sources are not needed, i.e. the wheel has been built in an earlier run of the session. `buildDeps` and `deps` are the names of the deps as resolved, `None` if unknown."""
+
+	__slots__ = ("installDir", "directURL", "deferredCheckout", "name", "buildDeps", "deps")
 
-	def __init__(self, installDir: Path):
+	def __init__(self, installDir: typing.Optional[Path], directURL: typing.Optional[dict] = None, deferredCheckout: typing.Optional[DeferredCheckout] = None, name: typing.Optional[str] = None, buildDeps: typing.Optional[typing.Collection[str]] = None, deps: typing.Optional[typing.Collection[str]] = None):
 		self.installDir = installDir
+		self.directURL = directURL
+		self.deferredCheckout = deferredCheckout
+		self.name = name
+		self.buildDeps = buildDeps
+		self.deps = deps
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + ", ".join((k + "=" + repr(getattr(self, k))) for k in self.__class__.__slots__) + ")"
+
+	def checkout(self):
+		"""Materializes the sources if their checkout was deferred. Must be called before building."""
+
+		if self.deferredCheckout is not None:
+			self.deferredCheckout()
+			self.deferredCheckout = None
 
 
 class InstallationCollection:
@@ -107,17 +583,41 @@ class InstallationCollection:
 
 
 class PackageFetcher:
-	__slots__ = ("installDirs", "sourcesDir", "registry", "ignored", "round")
+	"""Resolves the packages into a `ResolutionGraph`. A package is fetched as soon as it is discovered, and its deps are discovered as soon as it is fetched, so independent branches of the graph progress without waiting for each other."""
+
+	__slots__ = ("installDirs", "directURLs", "deferredCheckouts", "repoDirs", "repoCheckouts", "deepenedRepoDirs", "versionedUsingVCS", "metadata", "prefetched", "sourcesDir", "registry", "graph", "pool", "metadataCache", "negativeCache", "targetEnvironment", "depsHints")
+
+	def __init__(self, registry: "IRegistry", pool: typing.Optional[FetchPool] = None, metadataCache: typing.Optional[MetadataCache] = None, targetEnvironment: typing.Optional[TargetEnvironment] = None, depsHints: typing.Optional[typing.Mapping[str, typing.Sequence[str]]] = None, negativeCache: typing.Optional[NegativeCache] = None):
+		"""`depsHints` map names of packages to the names of their deps as they were resolved earlier (i.e. recorded into a lockfile). They are used, as well as the metadata cache, to guess the deps of the packages being fetched and to prefetch them."""
 
-	def __init__(self, registry: "IRegistry"):
 		self.registry = registry
+		if pool is None:
+			pool = FetchPool()
+		self.pool = pool
+		if metadataCache is None:
+			metadataCache = getDefaultMetadataCache()
+		self.metadataCache = metadataCache
+		if targetEnvironment is None:
+			targetEnvironment = TargetEnvironment.current()
+		self.targetEnvironment = targetEnvironment
+		self.depsHints = depsHints
+		if negativeCache is None:
+			negativeCache = getDefaultNegativeCache()
+		self.negativeCache = negativeCache
 		self.sourcesDir = None
 		self._reset()
 
 	def _reset(self):
-		self.round = None
+		self.graph = ResolutionGraph()
 		self.installDirs = {}
-		self.ignored = set()
+		self.directURLs = {}
+		self.deferredCheckouts = {}
+		self.repoDirs = {}
+		self.repoCheckouts = {}  # `repoKey`s mapped to the checkouts of the session, the packages of a repo discovered later join them
+		self.deepenedRepoDirs = set()
+		self.versionedUsingVCS = set()
+		self.metadata = {}
+		self.prefetched = set()
 		self.clean()
 
 	def __enter__(self):
@@ -129,211 +629,378 @@ class PackageFetcher:
 	def __exit__(self, *args, **kwargs):
 		self.clean()
 
-	def __call__(self, prefs: ResolutionPrefs, names: typing.Collection[str]):
-		ic(prefs, names)
-		self.round = ResolutionRound()
-		self.round.pkgs.toFetch.update({canonicalizedRequirement(el).name: 1 for el in names})
-		ic(self.round)
-
-		res = tuple(InstallationCollection(dk, []) for dk in DEPS_KINDS.values())
+	def _applicableExtrasDeps(self, node: ResolutionNode, md, extras: typing.Collection[str]) -> list:
+		"""The deps of `extras` of a package applicable to the target environment. `md` is `None` for the installed packages, their deps of extras are taken from the metadata of the installed distributions."""
 
-		while self.round:
-			self.round = self.round(prefs.clone(upgrade=False), self.installDirs, Path(self.sourcesDir.name), self.registry)
-			ic(self.round)
-			for dki in DepsKindID:
-				res[dki].targets.extend(InstallationTarget(self.installDirs[t]) for t in self.round.subRounds[dki].resolved)
+		te = self.targetEnvironment
+		res = []
+		if md is not None:
+			optionalDeps = md.optionalDeps
+			for extra in sorted(extras):
+				if extra not in optionalDeps:
+					print(styles.varContent(node.name) + " has no " + styles.entity("extra") + " " + styles.varContent(extra) + ", " + styles.operationName("ignoring"))
+					continue
+				res.extend(el for el in optionalDeps[extra] if te.isApplicable(el, (extra,)))
+		else:
+			dist = install.getInstalledPackageDistribution(node.name)
+			if dist is not None:
+				for reqStr in dist.requiresDist:
+					el = canonicalizedRequirement(reqStr)
+					if te.isApplicable(el, extras) and not te.isApplicable(el):  # gated by one of the extras
+						res.append(el)
 
 		return res
 
-	def clean(self):
-		if self.sourcesDir:
-			self.sourcesDir.cleanup()
-		self.sourcesDir = None
+	def _scheduleExtrasDeps(self, prefs: ResolutionPrefs, node: ResolutionNode, extras: typing.Collection[str], toFetch: typing.Dict[str, bool]):
+		"""Schedules the deps of `extras` requested for a package already resolved or installed. The extras of the packages not yet resolved are handled by `_resolveNode`."""
 
+		if not prefs.resolveDeps or node.state not in {ResolutionNodeState.resolved, ResolutionNodeState.satisfied}:
+			return
 
-class ResolutionSubRound:
-	__slots__ = ("depsKind", "resolved", "fetched", "toFetch", "ignored")
+		for el in self._applicableExtrasDeps(node, self.metadata.get(node.name, None) if node.state == ResolutionNodeState.resolved else None, extras):
+			unpinRequirement(el)
+			self._schedule(prefs, node, el, DepsKindID.pkgs, toFetch)
 
-	def __init__(self, depsKind: DepsKind):
-		self.depsKind = depsKind
-		self.toFetch = {}
-		self.fetched = {}
-		self.resolved = {}
-		self.ignored = {}
-
-	def __bool__(self) -> bool:
-		return bool(self.toFetch)
-
-	def __repr__(self):
-		return self.__class__.__name__ + "<" + ", ".join(map(repr, (self.depsKind.packageTypeName, len(self.resolved), len(self.toFetch), len(self.ignored)))) + ">"
-
-	def getDeps(self, prefs, md):
-		deps = self.depsKind.depsGetter(prefs, md)
-		for dep in deps:
-			unpinRequirement(dep)
-		return deps
-
-	def fetch(self, installDirs, sourcesDir, registry):
-		ic(self.depsKind.packageTypeName, self.toFetch)
-		buildDepsInstallDirs, ignored = clonePackagesRepos(sourcesDir, self.toFetch, registry)
-		ic(self.depsKind.packageTypeName, buildDepsInstallDirs, ignored)
-		for ignoredPackage in ignored:
-			if ignoredPackage.fetcher.type not in {Source.system}:
-				raise NotImplementedError("Fetcher is not implemented yet")
-		ignoredNames = {el.name: el for el in ignored}
-		self.fetched.update(buildDepsInstallDirs)
-		self.toFetch = {}
-		self.ignored.update(ignoredNames)
-		ic(self)
-
-	def isReInstallationNeeded(self, el, prefs: ResolutionPrefs):
-		if el.marker:
-			return False
+	def _ensureInRegistry(self, name: str):
+		"""Fails as soon as a package missing in the registries is discovered, before fetching anything for it. The misses are remembered until the set of packages in the registries changes."""
 
-		version = install.getInstalledPackageVersion(el.name)
-		if version:
-			print(styles.entity(self.depsKind.packageTypeName) + " " + styles.varContent(el.name) + " " + styles.entity("version") + " installed: " + styles.varContent(str(version)))
-			if not prefs.upgrade:
-				print(styles.operationName("No upgrade") + ", may " + styles.operationName("skip") + " if suitable " + styles.entity("version") + " installed")
-				if prefs.forceReinstall:
-					print(styles.operationName("Forcing reinstallation..."), styles.varContent(el))
-				else:
-					if list(el.specifier.filter((version,), prereleases=True)):
-						print(styles.success("Suitable " + styles.entity("version") + " installed") + ", " + styles.operationName("skipping ") + str(styles.varContent(el)))
-						return False
-			else:
-				print("`upgrade`==`True`, non-skipping", el)
-		else:
-			print(styles.entity(self.depsKind.packageTypeName) + " " + styles.varContent(el.name) + " " + "not installed")
+		if self.negativeCache is not None and self.negativeCache.isMissing(name, self.registry):
+			raise KnownFailureError(styles.varContent(name) + " has recently been missing in all the registries, which have not changed since then. Use `--refresh` to look it up anyway.")
 
-		return True
+		try:
+			self.registry.lookup(name)
+		except KeyError:
+			if self.negativeCache is not None:
+				self.negativeCache.recordMissing(name, self.registry)
+			raise
 
-	def isAlreadyBeingProcessed(self, el) -> ResolutionSubRoundPipelineStage:
-		for stage, collectionGetter in self.__class__._STAGE_TO_COLLECTION.items():
-			isAlreadyFetched = collectionGetter(self).get(el, None)
-			if isAlreadyFetched:
-				return stage
+	def _guessDeps(self, name: str) -> typing.Sequence[str]:
+		"""The names of the deps a package had when it was resolved the last time"""
 
-		return ResolutionSubRoundPipelineStage.notResolved
+		if self.depsHints is not None and name in self.depsHints:
+			return self.depsHints[name]
 
-	def genInstallTargets(self, installDirs) -> typing.Iterator[InstallationTarget]:
-		for el in reversed(self.resolved):
-			yield InstallationTarget(installDirs[el])
+		if self.metadataCache is None:
+			return ()
 
-	_STAGE_TO_COLLECTION = {
-		# ResolutionSubRoundPipelineStage.notResolved: lambda self: self.toFetch,
-		ResolutionSubRoundPipelineStage.fetched: lambda self: self.fetched,
-		ResolutionSubRoundPipelineStage.depsResolved: lambda self: self.resolved,
-	}
+		try:
+			fetcherSpec = self.registry.lookup(name).pkg.fetcher
+		except KeyError:
+			return ()
 
-	def stageToCollection(self, stage: ResolutionSubRoundPipelineStage):
-		return self.__class__._STAGE_TO_COLLECTION[stage](self)
+		if not isinstance(fetcherSpec, SourceFetcher):
+			return ()
 
-	def appendNewDeps(self, prefs: ResolutionPrefs, srcList, otherSubRounds: typing.List["ResolutionSubRound"], successor: "ResolutionSubRound"):
-		ic(self.depsKind.packageTypeName, srcList)
+		md = self.metadataCache.latest(fetcherSpec.repo, fetcherSpec.subDir)
+		if md is None:
+			return ()
 
-		# ToDo: Markers are currently ignored
-		for el in srcList:
-			ic(el.name in self.ignored)
-			if el.name in self.ignored:
-				print(styles.operationName("Ignoring") + " " + styles.entity(self.depsKind.packageTypeName) + ", must be system installed: " + styles.varContent(str(el)))
-				continue
+		try:
+			return [el.name for el in list(md.buildDeps) + list(md.deps) if self.targetEnvironment.isApplicable(el)]
+		except Exception:  # a guess is not worth failing for
+			return ()
 
-			ic(self.isReInstallationNeeded(el, prefs))
-			if not self.isReInstallationNeeded(el, prefs):
-				continue
+	def _prefetch(self, name: str):
+		"""Runs in a worker thread of the speculative executor"""
+
+		try:
+			fetcherSpec = self.registry.lookup(name).pkg.fetcher
+			if not isinstance(fetcherSpec, SourceFetcher) or fetcherSpec.type not in prefetchers:
+				return
 
-			el = el.name
-
-			for otherSubRound in otherSubRounds:
-				ic(otherSubRound)
-				otherRoundStage = otherSubRound.isAlreadyBeingProcessed(el)
-				if otherRoundStage:
-					if self.depsKind.moveToThis:
-						otherRoundCollection = otherSubRound.stageToCollection(otherRoundStage)
-						thisRoundCollection = otherSubRound.stageToCollection(otherRoundStage)
-						thisRoundCollection[el] = 1
-						del otherRoundCollection[el]
-					else:
-						print(styles.success("Already") + " " + styles.operationName("scheduled") + " for " + styles.operationName(otherRoundStage.name) + " in " + styles.entity(otherSubRound.depsKind.packageTypeName) + "s, skipping")
+			prefetcher = prefetchers[fetcherSpec.type]
+			if getDefaultFetchScheduler().speculative(fetcherSpec.repo, prefetcher, fetcherSpec.repo, self.sourcesPath / name, refSpec=fetcherSpec.refSpec, **fetcherSpec.fetcherKwargs):
+				print(styles.success("Prefetched") + " the likely " + styles.entity("dep") + " " + styles.varContent(name))
+		except Exception as ex:
+			print(styles.error("Error") + " " + styles.operationName("prefetching") + " " + styles.varContent(name) + ", ignoring: " + repr(ex))
+
+	def _prefetchLikelyDeps(self, prefs: ResolutionPrefs, names: typing.Iterable[str], speculativeExecutor) -> list:
+		"""Starts warming the mirrors of the packages the ones being fetched depended on the last time, transitively, so their fetches, if they turn out to be needed, don't wait for the network. Returns the futures."""
+
+		res = []
+		toGuess = list(names)
+		while toGuess:
+			for depName in self._guessDeps(toGuess.pop()):
+				if depName in self.graph or depName in self.prefetched:
 					continue
 
-			currentRoundStage = self.isAlreadyBeingProcessed(el)
-			if currentRoundStage:
-				print(styles.success("Already") + " " + styles.success(currentRoundStage.name) + " in " + styles.entity(self.depsKind.packageTypeName) + "s, will be processed in the next round, skipping")
-				continue
+				self.prefetched.add(depName)
+				toGuess.append(depName)
+				if not prefs.upgrade and install.getInstalledPackageVersion(depName):
+					continue  # likely to be satisfied
 
-			successor.toFetch[el] = 1
+				res.append(speculativeExecutor.submit(self._prefetch, depName))
 
+		return res
 
-class ResolutionRound:
-	__slots__ = ("subRounds",)
+	def _schedule(self, prefs: ResolutionPrefs, dependent: ResolutionNode, el, kind: DepsKindID, toFetch: typing.Dict[str, bool]):
+		name = el.name
+		extras = {canonicalizeExtraName(e) for e in getattr(el, "extras", ())}
+		node = self.graph.nodes.get(name, None)
+		neededForBuild = kind == DepsKindID.build or dependent.neededForBuild
+		packageTypeName = DEPS_KINDS[DepsKindID.build if neededForBuild else DepsKindID.pkgs].packageTypeName
+		depPrefs = prefs.clone(**DEPS_KINDS[kind].prefsPatch)
+
+		if node is not None:
+			newExtras = extras - node.extras
+			node.extras |= extras
+			node.constraints.append((dependent.name, el))
+			self.graph.addEdge(dependent.name, name, kind)
+			if node.state == ResolutionNodeState.system:
+				print(styles.operationName("Ignoring") + " " + styles.entity(packageTypeName) + ", must be system installed: " + styles.varContent(str(el)))
+			elif node.state == ResolutionNodeState.satisfied and not node.requested and isReInstallationNeeded(el, depPrefs, packageTypeName):
+				node.state = ResolutionNodeState.scheduled  # the installed version suits the previous dependents, but not this one
+				toFetch[name] = neededForBuild
+			else:
+				print(styles.success("Already") + " " + styles.operationName(node.state.name) + ": " + styles.varContent(name) + ", skipping")
+				if newExtras:
+					self._scheduleExtrasDeps(prefs, node, newExtras, toFetch)
+			return
+
+		if isReInstallationNeeded(el, depPrefs, packageTypeName):
+			self._ensureInRegistry(name)
+			node = self.graph.add(ResolutionNode(name, extras=extras))
+			toFetch[name] = neededForBuild
+		else:
+			node = self.graph.add(ResolutionNode(name, ResolutionNodeState.satisfied, extras=extras))
 
-	def __init__(self):
-		self.subRounds = {k: ResolutionSubRound(v) for k, v in DEPS_KINDS.items()}
+		node.constraints.append((dependent.name, el))
+		self.graph.addEdge(dependent.name, name, kind)
+		if extras:
+			self._scheduleExtrasDeps(prefs, node, extras, toFetch)
 
-	@property
-	def build(self):
-		return self.subRounds[DepsKindID.build]
+	def _extractMetadata(self, node: ResolutionNode):
+		"""Extracts metadata of a fetched package, reusing the one extracted earlier from the same commit if it is in the cache"""
 
-	@property
-	def pkgs(self):
-		return self.subRounds[DepsKindID.pkgs]
+		key = metadataCacheKey(self.directURLs.get(node.name, None)) if self.metadataCache is not None else None
+		if key is None:
+			return extractMetadata(node.installDir)
+
+		md = self.metadataCache.get(key)
+		if md is not None:
+			print(styles.success("Cached") + " " + styles.entity("metadata") + " of " + styles.varContent(node.name) + " " + styles.operationName("reused"))
+			return md
+
+		return self.metadataCache.put(key, extractMetadata(node.installDir))
 
-	def __bool__(self) -> bool:
-		return any(self.subRounds[dki] for dki in DepsKindID)
+	def _resolveNode(self, prefs: ResolutionPrefs, node: ResolutionNode, toFetch: typing.Dict[str, bool]) -> bool:
+		"""Extracts metadata of a fetched package and adds its deps into the graph. Returns whether the package computes its version from VCS tags."""
 
-	def __repr__(self):
-		return self.__class__.__name__ + "<" + ", ".join(repr(self.subRounds[dki]) for dki in DepsKindID) + ">"
+		md = self.metadata[node.name] = self._extractMetadata(node)
+		for kind, depsKind in DEPS_KINDS.items():
+			for el in depsKind.depsGetter(prefs, md):
+				if not self.targetEnvironment.isApplicable(el, node.extras):  # pruned before any lookup or fetching
+					print(styles.operationName("Pruned") + " " + styles.entity(depsKind.packageTypeName) + " not needed in the target environment: " + styles.varContent(str(el)))
+					continue
+				unpinRequirement(el)
+				self._schedule(prefs, node, el, kind, toFetch)
 
-	def thisOtherSubRounds(self):
-		subRoundsSet = set(self.subRounds)
+		if node.extras and prefs.resolveDeps:
+			for el in self._applicableExtrasDeps(node, md, node.extras):
+				unpinRequirement(el)
+				self._schedule(prefs, node, el, DepsKindID.pkgs, toFetch)
 
-		for thisSubRoundIdx in self.subRounds:
-			thisSubRound = self.subRounds[thisSubRoundIdx]
-			otherSubRounds = [self.subRounds[otherSubRoundIdx] for otherSubRoundIdx in (subRoundsSet - {thisSubRoundIdx})]
+		node.state = ResolutionNodeState.resolved
+		return isVersionedUsingVCS(md)
 
-			yield (thisSubRound, otherSubRounds)
+	def __call__(self, prefs: ResolutionPrefs, names: typing.Collection[str], fetchHistories: bool = True) -> typing.Tuple[InstallationCollection, ...]:
+		"""`fetchHistories` can be disabled if nothing is going to be built, i.e. only the plan is needed"""
 
-	def subroundSuccessorPrefs(self, prefs: ResolutionPrefs, successor: "ResolutionRound"):
-		for thisSubRoundIdx in self.subRounds:
-			thisSubRound = self.subRounds[thisSubRoundIdx]
-			thisSubRoundPrefs = prefs.clone(**thisSubRound.depsKind.prefsPatch)
-			successorSubRound = successor.subRounds[thisSubRoundIdx]
+		ic(prefs, names)
+		prefs = prefs.clone(upgrade=False)
+		graph = self.graph = ResolutionGraph()
+
+		toFetch = {}  # names discovered but not yet submitted, mapped to whether they are needed for building
+		for el in names:
+			req = canonicalizedRequirement(el)
+			if not self.targetEnvironment.isApplicable(req):
+				print(styles.operationName("Pruned") + " requested " + styles.entity("package") + " not needed in the target environment: " + styles.varContent(str(el)))
+				continue
+			self._ensureInRegistry(req.name)
+			graph.add(ResolutionNode(req.name, requested=True, extras={canonicalizeExtraName(e) for e in getattr(req, "extras", ())})).constraints.append((None, req))
+			toFetch[req.name] = False
+
+		with self.pool.executor() as executor, self.pool.speculativeExecutor() as speculativeExecutor:
+			inFlight = {}  # the futures of all the network operations, mapped to the callbacks processing their results in this thread
+			locatingErrors = {}
+			fetchingErrors = {}
+			deepeningErrors = {}
+			prefetches = []
+			busy = set()  # the checkouts being fetched or widened
+
+			def submit(task: typing.Callable, onDone: typing.Callable):
+				inFlight[executor.submit(task)] = onDone
+
+			def resolveFetched(installDirs: typing.Mapping[str, Path]):
+				versionedUsingVCS = []
+				for name, installDir in installDirs.items():
+					node = graph[name]
+					node.state = ResolutionNodeState.fetched
+					node.installDir = self.installDirs[name] = installDir
+					if self._resolveNode(prefs, node, toFetch):
+						versionedUsingVCS.append(name)
+
+				self.versionedUsingVCS.update(versionedUsingVCS)
+				if versionedUsingVCS and fetchHistories:
+					for name, task in historyDeepeningTasks(self.repoDirs, versionedUsingVCS, self.registry, self.directURLs, self.deepenedRepoDirs).items():
+						submit(task, partial(historyDeepened, name))
+
+			def historyDeepened(name: str, future):
+				try:
+					reportHistoryDeepened(name, future.result())
+				except Exception as ex:
+					deepeningErrors[name] = ex
+
+			def checkoutFetched(checkout: RepoCheckout, future):
+				busy.discard(checkout)
+				try:
+					revision = future.result()
+				except Exception as ex:
+					fetchingErrors.update((name, ex) for name, _ in checkout.pending)
+					return
+
+				installDirs = checkout.fetched(revision, self.directURLs, self.deferredCheckouts, self.repoDirs)
+				if not fetchingErrors:
+					resolveFetched(installDirs)
+					widen(checkout)
+
+			def checkoutWidened(checkout: RepoCheckout, names: typing.Collection[str], future):
+				busy.discard(checkout)
+				try:
+					future.result()
+				except Exception as ex:
+					fetchingErrors.update((name, ex) for name in names)
+					return
+
+				installDirs = checkout.record(names, self.directURLs, self.deferredCheckouts, self.repoDirs)
+				print(styles.success("Materialized") + " " + ", ".join(styles.varContent(name) for name in installDirs) + " in the shared checkout " + str(checkout.repoDir))
+				if not fetchingErrors:
+					resolveFetched(installDirs)
+					widen(checkout)
+
+			def widen(checkout: RepoCheckout):
+				"""Materializes the packages which have joined a checkout already fetched. Waits for the fetch or the widening in flight, the ones joining meanwhile are materialized after it."""
+
+				if checkout in busy or not checkout.pending:
+					return
+
+				busy.add(checkout)
+				names = [name for name, _ in checkout.pending]
+				task = checkout.widenTask()
+				if task is not None:
+					submit(task, partial(checkoutWidened, checkout, names))
+					return
+
+				separate = RepoCheckout(checkout.fetcherSpec, self.sourcesPath / names[0], checkout.twoPhase)  # the fetcher cannot widen checkouts
+				for name, spec in checkout.pending:
+					separate.add(name, spec)
+				checkout.pending = []
+				busy.discard(checkout)
+				busy.add(separate)
+				submit(separate.fetchTask(), partial(checkoutFetched, separate))
+
+			def fetch(names: typing.Collection[str]):
+				if fetchingErrors or locatingErrors:
+					return
+
+				checkouts, joined, inPlace, inPlaceErrors, ignored = planPackagesFetching(self.sourcesPath, names, self.registry, True, self.directURLs, self.repoCheckouts)
+				for ignoredPackage in ignored:
+					if ignoredPackage.fetcher.type not in {Source.system}:
+						raise NotImplementedError("Fetcher is not implemented yet")
+					graph[ignoredPackage.name].state = ResolutionNodeState.system
+
+				locatingErrors.update(inPlaceErrors)
+				for checkout in checkouts.values():
+					busy.add(checkout)
+					submit(checkout.fetchTask(), partial(checkoutFetched, checkout))
+				for checkout in joined:
+					widen(checkout)
+				resolveFetched(inPlace)
+
+			def startBatch(batchPrefs: ResolutionPrefs, batch: typing.List[str]):
+				"""The packages installed from the latest revisions are skipped, the rest of the batch is fetched when all of them are probed"""
+
+				probes = {} if batchPrefs.forceReinstall else {name: probe for name, probe in ((name, unchangedPackageProbe(name, self.registry)) for name in batch) if probe is not None}
+				if not probes:
+					fetch(batch)
+					return
+
+				unchanged = set()
+
+				def probed(name: str, future):
+					del probes[name]
+					if future.result():
+						unchanged.add(name)
+						graph[name].state = ResolutionNodeState.satisfied
+						print(styles.varContent(name) + " is installed from the latest " + styles.entity("revision") + ", " + styles.operationName("skipping"))
+					if not probes:
+						fetch([name for name in batch if name not in unchanged])
+
+				for name, probe in list(probes.items()):
+					submit(probe, partial(probed, name))
+
+			while toFetch or inFlight:
+				discovered = dict(toFetch)
+				toFetch.clear()
+				if not (fetchingErrors or locatingErrors):
+					for neededForBuild in (True, False):
+						batch = [name for name, nfb in discovered.items() if nfb == neededForBuild]
+						if batch:
+							batchPrefs = prefs.clone(**DEPS_KINDS[DepsKindID.build if neededForBuild else DepsKindID.pkgs].prefsPatch)
+							prefetches.extend(self._prefetchLikelyDeps(batchPrefs, batch, speculativeExecutor))
+							startBatch(batchPrefs, batch)
+
+				if not inFlight:
+					continue
 
-			yield (thisSubRound, successorSubRound, thisSubRoundPrefs)
+				done, _ = wait(inFlight, return_when=FIRST_COMPLETED)
+				for future in done:
+					inFlight.pop(future)(future)
 
-	def _processResolutionForCurrentSubRound(self, prefs: ResolutionPrefs, successor: "ResolutionRound", thisSubRound: ResolutionSubRound, otherSubRounds: typing.Iterable[ResolutionSubRound]):
-		ic(thisSubRound, otherSubRounds)
-		for name, installDir in thisSubRound.fetched.items():
-			ic(name, name not in thisSubRound.ignored)
-			if name not in thisSubRound.ignored:
-				md = extractMetadata(installDir)
+			for future in prefetches:  # the guesses not started yet are useless now, the ones running are waited for, their results stay in the mirrors
+				future.cancel()
 
-				for (subRoundForDepsExtr, successorSubRound, thisSubRoundPrefs) in self.subroundSuccessorPrefs(prefs, successor):
-					deps = subRoundForDepsExtr.getDeps(prefs, md)
+		if fetchingErrors or locatingErrors:
+			raise packagesFetchingError(locatingErrors, fetchingErrors)
+		if deepeningErrors:
+			raise historiesFetchingError(deepeningErrors)
 
-					thisSubRound.appendNewDeps(thisSubRoundPrefs, deps, otherSubRounds, successor=successorSubRound)
+		ic(graph)
+		self.checkConflicts()
+		return self.installCollections()
 
-					ic(subRoundForDepsExtr, successorSubRound, thisSubRoundPrefs)
+	def checkConflicts(self):
+		"""Intersects all the requirements on each package in the graph and fails if some of them cannot be satisfied together, before anything is built"""
 
-			successor.subRounds[thisSubRound.depsKind.idx].resolved[name] = installDir
+		installedVersions = {}
+		for node in self.graph.nodes.values():
+			if node.state in {ResolutionNodeState.satisfied, ResolutionNodeState.system}:
+				version = install.getInstalledPackageVersion(node.name)
+				if version is not None:
+					installedVersions[node.name] = version
 
-	def _resolveDeps(self, prefs: ResolutionPrefs, successor: "ResolutionRound"):
-		for thisSubRound, otherSubRounds in self.thisOtherSubRounds():
-			self._processResolutionForCurrentSubRound(prefs, successor, thisSubRound, otherSubRounds)
+		conflicts = findConflicts({node.name: node.constraints for node in self.graph.nodes.values()}, installedVersions)
+		if conflicts:
+			for conflict in conflicts:
+				print(styles.error("Conflict") + " " + str(conflict))
+			raise DependencyConflictsError("Some requirements cannot be satisfied together, nothing has been built", conflicts)
 
-	def __call__(self, prefs: ResolutionPrefs, installDirs, sourcesDir: Path, registry):
-		nextRound = ResolutionRound()
+	def installCollections(self) -> typing.Tuple[InstallationCollection, ...]:
+		"""The install plan split into build tools, which are to be installed first, and the rest. Both are ordered topologically."""
 
-		for dki in DepsKindID:
-			print("self.subRounds[" + repr(dki) + "].fetch(installDirs, sourcesDir, registry)")
-			self.subRounds[dki].fetch(installDirs, sourcesDir, registry)
+		res = tuple(InstallationCollection(dk, []) for dk in DEPS_KINDS.values())
+		for node in self.graph.installPlan():
+			kind = DepsKindID.build if node.neededForBuild else DepsKindID.pkgs
+			res[kind].targets.append(InstallationTarget(node.installDir, self.directURLs.get(node.name, None), self.deferredCheckouts.get(node.name, None), name=node.name, buildDeps=[k for k, v in node.deps.items() if v == DepsKindID.build], deps=[k for k, v in node.deps.items() if v == DepsKindID.pkgs]))
 
-		print("self._resolveDeps(prefs, successor=nextRound)")
-		self._resolveDeps(prefs, successor=nextRound)
+		return res
 
-		for dki in DepsKindID:
-			installDirs.update(self.subRounds[dki].fetched)
+	@property
+	def sourcesPath(self) -> Path:
+		return Path(self.sourcesDir.name)
 
-		return nextRound
+	def clean(self):
+		closeCatFileBatches()
+		if self.sourcesDir:
+			self.sourcesDir.cleanup()
+		self.sourcesDir = None
@@ -7,6 +7,7 @@ import httpx
 import miniGHAPI.GitHubAPI
 
 from ..registries import Package, Registry, derivePackageNameFromURI
+from ..utils.FetchScheduler import getDefaultFetchScheduler, raiseForRetriableStatus
 from ..utils.metadataExtractor import tryExtractPEP517AndPEP621Metadata
 
 
@@ -73,6 +74,10 @@ class Rejection:
 		return self.code.__doc__.format(repoUrl=self.repoUrl, httpStatus=self.httpStatus, pptU=self.pptU, conflictingPackage=self.conflictingPackage, exception=self.exception)
 
 
+def _getRawFile(uri: str, timeout: float) -> httpx.Response:
+	return raiseForRetriableStatus(httpx.get(uri, timeout=timeout))
+
+
 def filterPyprojectRepos(packageUrlsCandidates: typing.Iterable[PackageUrlCandidate], timeout: float) -> typing.Iterable[Package]:
 	try:
 		import tomllib
@@ -87,7 +92,7 @@ def filterPyprojectRepos(packageUrlsCandidates: typing.Iterable[PackageUrlCandid
 		p = rc.package
 		repoUrl = p.repo
 
-		pptRes = httpx.get(pptU, timeout=timeout)
+		pptRes = getDefaultFetchScheduler()(pptU, _getRawFile, pptU, timeout)
 		if pptRes.status_code // 100 == 4:
 			rejections.append(Rejection(RejectCode.noPyprojectToml, repoUrl, pptRes.status_code, pptU))
 			continue
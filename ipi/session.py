@@ -0,0 +1,256 @@
+"""Resumable installations: the progress of an installation is checkpointed on disk, so a failed one can be continued from the last stage each package has completed instead of being started over."""
+
+import hashlib
+import re
+import shutil
+import sys
+import threading
+import typing
+from enum import IntEnum
+from pathlib import Path
+
+from .lock import Lock
+from .utils.json import json
+from .utils.styles import styles
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+__all__ = ("InstallSession", "SessionStage", "SessionBusyError", "UnfinishedSessionError", "WrongTargetError", "getDefaultSessionDir", "currentTarget", "SESSION_FORMAT_VERSION")
+
+SESSION_FORMAT_VERSION = 2
+
+unsafeCharsRx = re.compile("[^\\w.-]+")
+
+
+def currentTarget() -> str:
+	"""The environment the packages are installed into: the prefix of the current interpreter, which is a venv if one is active"""
+
+	return str(Path(sys.prefix).absolute())
+
+
+def getDefaultSessionDir(target: typing.Optional[str] = None) -> typing.Optional[Path]:
+	"""The session dir of the installations into `target` (the current environment if not set) within the state dir, so the installations into different environments don't interfere. `None` if there is no state dir."""
+
+	from .settings import sessionsDir
+
+	if sessionsDir is None:
+		return None
+
+	if target is None:
+		target = currentTarget()
+
+	readable = unsafeCharsRx.sub("_", target).strip("_")
+	return sessionsDir / (readable[-64:] + "-" + hashlib.sha256(target.encode("utf-8")).hexdigest()[:16])
+
+
+class SessionStage(IntEnum):
+	depsResolved = 0
+	built = 1
+	installed = 2
+
+
+SessionStage.depsResolved.__doc__ = "The package is in the resolution, its revision is recorded"
+SessionStage.built.__doc__ = "The wheel is built and kept within the session dir, the sources are not needed anymore"
+SessionStage.installed.__doc__ = "The wheel is installed"
+
+
+class SessionBusyError(RuntimeError):
+	__slots__ = ()
+
+
+class UnfinishedSessionError(RuntimeError):
+	__slots__ = ()
+
+
+class WrongTargetError(RuntimeError):
+	__slots__ = ()
+
+
+class SessionDirLock:
+	"""Keeps other processes from using the same session dir at the same time. The lock file is next to the dir, since the dir is removed when the session is finished."""
+
+	__slots__ = ("dir", "file")
+
+	def __init__(self, dir: Path):
+		self.dir = dir
+		self.file = None
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.dir) + ", " + ("acquired" if self.file is not None else "released") + ")"
+
+	def acquire(self):
+		self.dir.parent.mkdir(parents=True, exist_ok=True)
+		f = open(str(self.dir) + ".lock", "wb")
+		if fcntl is not None:
+			try:
+				fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError:
+				f.close()
+				raise SessionBusyError("The session is being used by another process", self.dir) from None
+		self.file = f
+
+	def release(self):
+		if self.file is None:
+			return
+
+		if fcntl is not None:
+			fcntl.flock(self.file, fcntl.LOCK_UN)
+		self.file.close()
+		self.file = None
+
+
+class InstallSession:
+	"""The state of an installation persisted in `dir`: the resolution as a lock, the stage each package has reached and the wheels built but not yet installed. It is checkpointed after every stage a package completes and is removed when the installation is finished.
+	The dir is locked while the session is used, it must be `close`d (or `finish`ed) to release it."""
+
+	__slots__ = ("dir", "lock", "target", "stages", "wheels", "dirLock", "_lock")
+
+	FILE_NAME = "session.json"
+
+	def __init__(self, dir: Path, lock: Lock, target: str, stages: typing.Optional[typing.Dict[str, SessionStage]] = None, wheels: typing.Optional[typing.Dict[str, str]] = None, dirLock: typing.Optional[SessionDirLock] = None):
+		self.dir = dir
+		self.lock = lock
+		self.target = target
+		self.stages = stages if stages is not None else {p.name: SessionStage.depsResolved for p in lock.packages}
+		self.wheels = wheels if wheels is not None else {}
+		self.dirLock = dirLock
+		self._lock = threading.Lock()  # the packages are built concurrently
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.dir) + ", " + repr(self.stages) + ")"
+
+	@property
+	def filePath(self) -> Path:
+		return self.dir / self.__class__.FILE_NAME
+
+	@property
+	def wheelsPath(self) -> Path:
+		return self.dir / "wheels"
+
+	@classmethod
+	def exists(cls, dir: Path) -> bool:
+		return (dir / cls.FILE_NAME).is_file()
+
+	@classmethod
+	def ensureCanCreate(cls, dir: Path, discard: bool = False):
+		"""Fails if a new session in `dir` would discard an unfinished one (unless `discard`) or something that is not a session"""
+
+		if cls.exists(dir):
+			if not discard:
+				raise UnfinishedSessionError("There is an unfinished session. Use `--resume` to continue it or `--discard-session` to start over.", dir)
+		elif dir.exists() and (not dir.is_dir() or any(dir.iterdir())):
+			raise ValueError("Refusing to remove the dir, it doesn't contain a session", dir)
+
+	@classmethod
+	def create(cls, dir: Path, lock: Lock, discard: bool = False, target: typing.Optional[str] = None) -> "InstallSession":
+		"""Starts a new session of the installation into `target` (the current environment if not set). An unfinished one in `dir` is discarded only if `discard`."""
+
+		if target is None:
+			target = currentTarget()
+
+		dirLock = SessionDirLock(dir)
+		dirLock.acquire()
+		try:
+			cls.ensureCanCreate(dir, discard)
+			if cls.exists(dir):
+				print(styles.operationName("Discarding") + " the unfinished " + styles.entity("session") + " in " + styles.varContent(str(dir)))
+				shutil.rmtree(dir)
+
+			res = cls(dir, lock, target, dirLock=dirLock)
+			res.save()
+		except BaseException:
+			dirLock.release()
+			raise
+
+		return res
+
+	@classmethod
+	def load(cls, dir: Path, target: typing.Optional[str] = None) -> "InstallSession":
+		"""Fails if the session installs into an environment other than `target` (the current one if not set). The packages which wheels have disappeared are to be built again."""
+
+		if target is None:
+			target = currentTarget()
+
+		if not cls.exists(dir):
+			raise ValueError("No unfinished session to resume", dir)
+
+		dirLock = SessionDirLock(dir)
+		dirLock.acquire()
+		try:
+			d = json.loads((dir / cls.FILE_NAME).read_text())
+			version = d.get("version", None)
+			if version != SESSION_FORMAT_VERSION:
+				raise ValueError("Unsupported version of the session format", version, SESSION_FORMAT_VERSION)
+
+			if d["target"] != target:
+				raise WrongTargetError("The session installs into another environment", d["target"], target)
+
+			res = cls(dir, Lock.fromJSON(d["lock"]), d["target"], {k: SessionStage[v] for k, v in d["stages"].items()}, d.get("wheels", {}), dirLock=dirLock)
+		except BaseException:
+			dirLock.release()
+			raise
+
+		for name, stage in res.stages.items():
+			if stage == SessionStage.built and res.builtWheel(name) is None:
+				res.stages[name] = SessionStage.depsResolved
+				res.wheels.pop(name, None)
+		return res
+
+	def save(self):
+		"""The file is replaced atomically, so an interrupted checkpoint leaves the previous one intact"""
+
+		with self._lock:
+			self.dir.mkdir(parents=True, exist_ok=True)
+			tmp = self.filePath.with_suffix(".tmp")
+			tmp.write_text(json.dumps({"version": SESSION_FORMAT_VERSION, "target": self.target, "lock": self.lock.toJSON(), "stages": {k: v.name for k, v in self.stages.items()}, "wheels": dict(self.wheels)}, indent="\t"))
+			tmp.replace(self.filePath)
+
+	def stage(self, name: str) -> SessionStage:
+		return self.stages.get(name, SessionStage.depsResolved)
+
+	def wheelsDir(self, name: str) -> Path:
+		res = self.wheelsPath / name
+		res.mkdir(parents=True, exist_ok=True)
+		return res
+
+	def builtWheel(self, name: str) -> typing.Optional[Path]:
+		"""The wheel built in this session, if it is still present"""
+
+		fileName = self.wheels.get(name, None)
+		if fileName is None:
+			return None
+
+		res = self.wheelsPath / name / fileName
+		return res if res.is_file() else None
+
+	def markBuilt(self, name: str, wheel: Path):
+		with self._lock:
+			self.stages[name] = SessionStage.built
+			self.wheels[name] = wheel.name
+		self.save()
+
+	def markInstalled(self, name: str):
+		shutil.rmtree(self.wheelsPath / name, ignore_errors=True)
+		with self._lock:
+			self.stages[name] = SessionStage.installed
+			self.wheels.pop(name, None)
+		self.save()
+
+	def pending(self, stage: SessionStage) -> Lock:
+		"""The packages which have not yet reached `stage`, in the order of installation"""
+
+		return Lock(p for p in self.lock.packages if self.stage(p.name) < stage)
+
+	def close(self):
+		"""Releases the dir, the session stays there to be resumed"""
+
+		if self.dirLock is not None:
+			self.dirLock.release()
+
+	def finish(self):
+		if self.__class__.exists(self.dir):
+			shutil.rmtree(self.dir, ignore_errors=True)
+		self.close()
@@ -16,6 +16,12 @@ except ImportError:
 		settingsDir = None
 		privateRegistriesDir = None
 		reposRoot = None
+		mirrorsDir = None
+		bundlesConfigFile = None
+		metadataCacheFile = None
+		negativeCacheFile = None
+		wheelCacheDir = None
+		sessionsDir = None
 	else:
 		settingsDir = Path(platformdirs.user_state_dir(**_appdirsConfigDict))
 else:
@@ -25,3 +31,9 @@ else:
 if settingsDir is not None:
 	privateRegistriesDir = settingsDir / "privateRegs"
 	reposRoot = settingsDir / "tuf"
+	mirrorsDir = settingsDir / "mirrors"
+	bundlesConfigFile = settingsDir / "bundles.tsv"
+	metadataCacheFile = settingsDir / "metadataCache.sqlite"
+	negativeCacheFile = settingsDir / "negativeCache.sqlite"
+	wheelCacheDir = settingsDir / "wheels"
+	sessionsDir = settingsDir / "sessions"
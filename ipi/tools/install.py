@@ -1,18 +1,24 @@
+import base64
+import csv
+import hashlib
 import sys
 import typing
 from pathlib import Path
 from warnings import warn
 
 from ..deps import sh
+from ..utils.json import json
 from ..deps.packaging import Version
 from ..utils.WithPythonPath import WithPythonPath, cookPythonPathEnvDict
-from .distlib import getInstalledPackageDistribution
+from .installedIndex import InstalledDistributionsIndex, genSearchPath, getInstalledDistributionsIndex, getInstalledPackageDistribution
 from .pip import getScheme
 from .python import python
 from .setup_py import setupPy
 
 setupPyInstallCmd = setupPy.bake("install")
 
+DIRECT_URL_FILE_NAME = "direct_url.json"
+
 
 def getInstalledPackageVersion(name: str) -> typing.Optional[Version]:
 	pkg = getInstalledPackageDistribution(name)
@@ -22,9 +28,81 @@ def getInstalledPackageVersion(name: str) -> typing.Optional[Version]:
 	return None
 
 
+def getInstalledPackageDirectURL(name: str) -> typing.Optional[dict]:
+	"""Returns the contents of `direct_url.json` (PEP 610) of the installed package, if any"""
+
+	pkg = getInstalledPackageDistribution(name)
+	if pkg is None:
+		return None
+
+	text = pkg.read_text(DIRECT_URL_FILE_NAME)
+	if not text:
+		return None
+
+	try:
+		return json.loads(text)
+	except ValueError:
+		return None
+
+
+def directURLInstallConfig(directURL: typing.Optional[dict], config: typing.Optional[dict] = None) -> typing.Optional[dict]:
+	"""Makes installer config recording `directURL` into the `dist-info` of the package being installed"""
+
+	if directURL is None:
+		return config
+
+	config = dict(config) if config else {}
+	additionalMetadata = dict(config.get("installAdditionalMetadata", {}))
+	additionalMetadata[DIRECT_URL_FILE_NAME] = json.dumps(directURL).encode("utf-8")
+	config["installAdditionalMetadata"] = additionalMetadata
+	return config
+
+
+def writeAdditionalMetadata(name: str, additionalMetadata: typing.Dict[str, bytes], destDir: typing.Optional[Path] = None) -> bool:
+	"""Writes the files of `installAdditionalMetadata` into the `dist-info` of the package installed by a backend which cannot do it itself (`pip`) and records them into its `RECORD`, so they are removed together with the package. `destDir` is the root the package was installed into, if any.
+	Warns and returns `False` if the `dist-info` is not found: the package then cannot be probed for being unchanged and is fetched again every time."""
+
+	if not additionalMetadata:
+		return True
+
+	if destDir is None:
+		index = getInstalledDistributionsIndex()
+		index.refresh((name,))
+	else:
+		index = InstalledDistributionsIndex(Path(destDir) / d.relative_to(d.anchor) for d in genSearchPath())
+
+	dist = index.get(name)
+	if dist is None or dist.path.suffix != ".dist-info" or not dist.path.is_dir():
+		warn("Cannot find the `dist-info` of " + repr(name) + " to record " + ", ".join(additionalMetadata) + " into, it will be fetched again on every installation")
+		return False
+
+	written = {}
+	for fileName, content in additionalMetadata.items():
+		(dist.path / fileName).write_bytes(content)
+		digest = base64.urlsafe_b64encode(hashlib.sha256(content).digest()).rstrip(b"=").decode("ascii")
+		written[dist.path.name + "/" + fileName] = ("sha256=" + digest, str(len(content)))
+
+	recordFile = dist.path / "RECORD"
+	if recordFile.is_file():
+		with recordFile.open("rt", encoding="utf-8", newline="") as f:
+			rows = [r for r in csv.reader(f) if r and r[0] not in written]  # `pip` records its own `direct_url.json` of the wheel file
+		rows.extend([k, *v] for k, v in written.items())
+		with recordFile.open("wt", encoding="utf-8", newline="") as f:
+			csv.writer(f, lineterminator="\n").writerows(rows)
+
+	return True
+
+
 def setupPyInstall(targetDir: Path, pythonPath=()):
 	"""Most likely you don't need it!"""
-	return setupPyInstallCmd(_cwd=targetDir, _env=cookPythonPathEnvDict(pythonPath))
+	try:
+		return setupPyInstallCmd(_cwd=targetDir, _env=cookPythonPathEnvDict(pythonPath))
+	finally:
+		getInstalledDistributionsIndex().invalidate()  # the name of what was installed is not known here
+
+
+def wheelDistributionName(wheel: Path) -> str:
+	return wheel.name.split("-", 1)[0]
 
 
 class Installer:
@@ -102,8 +180,14 @@ class PipCLIInstaller(Installer):
 
 	def __call__(self, wheels: typing.Iterable[Path], config=None, pythonPath=()):
 		print(wheels, config, pythonPath)
+		if config is None:
+			config = {}
+
 		if wheels:
-			pipInstallUpgradeCmd(*wheels, _env=cookPythonPathEnvDict(pythonPath))
+			destDir = config.get("destDir", None)
+			pipInstallUpgradeCmd(*(("--root", destDir) if destDir else ()), *wheels, _env=cookPythonPathEnvDict(pythonPath))
+			for w in wheels:
+				writeAdditionalMetadata(wheelDistributionName(w), config.get("installAdditionalMetadata", {}), destDir)
 
 
 class PipCLIUnInstaller(Installer):
@@ -0,0 +1,210 @@
+import re
+import sys
+import threading
+import typing
+from pathlib import Path
+
+from .pip import SchemeT, getScheme
+
+__all__ = ("InstalledDistribution", "InstalledDistributionsIndex", "getInstalledDistributionsIndex", "getInstalledPackageDistribution")
+
+METADATA_FILES_NAMES = {
+	".dist-info": "METADATA",
+	".egg-info": "PKG-INFO",
+}
+
+
+nameSeparatorsRx = re.compile("[-_.]+")
+
+
+def indexKey(name: str) -> str:
+	"""Installers escape the names differently in the names of the metadata dirs, so all the separators are treated as equal (like PEP 503 does)"""
+
+	return nameSeparatorsRx.sub("-", name).lower()
+
+
+def genSearchPath(scheme: typing.Optional[SchemeT] = None) -> typing.Tuple[Path, ...]:
+	"""The dirs the distributions are installed into: the ones of the install scheme if `pip` is available, `sys.path` otherwise"""
+
+	if scheme is None and getScheme is not None:
+		scheme = getScheme()
+
+	if scheme is not None:
+		dirs = [scheme[k] for k in ("platlib", "platstdlib", "purelib")]
+	else:
+		dirs = sys.path
+
+	res = []
+	for d in dirs:
+		d = Path(d)
+		if d.is_dir() and d not in res:
+			res.append(d)
+	return tuple(res)
+
+
+def parseMetadataHeaders(metadataFile: Path) -> typing.Tuple[typing.Optional[str], typing.Optional[str]]:
+	"""Reads only `Name` and `Version` from the headers of a core metadata file, the body is not read"""
+
+	name = version = None
+	with metadataFile.open("rt", encoding="utf-8", errors="replace") as f:
+		for l in f:
+			if not l.strip():
+				break
+			k, _, v = l.partition(":")
+			k = k.lower()
+			if k == "name":
+				name = v.strip()
+			elif k == "version":
+				version = v.strip()
+			if name is not None and version is not None:
+				break
+
+	return name, version
+
+
+class InstalledDistribution:
+	__slots__ = ("name", "version", "path")
+
+	def __init__(self, name: str, version: str, path: Path):
+		self.name = name
+		self.version = version
+		self.path = path
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.name) + ", " + repr(self.version) + ", " + repr(self.path) + ")"
+
+	def read_text(self, fileName: str) -> typing.Optional[str]:  # the same API `importlib.metadata.Distribution` has
+		if not self.path.is_dir():
+			return None
+
+		f = self.path / fileName
+		return f.read_text("utf-8") if f.is_file() else None
+
+	@property
+	def requiresDist(self) -> typing.List[str]:
+		"""The deps recorded into the core metadata, including the ones of extras, which are gated by the `extra` marker"""
+
+		metadataFile = self.path / METADATA_FILES_NAMES[self.path.suffix] if self.path.is_dir() else self.path
+		res = []
+		with metadataFile.open("rt", encoding="utf-8", errors="replace") as f:
+			for l in f:
+				if not l.strip():
+					break
+				k, _, v = l.partition(":")
+				if k.lower() == "requires-dist":
+					res.append(v.strip())
+		return res
+
+	@classmethod
+	def fromPath(cls, p: Path) -> typing.Optional["InstalledDistribution"]:
+		metadataFileName = METADATA_FILES_NAMES.get(p.suffix, None)
+		if metadataFileName is None:
+			return None
+
+		metadataFile = p / metadataFileName if p.is_dir() else p  # old `egg-info`s may be plain files
+		if not metadataFile.is_file():
+			return None
+
+		name, version = parseMetadataHeaders(metadataFile)
+		if not name or not version:
+			return None
+
+		return cls(name, version, p)
+
+
+def dirEntryKey(fileName: str) -> typing.Optional[str]:
+	"""The key of the distribution derived from the name of its metadata dir (`<name>-<version>.dist-info`) without reading it"""
+
+	stem, dot, suffix = fileName.rpartition(".")
+	if not dot or "." + suffix not in METADATA_FILES_NAMES:
+		return None
+	return indexKey(stem.split("-", 1)[0])
+
+
+class InstalledDistributionsIndex:
+	"""A snapshot of the distributions installed, keyed by canonicalized names. The dirs are scanned once, then the index is updated only for the packages (un)installed."""
+
+	__slots__ = ("searchPath", "_dists", "_lock")
+
+	def __init__(self, searchPath: typing.Optional[typing.Iterable[Path]] = None):
+		self.searchPath = tuple(searchPath) if searchPath is not None else None
+		self._dists = None
+		self._lock = threading.RLock()
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.searchPath) + ", " + (str(len(self._dists)) + " dists" if self._dists is not None else "not scanned") + ")"
+
+	def _scan(self, onlyKeys: typing.Optional[typing.Collection[str]] = None) -> typing.Dict[str, typing.List[InstalledDistribution]]:
+		if self.searchPath is None:
+			self.searchPath = genSearchPath()
+
+		res = {}
+		for d in self.searchPath:
+			try:
+				fileNames = sorted(el.name for el in d.iterdir())
+			except OSError:
+				continue
+
+			for fileName in fileNames:
+				k = dirEntryKey(fileName)
+				if k is None or (onlyKeys is not None and k not in onlyKeys):
+					continue
+
+				dist = InstalledDistribution.fromPath(d / fileName)
+				if dist is not None:
+					res.setdefault(indexKey(dist.name), []).append(dist)
+
+		return res
+
+	@property
+	def dists(self) -> typing.Dict[str, typing.List[InstalledDistribution]]:
+		with self._lock:
+			if self._dists is None:
+				self._dists = self._scan()
+			return self._dists
+
+	def get(self, name: str) -> typing.Optional[InstalledDistribution]:
+		dists = self.dists.get(indexKey(name), None)
+		if not dists:
+			return None
+
+		names = {d.name for d in dists}
+		if len(names) > 1:  # it may be any combination!
+			raise RuntimeError("Distributions with differently spelled names are present, refuse to guess", dists)
+
+		return dists[0]
+
+	def refresh(self, names: typing.Iterable[str]):
+		"""Rescans only the entries of the packages just installed or uninstalled"""
+
+		keys = {indexKey(n) for n in names}
+		with self._lock:
+			if self._dists is None:
+				return
+
+			for k in keys:
+				self._dists.pop(k, None)
+			self._dists.update(self._scan(keys))
+
+	def invalidate(self):
+		"""Forces a full rescan, i.e. after something unknown was installed"""
+
+		with self._lock:
+			self._dists = None
+
+
+_defaultIndex = None
+_defaultIndexLock = threading.Lock()
+
+
+def getInstalledDistributionsIndex() -> InstalledDistributionsIndex:
+	global _defaultIndex
+
+	with _defaultIndexLock:
+		if _defaultIndex is None:
+			_defaultIndex = InstalledDistributionsIndex()
+		return _defaultIndex
+
+
+def getInstalledPackageDistribution(name: str) -> typing.Optional[InstalledDistribution]:
+	return getInstalledDistributionsIndex().get(name)
@@ -1,4 +1,5 @@
 import typing
+from functools import lru_cache
 from warnings import warn
 
 SchemeT = typing.Mapping[str, str]
@@ -16,10 +17,16 @@ except ImportError:
 	getPipScheme = None
 else:
 
-	def getScheme() -> SchemeT:
+	@lru_cache(maxsize=None)
+	def _getScheme() -> typing.Tuple[typing.Tuple[str, str], ...]:
 		sch = sysconfig.get_paths()
 		sch.update(getPipScheme())
-		return sch
+		return tuple(sch.items())
+
+	def getScheme() -> SchemeT:
+		"""Computed once per session, `pip` internals are slow"""
+
+		return dict(_getScheme())
 
 	def getPipScheme(distName: str = "") -> SchemeT:
 		isRoot = getuid() == 0 or running_under_virtualenv()
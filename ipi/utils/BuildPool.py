@@ -0,0 +1,105 @@
+import os
+import typing
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .styles import styles
+
+__all__ = ("BuildPool", "PackagesBuildingError")
+
+
+class PackagesBuildingError(RuntimeError):
+	"""Raised when building of some packages has failed. `errors` maps names of the packages to the exceptions."""
+
+	__slots__ = ()
+
+	@property
+	def errors(self) -> typing.Mapping[str, BaseException]:
+		return self.args[1]
+
+	def __str__(self) -> str:
+		return self.args[0] + ": " + ", ".join(k + ": " + repr(v) for k, v in self.errors.items())
+
+
+class BuildPool:
+	"""A bounded pool of threads running builds of packages concurrently. Each build is expected to run in its own subprocess, so the threads only wait. A package is built as soon as all the packages needed to build it are installed. The installs are serialized in the calling thread, a package is installed after all its deps are."""
+
+	__slots__ = ("concurrency",)
+
+	def __init__(self, concurrency: typing.Optional[int] = None) -> None:
+		if concurrency is None:
+			concurrency = os.cpu_count() or 1
+
+		if concurrency < 1:
+			raise ValueError("Concurrency must be positive", concurrency)
+
+		self.concurrency = concurrency
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.concurrency) + ")"
+
+	def __call__(self, names: typing.Sequence[str], buildPrereqs: typing.Mapping[str, typing.Collection[str]], installPrereqs: typing.Mapping[str, typing.Collection[str]], build: typing.Callable[[str], typing.Any], install: typing.Callable[[str, typing.Any], None]):
+		"""`names` are in the order of installation. `buildPrereqs` and `installPrereqs` map them to the names of the ones which must be installed before building and installing them. `build(name)` runs in a worker thread, `install(name, buildResult)` in the calling one. The deadlocks caused by cycles are broken by proceeding with the earliest package in `names`.
+		If a build fails, no more builds are started, the ones running are waited for and their packages are installed, then `PackagesBuildingError` is raised."""
+
+		toBuild = list(names)
+		built = {}  # name -> result, in the order of completion
+		installed = set()
+		inFlight = {}
+		errors = {}
+
+		def isReady(name: str, prereqs: typing.Mapping[str, typing.Collection[str]]) -> bool:
+			return all(dep in installed or dep == name for dep in prereqs.get(name, ()))
+
+		with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="build") as executor:
+
+			def submit(name: str):
+				toBuild.remove(name)
+				inFlight[executor.submit(build, name)] = name
+
+			while toBuild or inFlight or built:
+				if not errors:
+					for name in [n for n in toBuild if isReady(n, buildPrereqs)]:
+						submit(name)
+
+				installedCount = len(installed)
+				progress = True
+				while progress:
+					progress = False
+					for name in [n for n in names if n in built]:
+						if isReady(name, installPrereqs):
+							install(name, built.pop(name))
+							installed.add(name)
+							progress = True
+
+				if len(installed) != installedCount and not errors:  # may have unblocked some builds
+					continue
+
+				if not inFlight:
+					if errors:  # the rest wait for the failed ones
+						break
+
+					if built:  # a cycle among the installs
+						name = next(n for n in names if n in built)
+						print(styles.error("Dependency cycle") + " blocks installing " + styles.varContent(name) + ", installing it anyway")
+						install(name, built.pop(name))
+						installed.add(name)
+						continue
+
+					if not toBuild:
+						break
+
+					name = toBuild[0]  # a cycle among the builds
+					print(styles.error("Dependency cycle") + " blocks building " + styles.varContent(name) + ", building it anyway")
+					submit(name)
+
+				done, _ = wait(inFlight, return_when=FIRST_COMPLETED)
+				for future in done:
+					name = inFlight.pop(future)
+					try:
+						built[name] = future.result()
+					except Exception as ex:
+						print(styles.error("Error") + " " + styles.operationName("building") + " " + styles.varContent(name) + ": " + repr(ex))
+						errors[name] = ex
+
+		if errors:
+			raise PackagesBuildingError("Failed to build some packages", errors)
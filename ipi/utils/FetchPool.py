@@ -0,0 +1,73 @@
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ("FetchPool", "PackagesFetchingError")
+
+
+class PackagesFetchingError(RuntimeError):
+	"""Raised when fetching of some packages of a batch has failed. `errors` maps names of the packages to the exceptions."""
+
+	__slots__ = ()
+
+	@property
+	def errors(self) -> typing.Mapping[str, BaseException]:
+		return self.args[1]
+
+	def __str__(self) -> str:
+		return self.args[0] + ": " + ", ".join(k + ": " + repr(v) for k, v in self.errors.items())
+
+
+class FetchPool:
+	"""A bounded pool of threads running fetches (mostly `git clone`s, which are IO-bound subprocesses) concurrently.
+	A failure of one task doesn't abort the rest, errors are collected per task."""
+
+	__slots__ = ("concurrency",)
+
+	DEFAULT_CONCURRENCY = 8
+
+	def __init__(self, concurrency: typing.Optional[int] = None) -> None:
+		if concurrency is None:
+			concurrency = self.__class__.DEFAULT_CONCURRENCY
+
+		if concurrency < 1:
+			raise ValueError("Concurrency must be positive", concurrency)
+
+		self.concurrency = concurrency
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.concurrency) + ")"
+
+	def executor(self) -> ThreadPoolExecutor:
+		"""For the callers submitting the tasks as they are discovered rather than in batches"""
+
+		return ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="fetch")
+
+	def speculativeExecutor(self) -> ThreadPoolExecutor:
+		"""For the fetches which may turn out useless, a smaller share of the threads"""
+
+		return ThreadPoolExecutor(max_workers=max(1, self.concurrency // 4), thread_name_prefix="prefetch")
+
+	def __call__(self, tasks: typing.Mapping[str, typing.Callable[[], typing.Any]]) -> typing.Tuple[typing.Dict[str, typing.Any], typing.Dict[str, BaseException]]:
+		"""Runs the tasks and returns a tuple of 2 dicts: results and errors, both keyed by task names."""
+
+		res = {}
+		errors = {}
+
+		if self.concurrency == 1 or len(tasks) < 2:
+			for name, task in tasks.items():
+				try:
+					res[name] = task()
+				except Exception as ex:
+					errors[name] = ex
+			return res, errors
+
+		with ThreadPoolExecutor(max_workers=min(self.concurrency, len(tasks)), thread_name_prefix="fetch") as executor:
+			futures = {name: executor.submit(task) for name, task in tasks.items()}
+
+			for name, future in futures.items():
+				try:
+					res[name] = future.result()
+				except Exception as ex:
+					errors[name] = ex
+
+		return res, errors
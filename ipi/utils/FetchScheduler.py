@@ -0,0 +1,238 @@
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+import typing
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse
+
+from .styles import styles
+
+__all__ = ("FetchScheduler", "getDefaultFetchScheduler", "configureFetchScheduler", "isTransientError", "raiseForRetriableStatus")
+
+PROXY_ENV_VARS = ("HTTP_PROXY", "HTTPS_PROXY", "http_proxy", "https_proxy")
+
+RETRIABLE_HTTP_STATUSES = frozenset((408, 425, 429, 500, 502, 503, 504))
+
+# the messages of `git`, `hg` and `curl` about network failures worth retrying
+transientProcessErrorRx = re.compile(
+	"|".join(
+		(
+			"could not resolve host",
+			"temporary failure in name resolution",
+			"connection (timed out|reset|refused)",
+			"operation timed out",
+			"failed to connect",
+			"early eof",
+			"the remote end hung up unexpectedly",
+			"rpc failed",
+			"unexpected disconnect",
+			"tls|ssl|gnutls",
+			"returned error: (408|429|5[0-9][0-9])",
+			"http error (429|5[0-9][0-9])",
+			"abort: error: ",
+		)
+	),
+	re.IGNORECASE,
+)
+
+scpLikeURIRx = re.compile("^(?:[^@/:]+@)?([^/:]+):")
+
+
+def hostOf(uri: typing.Optional[str]) -> typing.Optional[str]:
+	"""The host the concurrency is limited for. `None` for local sources."""
+
+	if not uri:
+		return None
+
+	parsed = urlparse(uri)
+	if parsed.scheme and parsed.scheme != "file" and parsed.hostname:
+		return parsed.hostname.lower()
+
+	if not parsed.scheme or len(parsed.scheme) == 1:  # `git@github.com:a/b.git`, but not `C:\...`
+		m = scpLikeURIRx.match(uri)
+		if m and len(m.group(1)) > 1:
+			return m.group(1).lower()
+
+	return None
+
+
+def raiseForRetriableStatus(response):
+	"""For the HTTP clients (i.e. `httpx`) not raising on server-side errors themselves. Returns the response if its status is not worth retrying."""
+
+	if response.status_code in RETRIABLE_HTTP_STATUSES:
+		response.raise_for_status()
+	return response
+
+
+def isTransientError(ex: BaseException) -> bool:
+	"""Whether a failed network operation is worth retrying"""
+
+	try:
+		import httpx
+	except ImportError:
+		pass
+	else:
+		if isinstance(ex, httpx.HTTPStatusError):
+			return ex.response.status_code in RETRIABLE_HTTP_STATUSES
+		if isinstance(ex, httpx.TransportError):
+			return True
+
+	if isinstance(ex, HTTPError):
+		return ex.code in RETRIABLE_HTTP_STATUSES
+
+	if isinstance(ex, (URLError, ConnectionError, TimeoutError)):
+		return True
+
+	stderr = getattr(ex, "stderr", None)
+	if isinstance(ex, subprocess.CalledProcessError) or stderr is not None:
+		if not stderr:
+			return False  # the output of the commands run in foreground is not captured, a failure of unknown cause is not retried
+
+		if isinstance(stderr, bytes):
+			stderr = stderr.decode("utf-8", errors="replace")
+		return bool(transientProcessErrorRx.search(stderr))
+
+	return False
+
+
+class FetchScheduler:
+	"""Every network operation (fetching sources, updating TUF repos, downloading files from code hostings) goes through it.
+	Limits the count of concurrent operations per host, retries transient failures with jittered exponential backoff and applies the proxy settings."""
+
+	__slots__ = ("perHostConcurrency", "retries", "backoffBase", "backoffMax", "proxy", "_semaphores", "_semaphoresLock", "_held")
+
+	DEFAULT_PER_HOST_CONCURRENCY = 4
+	DEFAULT_RETRIES = 3
+	DEFAULT_BACKOFF_BASE = 1.0
+	DEFAULT_BACKOFF_MAX = 60.0
+
+	def __init__(self, perHostConcurrency: typing.Optional[int] = None, retries: typing.Optional[int] = None, proxy: typing.Optional[str] = None, backoffBase: typing.Optional[float] = None, backoffMax: typing.Optional[float] = None) -> None:
+		cls = self.__class__
+		self.perHostConcurrency = perHostConcurrency if perHostConcurrency is not None else cls.DEFAULT_PER_HOST_CONCURRENCY
+		self.retries = retries if retries is not None else cls.DEFAULT_RETRIES
+		self.backoffBase = backoffBase if backoffBase is not None else cls.DEFAULT_BACKOFF_BASE
+		self.backoffMax = backoffMax if backoffMax is not None else cls.DEFAULT_BACKOFF_MAX
+
+		if self.perHostConcurrency < 1:
+			raise ValueError("Per-host concurrency must be positive", self.perHostConcurrency)
+		if self.retries < 0:
+			raise ValueError("Count of retries must not be negative", self.retries)
+
+		self.proxy = proxy
+		self._semaphores = {}
+		self._semaphoresLock = threading.Lock()
+		self._held = threading.local()
+
+		if proxy:
+			self.applyProxy()
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + ", ".join(k + "=" + repr(getattr(self, k)) for k in ("perHostConcurrency", "retries", "proxy")) + ")"
+
+	def applyProxy(self):
+		"""`git`, `hg`, `httpx`, `urllib` and TUF clients all take the proxy from the environment, and the child processes inherit it"""
+
+		for k in PROXY_ENV_VARS:
+			os.environ[k] = self.proxy
+
+	def _semaphoreFor(self, host: str) -> threading.BoundedSemaphore:
+		with self._semaphoresLock:
+			res = self._semaphores.get(host, None)
+			if res is None:
+				res = self._semaphores[host] = threading.BoundedSemaphore(self.perHostConcurrency)
+			return res
+
+	def _heldHosts(self) -> typing.Set[str]:
+		res = getattr(self._held, "hosts", None)
+		if res is None:
+			res = self._held.hosts = set()
+		return res
+
+	def _slotFor(self, host: typing.Optional[str]) -> typing.Optional[threading.BoundedSemaphore]:
+		"""The semaphore limiting the operations with `host`. `None` for local sources and if the current thread already holds a slot of the host (i.e. a bundle is downloaded while a repo is being fetched), the nested operations would wait forever for the slots held by the outer ones otherwise."""
+
+		if not host or host in self._heldHosts():
+			return None
+		return self._semaphoreFor(host)
+
+	def backoff(self, attempt: int) -> float:
+		"""Full jitter: a random delay up to the exponentially growing cap, so the retries of concurrent failures don't hit the host all at once"""
+
+		return random.uniform(0, min(self.backoffMax, self.backoffBase * (2**attempt)))
+
+	def speculative(self, uri: typing.Optional[str], func: typing.Callable, *args, **kwargs) -> bool:
+		"""Calls `func(*args, **kwargs)` only if the host has a free slot right now, so the operations that may turn out useless use only the idle capacity and never delay the needed ones. Not retried. Returns whether `func` was called."""
+
+		host = hostOf(uri)
+		semaphore = self._slotFor(host)
+		if semaphore is not None:
+			if not semaphore.acquire(blocking=False):
+				return False
+			self._heldHosts().add(host)
+
+		try:
+			func(*args, **kwargs)
+		finally:
+			if semaphore is not None:
+				self._heldHosts().discard(host)
+				semaphore.release()
+
+		return True
+
+	def __call__(self, uri: typing.Optional[str], func: typing.Callable, *args, cleanup: typing.Optional[typing.Callable[[], typing.Any]] = None, **kwargs):
+		"""Calls `func(*args, **kwargs)` doing a network operation with `uri`. `cleanup` is called before each retry to remove the leftovers of the failed attempt."""
+
+		host = hostOf(uri)
+		semaphore = self._slotFor(host)
+		attempt = 0
+
+		while True:
+			if semaphore is not None:
+				semaphore.acquire()
+				self._heldHosts().add(host)
+
+			try:
+				return func(*args, **kwargs)
+			except Exception as ex:
+				if attempt >= self.retries or not isTransientError(ex):
+					raise
+				error = ex
+			finally:
+				if semaphore is not None:
+					self._heldHosts().discard(host)
+					semaphore.release()
+
+			delay = self.backoff(attempt)
+			attempt += 1
+			print(styles.error("Transient failure") + " of " + styles.varContent(str(uri)) + ": " + repr(error) + ", " + styles.operationName("retrying") + " (" + str(attempt) + "/" + str(self.retries) + ") in " + str(round(delay, 1)) + " s")
+
+			if cleanup is not None:
+				cleanup()
+
+			time.sleep(delay)
+
+
+_defaultFetchScheduler = None
+_defaultFetchSchedulerLock = threading.Lock()
+
+
+def configureFetchScheduler(retries: typing.Optional[int] = None, proxy: typing.Optional[str] = None, perHostConcurrency: typing.Optional[int] = None) -> FetchScheduler:
+	"""Replaces the default scheduler, i.e. according to the CLI options"""
+
+	global _defaultFetchScheduler
+
+	with _defaultFetchSchedulerLock:
+		_defaultFetchScheduler = FetchScheduler(perHostConcurrency=perHostConcurrency, retries=retries, proxy=proxy)
+		return _defaultFetchScheduler
+
+
+def getDefaultFetchScheduler() -> FetchScheduler:
+	global _defaultFetchScheduler
+
+	with _defaultFetchSchedulerLock:
+		if _defaultFetchScheduler is None:
+			_defaultFetchScheduler = FetchScheduler()
+		return _defaultFetchScheduler
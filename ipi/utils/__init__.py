@@ -1,3 +1,5 @@
+import os
+import typing
 from pathlib import Path
 
 
@@ -13,3 +15,45 @@ def canonicalizePackageName(pkgName: str) -> str:
 def canonicalizePackageNameMulti(pkgName: str) -> (str, str):
 	dashName = canonicalizePackageName(pkgName)
 	return dashName, dashName.replace("-", "_")
+
+
+SubDirsT = typing.Optional[typing.Union[str, typing.Sequence[str]]]
+
+
+def toSubDirs(subDir: SubDirsT) -> typing.Tuple[str, ...]:
+	"""Fetchers accept either a single subdir of a repo or several of them (when one checkout is shared by several packages of a monorepo). Returns them as a tuple, empty if the whole repo is needed."""
+
+	if not subDir:
+		return ()
+
+	if isinstance(subDir, str):
+		return (subDir,)
+
+	return tuple(subDir)
+
+
+VCS_DIRS_NAMES = frozenset((".git", ".hg"))
+
+
+def getDirSize(p: Path, ignoredNames: typing.AbstractSet[str] = VCS_DIRS_NAMES) -> typing.Tuple[int, int]:
+	"""Returns the count of files in a dir tree and their total size in bytes. Files and dirs named one of `ignoredNames` are skipped."""
+
+	count = 0
+	size = 0
+	for root, dirs, files in os.walk(str(p)):
+		dirs[:] = [d for d in dirs if d not in ignoredNames]
+		for f in files:
+			if f not in ignoredNames:
+				count += 1
+				size += os.lstat(os.path.join(root, f)).st_size
+
+	return count, size
+
+
+def formatSize(size: int) -> str:
+	for unit in ("B", "KiB", "MiB"):
+		if size < 1024:
+			return str(round(size, 1)) + " " + unit
+		size /= 1024
+
+	return str(round(size, 1)) + " GiB"
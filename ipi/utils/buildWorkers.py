@@ -0,0 +1,165 @@
+import os
+import subprocess
+import sys
+import threading
+import typing
+import zipfile
+from pathlib import Path
+
+from . import pythonBuild
+from .pythonBuild import readFrame, writeFrame
+from .WithPythonPath import cookPythonPathEnvDict
+
+__all__ = ("BuildWorker", "BuildWorkers", "getDefaultBuildWorkers", "closeBuildWorkers")
+
+BuildWorkerKeyT = typing.Tuple[str, typing.Tuple[str, ...]]
+
+
+def wheelTopLevelNames(wheel: Path) -> typing.FrozenSet[str]:
+	"""The names of the top-level modules and packages a wheel installs"""
+
+	res = set()
+	with zipfile.ZipFile(str(wheel)) as z:
+		for fileName in z.namelist():
+			first = fileName.split("/", 1)[0]
+			if first.endswith((".dist-info", ".data")):
+				continue
+			res.add(first.split(".", 1)[0])
+	return frozenset(res)
+
+
+class BuildWorker:
+	"""A long-lived process building wheels with a PEP 517 backend imported into it once. Requests and results are length-prefixed frames over its stdin and stdout, the logs of the builds stream to stderr."""
+
+	__slots__ = ("key", "proc", "buildsCount", "modules", "stale")
+
+	MAX_BUILDS = 64
+
+	def __init__(self, key: BuildWorkerKeyT):
+		self.key = key
+		env = dict(os.environ)
+		env.update(cookPythonPathEnvDict(key[1]) or {})
+		self.proc = subprocess.Popen((sys.executable, "-m", pythonBuild.__spec__.name, "--worker"), stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+		self.buildsCount = 0
+		self.modules = frozenset()
+		self.stale = False
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.key) + ", pid=" + repr(self.proc.pid) + ", buildsCount=" + repr(self.buildsCount) + (", stale" if self.stale else "") + ")"
+
+	@property
+	def isReusable(self) -> bool:
+		"""A worker is retired after a failed build, since the state of the backend may be broken, and after `MAX_BUILDS` ones, since backends may accumulate state"""
+
+		return not self.stale and self.buildsCount < self.__class__.MAX_BUILDS and self.proc.poll() is None
+
+	def build(self, packageDir: Path, outDir: Path) -> Path:
+		writeFrame(self.proc.stdin, {"pkg": str(packageDir), "outDir": str(outDir), "backend": self.key[0]})
+		res = readFrame(self.proc.stdout)
+		if res is None:
+			self.stale = True
+			raise RuntimeError("The build worker has exited", self.key, self.proc.poll())
+
+		self.buildsCount += 1
+		self.modules = frozenset(res.get("modules", ()))
+
+		try:
+			return Path(res["wheel"])
+		except KeyError:
+			self.stale = True
+			raise RuntimeError("Error building wheel", res["error"])
+
+	def close(self):
+		self.proc.stdin.close()
+		self.proc.wait()
+		self.proc.stdout.close()
+
+
+class BuildWorkers:
+	"""The workers keyed by the backend and the python path of the build. A worker serves one build at a time, so there are as many of them for a key as there were concurrent builds with it."""
+
+	__slots__ = ("idle", "busy", "lock")
+
+	def __init__(self):
+		self.idle = {}
+		self.busy = set()
+		self.lock = threading.Lock()
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(idle=" + repr(self.idle) + ", busy=" + repr(self.busy) + ")"
+
+	def _acquire(self, key: BuildWorkerKeyT) -> BuildWorker:
+		with self.lock:
+			workers = self.idle.get(key, None)
+			res = workers.pop() if workers else None
+			if res is None:
+				res = BuildWorker(key)
+			self.busy.add(res)
+			return res
+
+	def _release(self, worker: BuildWorker):
+		with self.lock:
+			self.busy.discard(worker)
+			if worker.isReusable:
+				self.idle.setdefault(worker.key, []).append(worker)
+				return
+
+		worker.close()
+
+	def build(self, packageDir: Path, outDir: Path, backend: str, pythonPath=()) -> Path:
+		worker = self._acquire((backend, tuple(str(p) for p in pythonPath)))
+		try:
+			return worker.build(packageDir.absolute().resolve(), outDir.absolute().resolve())
+		finally:
+			self._release(worker)
+
+	def invalidate(self, wheel: Path):
+		"""Retires the workers which have imported any of the modules `wheel` has just (re)installed, their backends would build with the outdated code"""
+
+		try:
+			names = wheelTopLevelNames(wheel)
+		except (OSError, zipfile.BadZipFile):  # cannot tell what is affected, so everything is
+			self.close()
+			return
+
+		toClose = []
+		with self.lock:
+			for worker in self.busy:
+				if worker.modules & names:
+					worker.stale = True
+
+			for key, workers in self.idle.items():
+				toClose.extend(w for w in workers if w.modules & names)
+				self.idle[key] = [w for w in workers if not w.modules & names]
+
+		for worker in toClose:
+			worker.close()
+
+	def close(self):
+		with self.lock:
+			toClose = [w for workers in self.idle.values() for w in workers]
+			self.idle.clear()
+			for worker in self.busy:
+				worker.stale = True
+
+		for worker in toClose:
+			worker.close()
+
+
+_defaultBuildWorkers = None
+_defaultBuildWorkersLock = threading.Lock()
+
+
+def getDefaultBuildWorkers() -> BuildWorkers:
+	global _defaultBuildWorkers
+
+	with _defaultBuildWorkersLock:
+		if _defaultBuildWorkers is None:
+			_defaultBuildWorkers = BuildWorkers()
+		return _defaultBuildWorkers
+
+
+def closeBuildWorkers():
+	with _defaultBuildWorkersLock:
+		if _defaultBuildWorkers is not None:
+			_defaultBuildWorkers.close()
@@ -0,0 +1,146 @@
+"""Pre-flight detection of the requirements which cannot be satisfied together. The specifiers of all the requirements of a package are intersected as ranges of versions, without knowing which versions exist, so only the combinations unsatisfiable by any version are reported."""
+
+import typing
+
+try:
+	from packaging.specifiers import SpecifierSet
+	from packaging.version import InvalidVersion, Version
+except ImportError:
+	SpecifierSet = Version = None
+
+from .styles import styles
+
+__all__ = ("Conflict", "DependencyConflictsError", "findConflicts")
+
+ConstraintT = typing.Tuple[typing.Optional[str], "packaging.requirements.Requirement"]  # the name of the dependent (`None` if requested by user) and the requirement
+
+
+class Conflict:
+	__slots__ = ("name", "constraints", "reason")
+
+	def __init__(self, name: str, constraints: typing.Sequence[ConstraintT], reason: str):
+		self.name = name
+		self.constraints = constraints
+		self.reason = reason
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.name) + ", " + repr(self.constraints) + ", " + repr(self.reason) + ")"
+
+	def __str__(self) -> str:
+		return styles.varContent(self.name) + ": " + self.reason + ": " + "; ".join(describeConstraint(c) for c in self.constraints)
+
+
+class DependencyConflictsError(RuntimeError):
+	__slots__ = ()
+
+
+def describeConstraint(constraint: ConstraintT) -> str:
+	dependent, req = constraint
+	return ("requested" if dependent is None else styles.varContent(dependent) + " requires") + " " + styles.varContent(str(req))
+
+
+def bumpedRelease(v: "Version", prefixLen: int) -> "Version":
+	"""The lowest version beyond all the ones starting with the first `prefixLen` components of the release of `v`"""
+
+	release = v.release[:prefixLen]
+	release = release[:-1] + (release[-1] + 1,)
+	return Version((str(v.epoch) + "!" if v.epoch else "") + ".".join(str(c) for c in release) + ".dev0")
+
+
+def specifierRange(spec: "packaging.specifiers.Specifier") -> typing.Optional[typing.Tuple[typing.Optional[typing.Tuple["Version", bool]], typing.Optional[typing.Tuple["Version", bool]]]]:
+	"""`(lowerBound, upperBound)`, each one is `(version, inclusive)` or `None` if unbounded. `None` for the specifiers not expressible as a range (`!=`, `===`)."""
+
+	op = spec.operator
+	if op in {"!=", "==="}:
+		return None
+
+	isPrefix = spec.version.endswith(".*")
+	try:
+		v = Version(spec.version[:-2] if isPrefix else spec.version)
+	except InvalidVersion:
+		return None
+
+	if op == "==":
+		if isPrefix:
+			return (Version(str(v) + ".dev0"), True), (bumpedRelease(v, len(v.release)), False)
+		return (v, True), (v, True)
+	if op == "~=":
+		return (v, True), (bumpedRelease(v, len(v.release) - 1), False)
+	if op == ">=":
+		return (v, True), None
+	if op == ">":
+		return (v, False), None
+	if op == "<=":
+		return None, (v, True)
+	if op == "<":
+		return None, (v, False)
+
+	return None
+
+
+def isTighterBound(candidate: typing.Tuple["Version", bool], current: typing.Optional[typing.Tuple["Version", bool]], isLower: bool) -> bool:
+	if current is None:
+		return True
+
+	if candidate[0] == current[0]:
+		return current[1] and not candidate[1]
+
+	return (candidate[0] > current[0]) == isLower
+
+
+def findPackageConflicts(name: str, constraints: typing.Sequence[ConstraintT], installedVersion: typing.Optional["Version"] = None) -> typing.List[Conflict]:
+	"""`installedVersion` is the version which is going to be kept, if it is not going to be reinstalled"""
+
+	res = []
+	lower = upper = None
+	lowerSource = upperSource = None
+	arbitrary = {}
+
+	for constraint in constraints:
+		_dependent, req = constraint
+		if installedVersion is not None and not req.specifier.contains(installedVersion, prereleases=True):
+			res.append(Conflict(name, [constraint], "the installed version " + styles.varContent(str(installedVersion)) + " is kept, but doesn't satisfy"))
+
+		for spec in req.specifier:
+			if spec.operator == "===":
+				arbitrary.setdefault(spec.version, constraint)
+				continue
+
+			bounds = specifierRange(spec)
+			if bounds is None:
+				continue
+
+			lo, hi = bounds
+			if lo is not None and isTighterBound(lo, lower, True):
+				lower, lowerSource = lo, constraint
+			if hi is not None and isTighterBound(hi, upper, False):
+				upper, upperSource = hi, constraint
+
+	if lower is not None and upper is not None:
+		if lower[0] > upper[0] or (lower[0] == upper[0] and not (lower[1] and upper[1])):
+			res.append(Conflict(name, sorted({id(c): c for c in (lowerSource, upperSource)}.values(), key=constraints.index), "no version satisfies both"))
+		elif lower[0] == upper[0]:  # pinned to a single version, which may be excluded
+			for constraint in constraints:
+				if not constraint[1].specifier.contains(lower[0], prereleases=True):
+					res.append(Conflict(name, sorted({id(c): c for c in (lowerSource, upperSource, constraint)}.values(), key=constraints.index), "the only version allowed, " + styles.varContent(str(lower[0])) + ", is excluded"))
+					break
+
+	if len(arbitrary) > 1:
+		res.append(Conflict(name, list(arbitrary.values()), "pinned to different arbitrary versions"))
+
+	return res
+
+
+def findConflicts(constraints: typing.Mapping[str, typing.Sequence[ConstraintT]], installedVersions: typing.Optional[typing.Mapping[str, "Version"]] = None) -> typing.List[Conflict]:
+	"""`constraints` map the names of packages to all the requirements on them still present after unpinning. `installedVersions` are the versions of the packages to be kept as they are. Returns nothing if `packaging` is not available."""
+
+	if SpecifierSet is None:
+		return []
+
+	if installedVersions is None:
+		installedVersions = {}
+
+	res = []
+	for name in sorted(constraints):
+		res.extend(findPackageConflicts(name, constraints[name], installedVersions.get(name, None)))
+	return res
@@ -0,0 +1,163 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import typing
+from pathlib import Path
+
+from . import metadataExtractor
+from .json import json
+from .metadataExtractor import MetadataExtractor
+from .repoURINormalizer import normalizeRepoURI
+
+__all__ = ("MetadataCache", "CachedMetadata", "getDefaultMetadataCache", "metadataCacheKey")
+
+# bump when the layout of the DB changes
+SCHEMA_VERSION = 3
+
+MetadataCacheKeyT = typing.Tuple[str, str, str]
+
+
+def extractorDigest() -> str:
+	"""Changes every time the code of the extractor changes, so the metadata extracted by a different extractor is not reused"""
+
+	h = hashlib.sha256(str(SCHEMA_VERSION).encode("ascii"))
+	h.update(Path(metadataExtractor.__file__).read_bytes())
+	return h.hexdigest()
+
+
+def metadataCacheKey(directURL: typing.Optional[dict]) -> typing.Optional[MetadataCacheKeyT]:
+	"""`(repo, commit, subDir)` of a package fetched from a VCS. `None` for the sources which contents are not identified by a commit (archives, local dirs)."""
+
+	if not directURL:
+		return None
+
+	vcsInfo = directURL.get("vcs_info", None)
+	if not isinstance(vcsInfo, dict) or not vcsInfo.get("commit_id", None):
+		return None
+
+	return (normalizeRepoURI(directURL["url"]), vcsInfo["commit_id"], directURL.get("subdirectory", None) or "")
+
+
+class CachedMetadata(MetadataExtractor):
+	"""The metadata extracted earlier by one of the extractors"""
+
+	__slots__ = ("_name", "_deps", "_buildDeps", "_optionalDeps")
+
+	def __init__(self, name: str, deps: typing.Sequence[str], buildDeps: typing.Sequence[str], optionalDeps: typing.Optional[typing.Mapping[str, typing.Sequence[str]]] = None):
+		self._name = name
+		self._deps = list(deps)
+		self._buildDeps = list(buildDeps)
+		self._optionalDeps = {k: list(v) for k, v in optionalDeps.items()} if optionalDeps else {}
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self._name) + ", " + repr(self._deps) + ", " + repr(self._buildDeps) + ", " + repr(self._optionalDeps) + ")"
+
+	@classmethod
+	def fromExtractor(cls, md: MetadataExtractor) -> "CachedMetadata":
+		return cls(md.name, md._getDeps(), md._getBuildDeps(), md._getOptionalDeps())
+
+	def _getName(self):
+		return self._name
+
+	def _getDeps(self):
+		return self._deps
+
+	def _getBuildDeps(self):
+		return self._buildDeps
+
+	def _getOptionalDeps(self):
+		return self._optionalDeps
+
+
+class MetadataCache:
+	"""A persistent sqlite storage of the metadata extracted from the packages, keyed by `(repo, commit, subDir)`. A commit is immutable, so an entry never becomes stale, but the whole cache is dropped when the extractor changes."""
+
+	__slots__ = ("path", "_db", "_lock")
+
+	def __init__(self, path: Path) -> None:
+		self.path = path
+		self._db = None
+		self._lock = threading.Lock()
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.path) + ")"
+
+	def _connect(self) -> sqlite3.Connection:
+		if self._db is None:
+			self.path.parent.mkdir(parents=True, exist_ok=True)
+			db = sqlite3.connect(str(self.path), check_same_thread=False)
+			db.execute("create table if not exists `meta` (`key` text primary key, `value` text not null)")
+			digest = extractorDigest()
+			stored = db.execute("select `value` from `meta` where `key` = 'extractor'").fetchone()
+			if stored is None or stored[0] != digest:
+				db.execute("drop table if exists `metadata`")
+				db.execute("insert or replace into `meta` (`key`, `value`) values ('extractor', ?)", (digest,))
+
+			db.execute("create table if not exists `metadata` (`repo` text not null, `revision` text not null, `subDir` text not null, `name` text not null, `deps` text not null, `buildDeps` text not null, `optionalDeps` text not null, `lastUsed` real not null, primary key (`repo`, `revision`, `subDir`))")
+			db.execute("create index if not exists `metadataByPackage` on `metadata` (`repo`, `subDir`, `lastUsed`)")
+			db.commit()
+			self._db = db
+
+		return self._db
+
+	def get(self, key: MetadataCacheKeyT) -> typing.Optional[CachedMetadata]:
+		with self._lock:
+			db = self._connect()
+			row = db.execute("select `name`, `deps`, `buildDeps`, `optionalDeps` from `metadata` where `repo` = ? and `revision` = ? and `subDir` = ?", key).fetchone()
+			if row is not None:
+				db.execute("update `metadata` set `lastUsed` = ? where `repo` = ? and `revision` = ? and `subDir` = ?", (time.time(),) + key)
+				db.commit()
+
+		return self.__class__._rowToMetadata(row)
+
+	def latest(self, repo: str, subDir: typing.Optional[str] = None) -> typing.Optional[CachedMetadata]:
+		"""The metadata of the revision of a package used most recently, whatever it is. Used to guess the deps of a package before it is fetched."""
+
+		with self._lock:
+			row = self._connect().execute("select `name`, `deps`, `buildDeps`, `optionalDeps` from `metadata` where `repo` = ? and `subDir` = ? order by `lastUsed` desc limit 1", (normalizeRepoURI(repo), subDir or "")).fetchone()
+
+		return self.__class__._rowToMetadata(row)
+
+	@classmethod
+	def _rowToMetadata(cls, row: typing.Optional[tuple]) -> typing.Optional[CachedMetadata]:
+		if row is None:
+			return None
+
+		name, deps, buildDeps, optionalDeps = row
+		return CachedMetadata(name, json.loads(deps), json.loads(buildDeps), json.loads(optionalDeps))
+
+	def put(self, key: MetadataCacheKeyT, md: MetadataExtractor) -> CachedMetadata:
+		res = CachedMetadata.fromExtractor(md)
+		with self._lock:
+			db = self._connect()
+			db.execute("insert or replace into `metadata` (`repo`, `revision`, `subDir`, `name`, `deps`, `buildDeps`, `optionalDeps`, `lastUsed`) values (?, ?, ?, ?, ?, ?, ?, ?)", key + (res._name, json.dumps(res._deps), json.dumps(res._buildDeps), json.dumps(res._optionalDeps), time.time()))
+			db.commit()
+		return res
+
+	def close(self):
+		with self._lock:
+			if self._db is not None:
+				self._db.close()
+				self._db = None
+
+
+_defaultMetadataCache = None
+_defaultMetadataCacheLock = threading.Lock()
+
+
+def getDefaultMetadataCache() -> typing.Optional[MetadataCache]:
+	"""Returns the metadata cache within the settings dir. `None` if there is no settings dir."""
+
+	global _defaultMetadataCache
+
+	with _defaultMetadataCacheLock:
+		if _defaultMetadataCache is None:
+			from ..settings import metadataCacheFile
+
+			if metadataCacheFile is None:
+				return None
+
+			_defaultMetadataCache = MetadataCache(metadataCacheFile)
+
+	return _defaultMetadataCache
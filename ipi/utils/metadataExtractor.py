@@ -8,6 +8,7 @@ from pathlib import Path
 from warnings import warn
 
 from . import canonicalizePackageName
+from .targetEnvironment import canonicalizeExtraName
 
 try:
 	from packaging.requirements import Requirement
@@ -87,6 +88,15 @@ class MetadataExtractor:
 			res.append(canonicalizedRequirement(el))
 		return res
 
+	@property
+	def optionalDeps(self) -> typing.Dict[str, list]:
+		"""The deps of extras, keyed by canonicalized names of extras"""
+
+		return {canonicalizeExtraName(extra): [canonicalizedRequirement(el) for el in els] for extra, els in self._getOptionalDeps().items()}
+
+	def _getOptionalDeps(self):
+		return {}
+
 
 class PEP517MetadataExtractor(MetadataExtractor):
 	__slots__ = ("toolSpecificDic", "child")
@@ -103,6 +113,9 @@ class PEP517MetadataExtractor(MetadataExtractor):
 	def _getDeps(self):
 		return self.child._getDeps()
 
+	def _getOptionalDeps(self):
+		return self.child._getOptionalDeps()
+
 	@property
 	def buildBackend(self):
 		return self.toolSpecificDic.get("build-backend", "setuptools.build_meta").split(".")
@@ -188,6 +201,9 @@ class PEP621MetadataExtractor(MetadataExtractor):
 	def _getDeps(self):
 		return self.toolSpecificDic.get("dependencies", [])
 
+	def _getOptionalDeps(self):
+		return self.toolSpecificDic.get("optional-dependencies", {})
+
 
 class FlitMetadataExtractor(MetadataExtractor):
 	__slots__ = ("toolSpecificDic",)
@@ -325,6 +341,16 @@ class SetuptoolsMetadataExtractor(MetadataExtractor):
 
 		return res
 
+	def _getOptionalDeps(self):
+		res = None
+		if self.setupCfg:
+			res = self.setupCfg._getOptionalDeps()
+
+		if not res and self.setupPy:
+			res = self.setupPy._getOptionalDeps()
+
+		return res
+
 
 class SetuptoolsSetupCfgMetadataExtractor(SetuptoolsMetadataExtractor):
 	__slots__ = ("toolSpecificDic",)
@@ -364,6 +390,14 @@ class SetuptoolsSetupCfgMetadataExtractor(SetuptoolsMetadataExtractor):
 		except KeyError:
 			return []
 
+	def _getOptionalDeps(self):
+		try:
+			extras = self.toolSpecificDic["options"]["extras_require"]
+		except KeyError:
+			return {}
+
+		return {extra: self.__class__._removeTrailingComments(els) for extra, els in extras.items()}
+
 
 class SetuptoolsSetupPyMetadataExtractor(SetuptoolsMetadataExtractor):
 	__slots__ = ("ast", "setupCall", "keywordsDict", "constantFoldingDict")
@@ -479,6 +513,17 @@ class SetuptoolsSetupPyMetadataExtractor(SetuptoolsMetadataExtractor):
 	def _getDeps(self):
 		return self._getArray("install_requires", str)
 
+	def _getOptionalDeps(self):
+		try:
+			res = self.getSetupKeyword("extras_require")
+		except KeyError:
+			return {}
+
+		if not isinstance(res, dict):
+			raise ValueError("`extras_require` is not a `dict`", res)
+
+		return {extra: [els] if isinstance(els, str) else list(els) for extra, els in res.items()}
+
 
 toolSpecificExtractors = {
 	"setuptools": SetuptoolsMetadataExtractor,
@@ -487,6 +532,33 @@ toolSpecificExtractors = {
 	"pdm": PDMMetadataExtractor,
 }
 
+# build tools computing the version of a package from the tags of its repo, so the history up to the nearest tag must be fetched
+VCS_VERSIONING_BUILD_DEPS = frozenset(
+	(
+		"setuptools-scm",
+		"setuptools-git-versioning",
+		"hatch-vcs",
+		"flit-scm",
+		"versioningit",
+		"dunamai",
+		"poetry-dynamic-versioning",
+		"uv-dynamic-versioning",
+		"pbr",
+		"vcversioner",
+	)
+)
+
+
+def isVersionedUsingVCS(md: MetadataExtractor) -> bool:
+	"""Whether the build backend of the package needs VCS tags to compute its version"""
+
+	try:
+		buildDeps = md.buildDeps
+	except NotImplementedError:
+		return False
+
+	return any(canonicalizePackageName(el.name).lower() in VCS_VERSIONING_BUILD_DEPS for el in buildDeps)
+
 
 def main():
 	if len(sys.argv) > 1:
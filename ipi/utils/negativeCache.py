@@ -0,0 +1,127 @@
+import sqlite3
+import threading
+import time
+import typing
+from pathlib import Path
+
+from . import canonicalizePackageName
+from .metadataCache import MetadataCacheKeyT
+
+__all__ = ("NegativeCache", "KnownFailureError", "getDefaultNegativeCache", "configureNegativeCache")
+
+# bump when the layout of the DB changes
+SCHEMA_VERSION = 1
+
+
+class KnownFailureError(RuntimeError):
+	"""The same operation has failed recently with the same inputs, so it is not retried"""
+
+	__slots__ = ()
+
+
+class NegativeCache:
+	"""A persistent sqlite storage of the failures worth not repeating: the names missing in every registry (until the set of packages in the registries changes) and the builds failed at a commit. The entries expire after `ttl` seconds. If `refresh`, the entries are ignored, but still recorded."""
+
+	__slots__ = ("path", "ttl", "refresh", "_db", "_lock")
+
+	DEFAULT_TTL = 7 * 24 * 60 * 60
+
+	def __init__(self, path: Path, ttl: typing.Optional[float] = None, refresh: bool = False) -> None:
+		if ttl is None:
+			ttl = self.__class__.DEFAULT_TTL
+
+		self.path = path
+		self.ttl = ttl
+		self.refresh = refresh
+		self._db = None
+		self._lock = threading.Lock()
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.path) + ", ttl=" + repr(self.ttl) + (", refresh=True" if self.refresh else "") + ")"
+
+	def _connect(self) -> sqlite3.Connection:
+		if self._db is None:
+			self.path.parent.mkdir(parents=True, exist_ok=True)
+			db = sqlite3.connect(str(self.path), check_same_thread=False)
+			if db.execute("pragma user_version").fetchone()[0] != SCHEMA_VERSION:
+				db.execute("drop table if exists `lookupMisses`")
+				db.execute("drop table if exists `buildFailures`")
+				db.execute("pragma user_version = " + str(SCHEMA_VERSION))
+
+			db.execute("create table if not exists `lookupMisses` (`name` text primary key, `registryDigest` text not null, `time` real not null)")
+			db.execute("create table if not exists `buildFailures` (`repo` text not null, `revision` text not null, `subDir` text not null, `error` text not null, `time` real not null, primary key (`repo`, `revision`, `subDir`))")
+			db.commit()
+			self._db = db
+
+		return self._db
+
+	def _query(self, sql: str, args: tuple) -> typing.Optional[tuple]:
+		if self.refresh:
+			return None
+
+		with self._lock:
+			return self._connect().execute(sql, args + (time.time() - self.ttl,)).fetchone()
+
+	def _modify(self, sql: str, args: tuple):
+		with self._lock:
+			db = self._connect()
+			db.execute(sql, args)
+			db.commit()
+
+	def isMissing(self, name: str, registry: "IRegistry") -> bool:
+		row = self._query("select `registryDigest` from `lookupMisses` where `name` = ? and `time` >= ?", (canonicalizePackageName(name),))
+		return row is not None and row[0] == registry.snapshotDigest()
+
+	def recordMissing(self, name: str, registry: "IRegistry"):
+		self._modify("insert or replace into `lookupMisses` (`name`, `registryDigest`, `time`) values (?, ?, ?)", (canonicalizePackageName(name), registry.snapshotDigest(), time.time()))
+
+	def buildFailure(self, key: MetadataCacheKeyT) -> typing.Optional[str]:
+		"""The error the build of the package at the commit has failed with"""
+
+		row = self._query("select `error` from `buildFailures` where `repo` = ? and `revision` = ? and `subDir` = ? and `time` >= ?", key)
+		return row[0] if row is not None else None
+
+	def recordBuildFailure(self, key: MetadataCacheKeyT, error: BaseException):
+		self._modify("insert or replace into `buildFailures` (`repo`, `revision`, `subDir`, `error`, `time`) values (?, ?, ?, ?, ?)", key + (repr(error), time.time()))
+
+	def forgetBuildFailure(self, key: MetadataCacheKeyT):
+		self._modify("delete from `buildFailures` where `repo` = ? and `revision` = ? and `subDir` = ?", key)
+
+	def close(self):
+		with self._lock:
+			if self._db is not None:
+				self._db.close()
+				self._db = None
+
+
+_defaultNegativeCache = None
+_defaultNegativeCacheRefresh = False
+_defaultNegativeCacheLock = threading.Lock()
+
+
+def configureNegativeCache(refresh: bool = False):
+	"""`refresh` makes the known failures retried, i.e. according to the CLI options"""
+
+	global _defaultNegativeCache, _defaultNegativeCacheRefresh
+
+	with _defaultNegativeCacheLock:
+		_defaultNegativeCacheRefresh = refresh
+		if _defaultNegativeCache is not None:
+			_defaultNegativeCache.refresh = refresh
+
+
+def getDefaultNegativeCache() -> typing.Optional[NegativeCache]:
+	"""Returns the negative cache within the settings dir. `None` if there is no settings dir."""
+
+	global _defaultNegativeCache
+
+	with _defaultNegativeCacheLock:
+		if _defaultNegativeCache is None:
+			from ..settings import negativeCacheFile
+
+			if negativeCacheFile is None:
+				return None
+
+			_defaultNegativeCache = NegativeCache(negativeCacheFile, refresh=_defaultNegativeCacheRefresh)
+
+	return _defaultNegativeCache
@@ -1,4 +1,9 @@
+import importlib
+import os
+import struct
 import sys
+import traceback
+import typing
 from pathlib import Path
 
 from .CLICookie import CLICookie
@@ -6,10 +11,8 @@ from .json import json
 from .WithPythonPath import WithPythonPath
 
 
-def buildWheelUsingPEP517(packageDir: Path, outDir: Path, pythonPath=()):
-	print("buildWheelUsingPEP517 pythonPath", pythonPath)
-	with WithPythonPath(*pythonPath):
-		from pyproject_hooks import BuildBackendHookCaller
+def getBuildBackend(packageDir: Path, pythonPath=()) -> typing.Tuple[str, typing.Optional[str]]:
+	"""`(build-backend, backend-path)` declared in `pyproject.toml`, `setuptools` if not declared"""
 
 	tomlFile = packageDir / "pyproject.toml"
 	if tomlFile.is_file():
@@ -36,6 +39,15 @@ def buildWheelUsingPEP517(packageDir: Path, outDir: Path, pythonPath=()):
 		build_backend = "setuptools.build_meta"
 		backend_path = None
 
+	return build_backend, backend_path
+
+
+def buildWheelUsingPEP517(packageDir: Path, outDir: Path, pythonPath=()):
+	print("buildWheelUsingPEP517 pythonPath", pythonPath)
+	with WithPythonPath(*pythonPath):
+		from pyproject_hooks import BuildBackendHookCaller
+
+	build_backend, backend_path = getBuildBackend(packageDir, pythonPath)
 	hooks = BuildBackendHookCaller(packageDir, build_backend=build_backend, backend_path=backend_path)
 
 	with WithPythonPath(packageDir, *pythonPath):
@@ -64,6 +76,102 @@ class RemotePep517:
 			raise RuntimeError("Error building wheel", res["error"])
 
 
+FRAME_HEADER = struct.Struct(">I")
+
+
+def writeFrame(f: typing.BinaryIO, obj: typing.Any):
+	"""A frame is a JSON document prefixed with its length, so no in-band markers are needed"""
+
+	data = json.dumps(obj).encode("utf-8")
+	f.write(FRAME_HEADER.pack(len(data)) + data)
+	f.flush()
+
+
+def readFrame(f: typing.BinaryIO) -> typing.Any:
+	"""`None` on EOF"""
+
+	header = f.read(FRAME_HEADER.size)
+	if len(header) < FRAME_HEADER.size:
+		return None
+
+	(size,) = FRAME_HEADER.unpack(header)
+	data = f.read(size)
+	if len(data) < size:
+		return None
+
+	return json.loads(data.decode("utf-8"))
+
+
+def loadBackend(backend: str):
+	"""Imports the object a PEP 517 `build-backend` refers to: `module.path:object.path`"""
+
+	moduleName, _, objectPath = backend.partition(":")
+	res = importlib.import_module(moduleName.strip())
+	for attr in filter(None, objectPath.strip().split(".")):
+		res = getattr(res, attr)
+	return res
+
+
+def isWithinDir(path: typing.Any, dirPrefix: str) -> bool:
+	return isinstance(path, str) and os.path.abspath(path).startswith(dirPrefix)
+
+
+def purgeModulesFrom(dir: str) -> typing.Set[str]:
+	"""Unloads the modules imported from `dir`, so the modules with the same names in the next package built by the worker are imported from it, not reused. Returns their names."""
+
+	dirPrefix = os.path.join(dir, "")
+	res = set()
+	for name, module in list(sys.modules.items()):
+		paths = [getattr(module, "__file__", None)]
+		paths.extend(getattr(module, "__path__", None) or ())  # namespace packages have no `__file__`
+		if any(isWithinDir(p, dirPrefix) for p in paths):
+			del sys.modules[name]
+			res.add(name)
+
+	for k in [k for k in sys.path_importer_cache if k == dir or isWithinDir(k, dirPrefix)]:
+		del sys.path_importer_cache[k]
+	importlib.invalidate_caches()
+
+	return res
+
+
+def serveBuilds(requests: typing.BinaryIO, results: typing.BinaryIO) -> int:
+	"""The loop of a persistent build worker: builds the wheels requested using the backends imported into this process once. The modules imported from a package are unloaded after its build. The logs of the builds are written to stderr, the results are sent over `results`, each one with the names of the top-level modules imported so far, so the worker can be retired when any of them is reinstalled."""
+
+	backends = {}
+	while True:
+		req = readFrame(requests)
+		if req is None:
+			return 0
+
+		cwd = os.getcwd()
+		packageDir = str(Path(req["pkg"]).absolute().resolve())
+		try:
+			backend = backends.get(req["backend"], None)
+			if backend is None:
+				backend = backends[req["backend"]] = loadBackend(req["backend"])
+
+			outDir = Path(req["outDir"]).absolute().resolve()
+			outDir.mkdir(exist_ok=True, parents=True)
+			os.chdir(packageDir)
+			sys.path.insert(0, packageDir)
+			res = {"wheel": str(outDir / backend.build_wheel(str(outDir), {}))}
+		except BaseException as ex:
+			traceback.print_exc()
+			res = {"error": {"__class": ex.__class__.__name__, "args": [str(a) for a in ex.args]}}
+		finally:
+			os.chdir(cwd)
+			if sys.path and sys.path[0] == packageDir:
+				del sys.path[0]
+
+			purged = purgeModulesFrom(packageDir)
+			for k in [k for k in backends if k.partition(":")[0].strip() in purged]:  # an in-tree backend
+				del backends[k]
+
+		res["modules"] = sorted({k.partition(".")[0] for k in sys.modules})
+		writeFrame(results, res)
+
+
 def _deserializeArgs(jStr: str):
 	j = json.loads(jStr)
 	packageDir = Path(j["pkg"]).absolute().resolve()
@@ -73,6 +181,11 @@ def _deserializeArgs(jStr: str):
 
 
 def main() -> int:
+	if sys.argv[1:] == ["--worker"]:
+		results = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+		os.dup2(sys.stderr.fileno(), sys.stdout.fileno())  # whatever the backends and their subprocesses print is a log, it must not get into the results
+		return serveBuilds(sys.stdin.buffer, results)
+
 	jStr = sys.stdin.read()
 	resCode = 1
 	packageDir, outDir, cookies = _deserializeArgs(jStr)
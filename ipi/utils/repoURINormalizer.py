@@ -34,3 +34,21 @@ normalizers = (
 	GitHubRepoURINormalizer,
 	GitLabRepoURINormalizer,
 )
+
+
+def normalizeRepoURI(uri: str) -> str:
+	"""Returns the canonical form of the URI of a repo, so different spellings of the same repo (with and without `.git`, trailing slash, letter case of host) map to the same string."""
+
+	from urllib.parse import urlparse, urlunparse
+
+	uri = uri.strip().rstrip("/")
+	if uri.lower().endswith(".git"):
+		uri = uri[: -len(".git")]
+
+	parsed = urlparse(uri)
+	for n in normalizers:
+		normalized = n.normalize(parsed)
+		if normalized is not None:
+			return normalized
+
+	return urlunparse(parsed._replace(scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower()))
@@ -0,0 +1,97 @@
+import re
+import threading
+import typing
+from pathlib import Path
+
+from .json import json
+
+try:
+	from packaging.markers import default_environment
+except ImportError:
+	default_environment = None
+
+__all__ = ("TargetEnvironment", "canonicalizeExtraName")
+
+extraSeparatorsRx = re.compile("[-_.]+")
+
+# computes the same values `packaging.markers.default_environment` does, but needs only the stdlib, since `packaging` may be missing in the target interpreter
+ENVIRONMENT_SCRIPT = """
+import json, os, platform, sys
+
+def formatFullVersion(info):
+	res = "{0.major}.{0.minor}.{0.micro}".format(info)
+	if info.releaselevel != "final":
+		res += info.releaselevel[0] + str(info.serial)
+	return res
+
+print(json.dumps({
+	"implementation_name": sys.implementation.name,
+	"implementation_version": formatFullVersion(sys.implementation.version),
+	"os_name": os.name,
+	"platform_machine": platform.machine(),
+	"platform_release": platform.release(),
+	"platform_system": platform.system(),
+	"platform_version": platform.version(),
+	"python_full_version": platform.python_version(),
+	"platform_python_implementation": platform.python_implementation(),
+	"python_version": ".".join(platform.python_version_tuple()[:2]),
+	"sys_platform": sys.platform,
+}))
+"""
+
+
+def canonicalizeExtraName(extra: str) -> str:
+	"""PEP 685"""
+
+	return extraSeparatorsRx.sub("-", extra).lower()
+
+
+class TargetEnvironment:
+	"""The values of the environment markers (PEP 508) of the interpreter the packages are installed for. The results of evaluation of markers are memoized, the same markers are repeated across lots of packages."""
+
+	__slots__ = ("markers", "_evaluated", "_lock")
+
+	def __init__(self, markers: typing.Mapping[str, str]):
+		self.markers = dict(markers)
+		self._evaluated = {}
+		self._lock = threading.Lock()
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.markers) + ")"
+
+	@classmethod
+	def current(cls) -> "TargetEnvironment":
+		if default_environment is None:
+			return cls({})
+
+		return cls(default_environment())
+
+	@classmethod
+	def fromInterpreter(cls, executable: typing.Union[str, Path]) -> "TargetEnvironment":
+		from ..deps import sh
+
+		return cls(json.loads(str(sh.Command(str(executable))("-c", ENVIRONMENT_SCRIPT))))
+
+	def evaluate(self, marker, extra: str = "") -> bool:
+		k = (str(marker), extra)
+		with self._lock:
+			res = self._evaluated.get(k, None)
+
+		if res is None:
+			env = dict(self.markers)
+			env["extra"] = extra
+			res = marker.evaluate(env)
+			with self._lock:
+				self._evaluated[k] = res
+
+		return res
+
+	def isApplicable(self, req, extras: typing.Iterable[str] = ()) -> bool:
+		"""Whether `req` is needed in this environment when the package depending on it is installed with `extras`"""
+
+		marker = getattr(req, "marker", None)
+		if not marker or not self.markers:  # no `packaging`, nothing can be evaluated
+			return True
+
+		extras = tuple(extras)
+		return any(self.evaluate(marker, extra) for extra in (extras if extras else ("",)))
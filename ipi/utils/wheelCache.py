@@ -0,0 +1,128 @@
+import hashlib
+import shutil
+import sys
+import sysconfig
+import threading
+import typing
+from functools import lru_cache
+from pathlib import Path
+from tempfile import mkdtemp
+
+try:
+	from packaging.tags import parse_tag, sys_tags
+except ImportError:
+	parse_tag = sys_tags = None
+
+from .json import json
+
+__all__ = ("WheelCache", "wheelCacheKey", "getDefaultWheelCache", "interpreterTag")
+
+# bump when the layout of the cache or the way the keys are computed changes
+CACHE_VERSION = 1
+
+PURE_BUCKET = "any"
+
+
+def wheelCacheKey(tree: str, backend: typing.Sequence[typing.Any], buildDeps: typing.Mapping[str, typing.Optional[str]]) -> str:
+	"""`tree` is the hash of the tree of the sources in the VCS, `backend` identifies the build backend, `buildDeps` map the names of the build deps to their versions used for building. The interpreter is not a part of the key, the wheels are bucketed by it."""
+
+	return hashlib.sha256(json.dumps([CACHE_VERSION, tree, list(backend), sorted(buildDeps.items())]).encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def interpreterTag() -> str:
+	"""The most specific tag of the wheels built by the current interpreter"""
+
+	if sys_tags is not None:
+		return str(next(iter(sys_tags())))
+
+	return sys.implementation.cache_tag + "-" + sysconfig.get_platform().replace("-", "_").replace(".", "_")
+
+
+def wheelTags(wheelFileName: str) -> str:
+	"""`python-abi-platform` part of the name of a wheel"""
+
+	return "-".join(wheelFileName[: -len(".whl")].split("-")[-3:])
+
+
+def isPureWheel(wheelFileName: str) -> bool:
+	_python, abi, platform = wheelTags(wheelFileName).split("-")
+	return abi == "none" and platform == "any"
+
+
+@lru_cache(maxsize=None)
+def supportedTags() -> typing.FrozenSet[str]:
+	return frozenset(str(t) for t in sys_tags())
+
+
+def isCompatibleWheel(wheelFileName: str) -> bool:
+	if parse_tag is None:
+		return wheelTags(wheelFileName).startswith(("py3", "py2.py3"))
+
+	return any(str(t) in supportedTags() for t in parse_tag(wheelTags(wheelFileName)))
+
+
+class WheelCache:
+	"""A persistent content-addressed storage of the built wheels: `<bucket>/<key>/<wheel>`. Platform-specific wheels are bucketed by the interpreter tag, the pure-Python ones are in a bucket shared by all the interpreters they are compatible with."""
+
+	__slots__ = ("path",)
+
+	def __init__(self, path: Path) -> None:
+		self.path = path
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "(" + repr(self.path) + ")"
+
+	def _entryDir(self, bucket: str, key: str) -> Path:
+		return self.path / bucket / key[:2] / key
+
+	def get(self, key: str) -> typing.Optional[Path]:
+		for bucket in (interpreterTag(), PURE_BUCKET):
+			for wheel in sorted(self._entryDir(bucket, key).glob("*.whl")):
+				if bucket != PURE_BUCKET or isCompatibleWheel(wheel.name):
+					return wheel
+
+		return None
+
+	def put(self, key: str, wheel: Path) -> Path:
+		"""The entry is populated in a temporary dir and renamed into place, so it is either complete or absent"""
+
+		entryDir = self._entryDir(PURE_BUCKET if isPureWheel(wheel.name) else interpreterTag(), key)
+		res = entryDir / wheel.name
+		if res.is_file():
+			return res
+
+		entryDir.parent.mkdir(parents=True, exist_ok=True)
+		tmpDir = Path(mkdtemp(prefix="." + key + "_", dir=str(entryDir.parent)))
+		try:
+			shutil.copy2(str(wheel), str(tmpDir / wheel.name))
+			try:
+				tmpDir.rename(entryDir)
+			except OSError:
+				if not res.is_file():  # otherwise populated concurrently
+					raise
+		finally:
+			shutil.rmtree(tmpDir, ignore_errors=True)
+
+		return res
+
+
+_defaultWheelCache = None
+_defaultWheelCacheLock = threading.Lock()
+
+
+def getDefaultWheelCache() -> typing.Optional[WheelCache]:
+	"""Returns the wheel cache within the settings dir. `None` if there is no settings dir."""
+
+	global _defaultWheelCache
+
+	with _defaultWheelCacheLock:
+		if _defaultWheelCache is None:
+			from ..settings import wheelCacheDir
+
+			if wheelCacheDir is None:
+				return None
+
+			_defaultWheelCache = WheelCache(wheelCacheDir)
+
+	return _defaultWheelCache
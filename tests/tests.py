@@ -2,8 +2,22 @@
 import sys
 from pathlib import Path
 import unittest
+import io
+import base64
+import hashlib
+import json
+import zipfile
+import socket
 import itertools, re
+import types
+import typing
+import unittest.mock
 import colorama
+import subprocess
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
@@ -13,6 +27,29 @@ dict = OrderedDict
 
 import ipi
 from ipi import *
+from ipi.deps import git as gitModule
+from ipi.deps.archive import fetchUsingArchive
+from ipi.deps.fetchers import Source, SourceFetcher
+from ipi.deps.git import MIRROR_REFS_PREFIX, MIRRORS_KIND, MirrorsCache, estimateCheckoutUsingGit, fetchMetadataUsingGit, fetchUsingGit, updateMirror
+from ipi.lock import LOCK_FORMAT_VERSION, Lock, LockedPackage
+from ipi.cli.argparse import _installImpl
+from ipi.resolver import DepsKindID, PackageFetcher, ResolutionNode, ResolutionNodeState, deepenPackagesHistories, historyDeepeningTasks
+from ipi.tools import install
+from ipi.tools.installedIndex import InstalledDistributionsIndex, genSearchPath
+from ipi.session import InstallSession, SessionBusyError, SessionStage, UnfinishedSessionError, WrongTargetError, currentTarget, getDefaultSessionDir
+from ipi.utils.conflicts import DependencyConflictsError, findConflicts
+from ipi.utils.buildWorkers import BuildWorkers
+from ipi.utils.pythonBuild import FRAME_HEADER, readFrame, writeFrame
+from ipi.utils.FetchScheduler import FetchScheduler, isTransientError
+from ipi.utils.wheelCache import PURE_BUCKET, WheelCache, interpreterTag, wheelCacheKey
+from ipi.utils.targetEnvironment import TargetEnvironment, canonicalizeExtraName
+
+try:
+	from packaging.markers import default_environment
+	from packaging.requirements import Requirement
+	from packaging.version import Version
+except ImportError:
+	Requirement = None
 
 
 class Tests(unittest.TestCase):
@@ -21,5 +58,714 @@ class Tests(unittest.TestCase):
 		raise NotImplementedError
 
 
+def git(*args, cwd):
+	return subprocess.run(("git",) + args, cwd=str(cwd), check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode("utf-8").strip()
+
+
+def makeGitRepo(repoDir: Path, files: dict) -> str:
+	"""Commits `files` (relative path -> content) into a new repo, returns the hash of the commit"""
+
+	repoDir.mkdir(parents=True, exist_ok=True)
+	git("init", "-q", cwd=repoDir)
+	return commitFiles(repoDir, files)
+
+
+def commitFiles(repoDir: Path, files: dict) -> str:
+	for relPath, content in files.items():
+		f = repoDir / relPath
+		f.parent.mkdir(parents=True, exist_ok=True)
+		f.write_text(content)
+	git("add", "-A", cwd=repoDir)
+	git("-c", "user.name=test", "-c", "user.email=test@example.org", "commit", "-q", "-m", "commit", cwd=repoDir)
+	return git("rev-parse", "HEAD", cwd=repoDir)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+	def log_message(self, *args):
+		pass
+
+
+class ServedDir:
+	"""Serves a dir over HTTP on localhost within a `with` block"""
+
+	__slots__ = ("dir", "handler", "server", "thread")
+
+	def __init__(self, dir: Path, handler: typing.Type[SimpleHTTPRequestHandler] = QuietHandler):
+		self.dir = dir
+		self.handler = handler
+		self.server = None
+		self.thread = None
+
+	def __enter__(self) -> str:
+		self.server = ThreadingHTTPServer(("127.0.0.1", 0), partial(self.handler, directory=str(self.dir)))
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+		return "http://127.0.0.1:" + str(self.server.server_address[1]) + "/"
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.server.shutdown()
+		self.server.server_close()
+
+
+MONOREPO_FILES = {
+	"pyproject.toml": "[build-system]\n",
+	"a/pyproject.toml": "[project]\nname = 'a'\n",
+	"a/a/__init__.py": "",
+	"b/pyproject.toml": "[project]\nname = 'b'\n",
+}
+
+
+class ArchiveTests(unittest.TestCase):
+	def _fetch(self, fmt: str):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			commit = makeGitRepo(tmp / "repo", MONOREPO_FILES)
+			served = tmp / "served"
+			served.mkdir()
+			git("archive", "--format=" + fmt, "--prefix=repo-main/", "-o", str(served / ("repo." + fmt)), "HEAD", cwd=tmp / "repo")
+
+			with ServedDir(served) as baseURI:
+				revision = fetchUsingArchive(baseURI + "repo." + fmt, tmp / "out", subDir="a")
+
+			self.assertEqual(revision, commit)
+			self.assertEqual(sorted(str(p.relative_to(tmp / "out")) for p in (tmp / "out").rglob("*") if p.is_file()), ["a/a/__init__.py", "a/pyproject.toml", "pyproject.toml"])
+
+	def testTarGz(self):
+		self._fetch("tar.gz")
+
+	def testZip(self):
+		self._fetch("zip")
+
+	def testHTTPError(self):
+		with TemporaryDirectory() as tmp:
+			with ServedDir(Path(tmp)) as baseURI:
+				with self.assertRaises(Exception):
+					fetchUsingArchive(baseURI + "missing.tar.gz", Path(tmp) / "out")
+
+
+class BundleTests(unittest.TestCase):
+	def _seed(self, bundleURI: typing.Callable[[Path, str], str], seeded: bool = True):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			origin = tmp / "origin"
+			first = makeGitRepo(origin, MONOREPO_FILES)
+			git("tag", "v1", cwd=origin)
+			served = tmp / "served"
+			served.mkdir()
+			git("bundle", "create", "-q", str(served / "repo.bundle"), "--all", cwd=origin)
+			second = commitFiles(origin, {"b/b.py": ""})  # only this one is to be fetched from the origin
+
+			with ServedDir(served) as baseURI:
+				mirrorDir = tmp / "mirror"
+				ref = updateMirror(origin.as_uri(), mirrorDir, bundle=bundleURI(served / "repo.bundle", baseURI))
+
+			self.assertEqual(git("rev-parse", ref, cwd=mirrorDir), second)
+			self.assertEqual(bool(git("for-each-ref", MIRROR_REFS_PREFIX + "bundle/", cwd=mirrorDir)), seeded)
+			if seeded:
+				self.assertEqual(git("rev-parse", "v1^{commit}", cwd=mirrorDir), first)
+				self.assertFalse((mirrorDir / "shallow").is_file())  # the history from the bundle is kept
+
+	def testLocal(self):
+		self._seed(lambda path, baseURI: str(path))
+
+	def testHTTP(self):
+		self._seed(lambda path, baseURI: baseURI + path.name)
+
+	def testUnusable(self):
+		self._seed(lambda path, baseURI: baseURI + "missing.bundle", seeded=False)
+
+	def testDownloadedBeforeLocking(self):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			origin = tmp / "origin"
+			makeGitRepo(origin, MONOREPO_FILES)
+			served = tmp / "served"
+			served.mkdir()
+			git("bundle", "create", "-q", str(served / "repo.bundle"), "--all", cwd=origin)
+
+			mirrors = MirrorsCache(tmp / "mirrors")
+			mirrorDir = mirrors.pathFor(MIRRORS_KIND, origin.as_uri())
+			lockedWhileServing = []
+
+			class Handler(QuietHandler):
+				def do_GET(self):
+					with mirrors.lock(mirrorDir, blocking=False) as acquired:
+						lockedWhileServing.append(not acquired)
+					super().do_GET()
+
+			with ServedDir(served, Handler) as baseURI:
+				fetchUsingGit(origin.as_uri(), tmp / "out", mirrors=mirrors, bundle=baseURI + "repo.bundle")
+
+			self.assertEqual(lockedWhileServing, [False])
+			self.assertTrue(git("for-each-ref", MIRROR_REFS_PREFIX + "bundle/", cwd=mirrorDir))
+			self.assertTrue((tmp / "out" / "a" / "pyproject.toml").is_file())
+
+
+class FetchSchedulerTests(unittest.TestCase):
+	def testTransientProcessErrors(self):
+		self.assertTrue(isTransientError(subprocess.CalledProcessError(128, ("git", "fetch"), stderr=b"fatal: unable to access 'https://example.org/': Could not resolve host: example.org")))
+		self.assertFalse(isTransientError(subprocess.CalledProcessError(128, ("git", "fetch"), stderr=b"fatal: couldn't find remote ref refs/heads/missing")))
+		self.assertFalse(isTransientError(subprocess.CalledProcessError(128, ("git", "fetch"))))  # not captured, the cause is unknown
+
+	def testGitFetchFailures(self):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			attempts = []
+
+			def fetch(uri: str, mirrorDir: Path, **kwargs):
+				attempts.append(uri)
+				return updateMirror(uri, mirrorDir, bundle="", **kwargs)
+
+			scheduler = FetchScheduler(retries=2, backoffBase=0.0)
+
+			with socket.socket() as s:  # nothing listens on it after it is closed
+				s.bind(("127.0.0.1", 0))
+				uri = "http://127.0.0.1:" + str(s.getsockname()[1]) + "/repo.git"
+			with self.assertRaises(Exception):
+				scheduler(uri, fetch, uri, tmp / "unreachable")
+			self.assertEqual(len(attempts), 3)
+
+			origin = tmp / "origin"
+			makeGitRepo(origin, MONOREPO_FILES)
+			attempts.clear()
+			with self.assertRaises(Exception):
+				scheduler(origin.as_uri(), fetch, origin.as_uri(), tmp / "missingRef", refSpec="missing")
+			self.assertEqual(len(attempts), 1)
+
+	def testNested(self):
+		scheduler = FetchScheduler(perHostConcurrency=1, retries=0)
+		self.assertEqual(scheduler("https://example.org/a.git", scheduler, "https://example.org/a.bundle", lambda: 1), 1)
+		self.assertTrue(scheduler.speculative("https://example.org/a.git", scheduler, "https://example.org/a.bundle", lambda: 1))
+		self.assertTrue(scheduler.speculative("https://example.org/a.git", lambda: None))  # the slot is released
+
+	def testRetries(self):
+		attempts = []
+
+		def failing(ex):
+			attempts.append(ex)
+			raise ex
+
+		scheduler = FetchScheduler(retries=2, backoffBase=0.0)
+		with self.assertRaises(ConnectionError):
+			scheduler(None, failing, ConnectionError())
+		self.assertEqual(len(attempts), 3)
+
+		attempts.clear()
+		with self.assertRaises(subprocess.CalledProcessError):
+			scheduler(None, failing, subprocess.CalledProcessError(1, ("git",)))
+		self.assertEqual(len(attempts), 1)
+
+
+class SessionTests(unittest.TestCase):
+	def _lock(self) -> Lock:
+		return Lock((LockedPackage("a", DepsKindID.pkgs, ("default",), SourceFetcher(Source.git, "https://example.org/a.git"), "0" * 40),))
+
+	def testUnfinishedIsKept(self):
+		with TemporaryDirectory() as tmp:
+			dir = Path(tmp) / "session"
+			InstallSession.create(dir, self._lock()).close()
+
+			with self.assertRaises(UnfinishedSessionError):
+				InstallSession.create(dir, self._lock())
+			self.assertTrue(InstallSession.exists(dir))
+
+			session = InstallSession.create(dir, self._lock(), discard=True)
+			session.finish()
+			self.assertFalse(dir.exists())
+
+	def testNotASession(self):
+		with TemporaryDirectory() as tmp:
+			dir = Path(tmp) / "notASession"
+			dir.mkdir()
+			(dir / "precious").write_text("")
+			for discard in (False, True):
+				with self.assertRaises(ValueError):
+					InstallSession.create(dir, self._lock(), discard=discard)
+			self.assertTrue((dir / "precious").is_file())
+
+	def testBusy(self):
+		with TemporaryDirectory() as tmp:
+			dir = Path(tmp) / "session"
+			session = InstallSession.create(dir, self._lock())
+			session.markInstalled("a")
+			with self.assertRaises(SessionBusyError):
+				InstallSession.load(dir)
+			with self.assertRaises(SessionBusyError):
+				InstallSession.create(dir, self._lock(), discard=True)
+			session.close()
+
+			resumed = InstallSession.load(dir)
+			self.assertEqual(resumed.stage("a"), SessionStage.installed)
+			resumed.close()
+
+	def testResumeWithoutSession(self):
+		with TemporaryDirectory() as tmp:
+			with self.assertRaises(ValueError):
+				InstallSession.load(Path(tmp) / "session")
+
+			for dryRun in (True, False):
+				with self.assertRaises(SystemExit) as cm:
+					_installImpl((), False, False, dryRun=dryRun, resume=True, sessionDir=Path(tmp) / "session")
+				self.assertEqual(cm.exception.code, 1)
+
+	def testTarget(self):
+		with TemporaryDirectory() as tmp:
+			dir = Path(tmp) / "session"
+			InstallSession.create(dir, self._lock(), target="/elsewhere/venv").close()
+
+			with self.assertRaises(WrongTargetError):
+				InstallSession.load(dir)
+			for dryRun in (True, False):
+				with self.assertRaises(SystemExit) as cm:
+					_installImpl((), False, False, dryRun=dryRun, resume=True, sessionDir=dir)
+				self.assertEqual(cm.exception.code, 1)
+
+			resumed = InstallSession.load(dir, target="/elsewhere/venv")
+			self.assertEqual(resumed.target, "/elsewhere/venv")
+			resumed.finish()
+
+			InstallSession.create(dir, self._lock()).close()
+			resumed = InstallSession.load(dir)
+			self.assertEqual(resumed.target, currentTarget())
+			resumed.finish()
+
+	def testDefaultDirPerTarget(self):
+		a = getDefaultSessionDir("/home/user/venvs/a")
+		self.assertIsNotNone(a)
+		self.assertNotEqual(a, getDefaultSessionDir("/home/user/venvs/b"))
+		self.assertNotEqual(a, getDefaultSessionDir("/home/user/venvs_a"))
+		self.assertEqual(a, getDefaultSessionDir("/home/user/venvs/a"))
+		self.assertEqual(getDefaultSessionDir(), getDefaultSessionDir(currentTarget()))
+		self.assertEqual(a.parent, getDefaultSessionDir().parent)
+
+
+class FakeRegistry:
+	"""Looks up the packages among the fetchers given"""
+
+	__slots__ = ("fetchers",)
+
+	def __init__(self, fetchers: typing.Mapping[str, SourceFetcher]):
+		self.fetchers = fetchers
+
+	def lookup(self, name: str):
+		return types.SimpleNamespace(pkg=types.SimpleNamespace(fetcher=self.fetchers[name]))
+
+
+class DeepeningTests(unittest.TestCase):
+	def _origin(self, tmp: Path, commitsAfterTag: int = 20, tagged: bool = True) -> typing.Tuple[str, str]:
+		"""A repo the tag of which is `commitsAfterTag` commits back from `HEAD`, returns its URI and the hash of `HEAD`"""
+
+		origin = tmp / "origin"
+		makeGitRepo(origin, MONOREPO_FILES)
+		git("config", "uploadpack.allowFilter", "true", cwd=origin)
+		if tagged:
+			git("tag", "v1", cwd=origin)
+		for i in range(commitsAfterTag):
+			head = commitFiles(origin, {"counter.txt": str(i)})
+		return origin.as_uri(), head
+
+	def _assertDescribed(self, repoDir: Path):
+		self.assertEqual(git("describe", "--tags", "--abbrev=0", cwd=repoDir), "v1")
+
+	def testDirectClone(self):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			uri, head = self._origin(tmp)
+			clone = tmp / "clone"
+			self.assertEqual(gitModule.cloneUsingGit(uri, clone, depth=1), head)
+			self.assertTrue(gitModule.isShallowUsingGit(clone))
+			self.assertFalse(gitModule.isTagReachableUsingGit(clone, head))
+
+			self.assertTrue(gitModule.deepenUsingGit(uri, clone, head))
+			self._assertDescribed(clone)
+
+	def testMirrorWorktree(self):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			uri, head = self._origin(tmp)
+			mirrors = MirrorsCache(tmp / "mirrors")
+			out = tmp / "out"
+			self.assertEqual(fetchUsingGit(uri, out, mirrors=mirrors, bundle=""), head)
+			mirrorDir = mirrors.pathFor(MIRRORS_KIND, uri)
+			self.assertTrue((mirrorDir / "shallow").is_file())
+			self.assertFalse(gitModule.isTagReachableUsingGit(out, head))
+
+			self.assertTrue(gitModule.deepenUsingGit(uri, out, head, mirrors=mirrors))
+			self._assertDescribed(out)
+
+			refs = git("for-each-ref", "--format=%(refname)", cwd=mirrorDir).splitlines()
+			self.assertIn("refs/tags/v1", refs)  # auto-followed while deepening the blobless mirror
+			self.assertEqual([r for r in refs if not r.startswith((MIRROR_REFS_PREFIX, "refs/tags/"))], [])
+			self.assertEqual(git("config", "remote.origin.partialclonefilter", cwd=mirrorDir), gitModule.MIRROR_FILTER)
+
+	def _deepenRecordingFetches(self, uri: str, clone: Path, head: str) -> typing.Tuple[bool, typing.List[str]]:
+		fetches = []
+		gitFetch = gitModule.gitFetch
+
+		def recordingFetch(*args, **kwargs):
+			fetches.append(str(args[0]))
+			return gitFetch(*args, **kwargs)
+
+		with unittest.mock.patch.object(gitModule, "DEEPEN_MAX_DEPTH", gitModule.DEEPEN_INITIAL_STEP), unittest.mock.patch.object(gitModule, "gitFetch", recordingFetch):
+			found = gitModule.deepenUsingGit(uri, clone, head)
+		return found, fetches
+
+	def testUnshallowAtMaxDepth(self):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			uri, head = self._origin(tmp, commitsAfterTag=40)
+			clone = tmp / "clone"
+			gitModule.cloneUsingGit(uri, clone, depth=1)
+
+			found, fetches = self._deepenRecordingFetches(uri, clone, head)
+			self.assertTrue(found)
+			self.assertEqual(fetches, ["--deepen=" + str(gitModule.DEEPEN_INITIAL_STEP), "--unshallow"])
+			self.assertFalse(gitModule.isShallowUsingGit(clone))
+			self._assertDescribed(clone)
+
+	def testNoTags(self):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			uri, head = self._origin(tmp, commitsAfterTag=40, tagged=False)
+			clone = tmp / "clone"
+			gitModule.cloneUsingGit(uri, clone, depth=1)
+
+			found, fetches = self._deepenRecordingFetches(uri, clone, head)
+			self.assertFalse(found)
+			self.assertEqual(fetches[-1], "--unshallow")
+			self.assertFalse(gitModule.isShallowUsingGit(clone))
+
+	def testSharedCheckoutDeepenedOnce(self):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			uri, head = self._origin(tmp)
+			clone = tmp / "clone"
+			gitModule.cloneUsingGit(uri, clone, depth=1)
+
+			fetchers = {name: SourceFetcher(Source.git, uri, subDir=name) for name in ("a", "b")}
+			repoDirs = {name: clone for name in fetchers}
+			directURLs = {name: f.toDirectURL(head) for name, f in fetchers.items()}
+			directURLs["unrelated"] = SourceFetcher(Source.git, uri).toDirectURL(head)
+			self.assertEqual(len(historyDeepeningTasks(repoDirs, fetchers, FakeRegistry(fetchers), directURLs)), 1)
+
+			deepenPackagesHistories(repoDirs, fetchers, FakeRegistry(fetchers), directURLs)
+			self._assertDescribed(clone)
+
+
+class EstimateTests(unittest.TestCase):
+	def testBlobless(self):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			origin = tmp / "origin"
+			makeGitRepo(origin, dict(MONOREPO_FILES, **{"a/a/data.bin": "x" * 100000, "b/b.py": "b = 1\n"}))
+			git("config", "uploadpack.allowFilter", "true", cwd=origin)
+			mirrors = MirrorsCache(tmp / "mirrors")
+
+			revision = fetchMetadataUsingGit(origin.as_uri(), tmp / "out", subDir="a", mirrors=mirrors)
+			filesCount, toDownloadCount, toDownloadSize = estimateCheckoutUsingGit(origin.as_uri(), tmp / "out", revision, subDir="a", mirrors=mirrors)
+
+		self.assertEqual((filesCount, toDownloadCount), (3, 2))  # only `pyproject.toml` has been fetched
+		self.assertGreater(toDownloadSize, 0)
+
+
+class LockTests(unittest.TestCase):
+	def _lock(self) -> Lock:
+		return Lock(
+			(
+				LockedPackage("b", DepsKindID.build, ("default",), SourceFetcher(Source.git, "https://example.org/mono.git", "b", "main", bundle="https://example.org/mono.bundle"), "0" * 40),
+				LockedPackage("a", DepsKindID.pkgs, ("default",), SourceFetcher(Source.git, "https://example.org/mono.git", "a", "main"), "0" * 40, deps=("c",), buildDeps=("b",), tagsNeeded=True),
+				LockedPackage("c", DepsKindID.pkgs, ("other", "default"), SourceFetcher(Source.archive, "https://example.org/c.tar.gz"), None),
+			)
+		)
+
+	def testRoundTrip(self):
+		lock = self._lock()
+		with TemporaryDirectory() as tmp:
+			path = Path(tmp) / "ipi.lock.json"
+			lock.save(path)
+			loaded = Lock.load(path)
+
+		self.assertEqual(loaded.toJSON(), lock.toJSON())
+		self.assertEqual([p.name for p in loaded.packages], ["b", "a", "c"])  # the order of installation
+
+		a = loaded.packages[1]
+		self.assertEqual((a.kind, a.fetcher.type, a.fetcher.subDir, a.fetcher.refSpec, a.revision, a.deps, a.buildDeps, a.tagsNeeded), (DepsKindID.pkgs, Source.git, "a", "main", "0" * 40, ("c",), ("b",), True))
+		self.assertEqual(loaded.packages[0].fetcher.bundle, "https://example.org/mono.bundle")
+		self.assertEqual(loaded.packages[2].regPath, ("other", "default"))
+		self.assertEqual(loaded.depsHints(), {"b": (), "a": ("b", "c"), "c": ()})
+
+	def testOptionalFieldsOmitted(self):
+		c = self._lock().packages[2].toJSON()
+		self.assertFalse({"subDir", "refSpec", "bundle", "tagsNeeded"} & set(c))
+
+	def testUnsupportedVersion(self):
+		d = self._lock().toJSON()
+		d["version"] = LOCK_FORMAT_VERSION + 1
+		with self.assertRaises(ValueError):
+			Lock.fromJSON(d)
+
+
+@unittest.skipIf(Requirement is None, "`packaging` is needed to evaluate markers")
+class TargetEnvironmentTests(unittest.TestCase):
+	MARKERS = {
+		"implementation_name": "cpython",
+		"implementation_version": "3.8.10",
+		"os_name": "nt",
+		"platform_machine": "AMD64",
+		"platform_release": "10",
+		"platform_system": "Windows",
+		"platform_version": "10.0.19041",
+		"python_full_version": "3.8.10",
+		"platform_python_implementation": "CPython",
+		"python_version": "3.8",
+		"sys_platform": "win32",
+	}
+
+	def testMarkers(self):
+		te = TargetEnvironment(self.MARKERS)
+		self.assertTrue(te.isApplicable(Requirement("a")))
+		self.assertTrue(te.isApplicable(Requirement("colorama; sys_platform == 'win32'")))
+		self.assertFalse(te.isApplicable(Requirement("uvloop; sys_platform != 'win32'")))
+		self.assertTrue(te.isApplicable(Requirement("importlib-metadata; python_version < '3.10'")))
+		self.assertFalse(te.isApplicable(Requirement("tomli; python_version >= '3.11' and os_name == 'nt'")))
+
+	def testExtras(self):
+		te = TargetEnvironment(self.MARKERS)
+		req = Requirement("pysocks; extra == 'socks'")
+		self.assertFalse(te.isApplicable(req))
+		self.assertTrue(te.isApplicable(req, ("socks",)))
+		self.assertTrue(te.isApplicable(req, ("http2", "socks")))
+		self.assertFalse(te.isApplicable(Requirement("pywin32; extra == 'win' and sys_platform != 'win32'"), ("win",)))
+
+	def testNoMarkersKnown(self):
+		self.assertTrue(TargetEnvironment({}).isApplicable(Requirement("uvloop; sys_platform != 'win32'")))  # nothing can be evaluated
+
+	def testInterpreter(self):
+		self.assertEqual(TargetEnvironment.fromInterpreter(sys.executable).markers, default_environment())
+
+	def testCanonicalizeExtraName(self):
+		self.assertEqual(canonicalizeExtraName("Foo_Bar.baz--Qux"), "foo-bar-baz-qux")
+
+
+@unittest.skipIf(Requirement is None, "`packaging` is needed to intersect specifiers")
+class ConflictsTests(unittest.TestCase):
+	def _conflicts(self, *reqs: str, installedVersion: typing.Optional[str] = None) -> list:
+		return findConflicts({"x": [(None if i == 0 else "dependent" + str(i), Requirement("x" + r)) for i, r in enumerate(reqs)]}, {"x": Version(installedVersion)} if installedVersion else None)
+
+	def testSatisfiable(self):
+		self.assertEqual(self._conflicts(">=1.0", "<2", "!=1.5", "~=1.2"), [])
+		self.assertEqual(self._conflicts("==1.*", ">=1.9"), [])
+		self.assertEqual(self._conflicts(">=1.0", "<=1.0"), [])
+		self.assertEqual(self._conflicts("", ""), [])
+
+	def testDisjointRanges(self):
+		conflicts = self._conflicts(">=2", "<1.5", ">=1")
+		self.assertEqual(len(conflicts), 1)
+		self.assertEqual([str(req) for _, req in conflicts[0].constraints], ["x>=2", "x<1.5"])  # only the ones that clash
+
+	def testExclusiveBounds(self):
+		self.assertEqual(len(self._conflicts(">1.0", "<=1.0")), 1)
+		self.assertEqual(len(self._conflicts("~=1.4", "==2.*")), 1)
+
+	def testExcludedPin(self):
+		conflicts = self._conflicts("==1.0", "!=1.0")
+		self.assertEqual(len(conflicts), 1)
+		self.assertIn("excluded", conflicts[0].reason)
+
+	def testArbitraryEquality(self):
+		self.assertEqual(len(self._conflicts("===1.0-custom", "===1.0-other")), 1)
+		self.assertEqual(self._conflicts("===1.0-custom", "===1.0-custom"), [])
+
+	def testInstalledVersion(self):
+		self.assertEqual(len(self._conflicts(">=2", installedVersion="1.9")), 1)
+		self.assertEqual(self._conflicts(">=1", installedVersion="1.9"), [])
+
+	def testCheckConflicts(self):
+		fetcher = PackageFetcher(None)
+		try:
+			for name, reqs in (("x", ("x>=2", "x<1")), ("y", ("y>=1",))):
+				node = fetcher.graph.add(ResolutionNode(name, ResolutionNodeState.resolved))
+				node.constraints.extend(("dependent", Requirement(r)) for r in reqs)
+
+			with self.assertRaises(DependencyConflictsError) as cm:
+				fetcher.checkConflicts()
+			self.assertEqual([c.name for c in cm.exception.args[1]], ["x"])
+		finally:
+			fetcher.clean()
+
+
+class WheelCacheTests(unittest.TestCase):
+	def testKey(self):
+		key = wheelCacheKey("0" * 40, ("setuptools.build_meta", None), {"setuptools": "69.0.0", "wheel": "0.42.0"})
+		self.assertEqual(key, wheelCacheKey("0" * 40, ["setuptools.build_meta", None], {"wheel": "0.42.0", "setuptools": "69.0.0"}))  # the order of the deps doesn't matter
+		self.assertEqual(len(key), 64)
+
+		for other in (
+			wheelCacheKey("1" * 40, ("setuptools.build_meta", None), {"setuptools": "69.0.0", "wheel": "0.42.0"}),
+			wheelCacheKey("0" * 40, ("flit_core.buildapi", None), {"setuptools": "69.0.0", "wheel": "0.42.0"}),
+			wheelCacheKey("0" * 40, ("setuptools.build_meta", "backend"), {"setuptools": "69.0.0", "wheel": "0.42.0"}),
+			wheelCacheKey("0" * 40, ("setuptools.build_meta", None), {"setuptools": "69.0.1", "wheel": "0.42.0"}),
+			wheelCacheKey("0" * 40, ("setuptools.build_meta", None), {"setuptools": "69.0.0"}),
+		):
+			self.assertNotEqual(key, other)
+
+	def _wheel(self, dir: Path, name: str) -> Path:
+		res = dir / name
+		res.write_bytes(b"wheel " + name.encode("utf-8"))
+		return res
+
+	def testBuckets(self):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			cache = WheelCache(tmp / "cache")
+			self.assertIsNone(cache.get("a" * 64))
+
+			pure = cache.put("a" * 64, self._wheel(tmp, "a-1.0-py3-none-any.whl"))
+			self.assertEqual(pure.relative_to(cache.path).parts[0], PURE_BUCKET)
+			self.assertEqual(cache.get("a" * 64), pure)
+
+			platformSpecific = cache.put("b" * 64, self._wheel(tmp, "b-1.0-" + interpreterTag() + ".whl"))
+			self.assertEqual(platformSpecific.relative_to(cache.path).parts[0], interpreterTag())
+			self.assertEqual(cache.get("b" * 64), platformSpecific)
+
+			self.assertEqual(cache.put("a" * 64, self._wheel(tmp, "a-1.0-py3-none-any.whl")), pure)  # already cached
+
+	def testConcurrentPuts(self):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			cache = WheelCache(tmp / "cache")
+			key = "c" * 64
+			wheels = [self._wheel(tmp, "c-1.0-py3-none-any.whl")] * 16
+			results = []
+			threads = [threading.Thread(target=lambda w=w: results.append(cache.put(key, w))) for w in wheels]
+			for t in threads:
+				t.start()
+			for t in threads:
+				t.join()
+
+			self.assertEqual(len(set(results)), 1)
+			self.assertEqual(results[0].read_bytes(), wheels[0].read_bytes())
+			self.assertEqual([p.name for p in results[0].parent.parent.iterdir()], [key])  # no temporary dirs left
+
+	def testFailedPutLeavesNothing(self):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			cache = WheelCache(tmp / "cache")
+			with self.assertRaises(OSError):
+				cache.put("d" * 64, tmp / "d-1.0-py3-none-any.whl")  # missing, the copy fails
+
+			self.assertIsNone(cache.get("d" * 64))
+			self.assertEqual(list((cache.path / PURE_BUCKET / "dd").iterdir()), [])
+
+	def testFailedRenameRaises(self):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			cache = WheelCache(tmp / "cache")
+			key = "e" * 64
+			other = cache.put(key, self._wheel(tmp, "other-1.0-py3-none-any.whl"))  # the entry dir exists, but has no such wheel
+
+			with self.assertRaises(OSError):
+				cache.put(key, self._wheel(tmp, "e-1.0-py3-none-any.whl"))
+
+			self.assertEqual(cache.get(key), other)
+			self.assertEqual([p.name for p in other.parent.parent.iterdir()], [key])  # no temporary dirs left
+
+
+def makeWheel(dir: Path, name: str, version: str = "1.0") -> Path:
+	"""A minimal pure wheel with an empty package"""
+
+	res = dir / (name + "-" + version + "-py3-none-any.whl")
+	distInfo = name + "-" + version + ".dist-info/"
+	files = {
+		name + "/__init__.py": "",
+		distInfo + "METADATA": "Metadata-Version: 2.1\nName: " + name + "\nVersion: " + version + "\n",
+		distInfo + "WHEEL": "Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+	}
+	with zipfile.ZipFile(res, "w") as z:
+		for k, v in files.items():
+			z.writestr(k, v)
+		z.writestr(distInfo + "RECORD", "".join(k + ",,\n" for k in files) + distInfo + "RECORD,,\n")
+	return res
+
+
+class PipInstallerTests(unittest.TestCase):
+	def testDirectURLRecorded(self):
+		directURL = {"url": "https://example.org/a.git", "vcs_info": {"vcs": "git", "commit_id": "0" * 40}}
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			root = tmp / "root"
+			install.PipCLIInstaller()((makeWheel(tmp, "ipi_test_pkg"),), install.directURLInstallConfig(directURL, {"destDir": str(root)}))
+
+			dist = InstalledDistributionsIndex(root / d.relative_to(d.anchor) for d in genSearchPath()).get("ipi_test_pkg")
+			self.assertIsNotNone(dist)
+			self.assertEqual(json.loads(dist.read_text(install.DIRECT_URL_FILE_NAME)), directURL)
+
+			records = [l.split(",") for l in dist.read_text("RECORD").splitlines() if l.split(",")[0].endswith("/" + install.DIRECT_URL_FILE_NAME)]
+			self.assertEqual(len(records), 1)
+			content = (dist.path / install.DIRECT_URL_FILE_NAME).read_bytes()
+			self.assertEqual(records[0][1:], ["sha256=" + base64.urlsafe_b64encode(hashlib.sha256(content).digest()).rstrip(b"=").decode("ascii"), str(len(content))])
+
+	def testNotFound(self):
+		with TemporaryDirectory() as tmp:
+			with self.assertWarns(UserWarning):
+				self.assertFalse(install.writeAdditionalMetadata("ipi_test_missing", {install.DIRECT_URL_FILE_NAME: b"{}"}, Path(tmp)))
+
+
+FAKE_BACKEND = """
+import os, zipfile
+
+def build_wheel(wheel_directory, config_settings=None, metadata_directory=None):
+	import helper  # a module of the package being built
+
+	fileName = helper.NAME + "-1.0-py3-none-any.whl"
+	with zipfile.ZipFile(os.path.join(wheel_directory, fileName), "w") as z:
+		z.writestr(helper.NAME + "/__init__.py", "")
+	return fileName
+"""
+
+
+class BuildWorkersTests(unittest.TestCase):
+	def testFrames(self):
+		f = io.BytesIO()
+		frames = [{"pkg": "/a", "outDir": "/b", "backend": "setuptools.build_meta"}, {"modules": ["ünicode"]}, None, []]
+		for frame in frames:
+			writeFrame(f, frame)
+
+		f.seek(0)
+		self.assertEqual([readFrame(f) for _ in frames], frames)
+		self.assertIsNone(readFrame(f))  # EOF
+
+	def testTruncatedFrames(self):
+		data = io.BytesIO()
+		writeFrame(data, {"wheel": "a-1.0-py3-none-any.whl"})
+		data = data.getvalue()
+
+		self.assertIsNone(readFrame(io.BytesIO(data[: FRAME_HEADER.size - 1])))
+		self.assertIsNone(readFrame(io.BytesIO(data[:-1])))
+
+	def testPackagesModulesAreNotReused(self):
+		with TemporaryDirectory() as tmp:
+			tmp = Path(tmp)
+			backendDir = tmp / "backend"
+			backendDir.mkdir()
+			(backendDir / "fakeBackend.py").write_text(FAKE_BACKEND)
+
+			workers = BuildWorkers()
+			try:
+				wheels = []
+				for name in ("first", "second"):
+					packageDir = tmp / name
+					packageDir.mkdir()
+					(packageDir / "helper.py").write_text("NAME = " + repr(name) + "\n")
+					wheels.append(workers.build(packageDir, tmp / "out", "fakeBackend", pythonPath=[backendDir, Path(__file__).parent.parent]).name)
+
+				self.assertEqual(wheels, ["first-1.0-py3-none-any.whl", "second-1.0-py3-none-any.whl"])
+				(worker,) = [w for ws in workers.idle.values() for w in ws]
+				self.assertEqual(worker.buildsCount, 2)  # both built by the same process
+				self.assertNotIn("helper", worker.modules)
+			finally:
+				workers.close()
+
+
 if __name__ == "__main__":
 	unittest.main()